@@ -0,0 +1,33 @@
+import os
+
+from flask import Flask
+from flask_cors import CORS
+from flask_restful import Api
+
+from api.compression import Compression
+from api.resources import Dataset, DatasetList, DatasetImport
+from interface.service import DatasetsService
+
+
+def create_app(datasets_service: DatasetsService) -> Flask:
+    app = Flask(__name__)
+    CORS(app, resources={
+        r'/api/*': {
+            'origins': '*'
+        }
+    })
+    Compression(
+        app,
+        min_size=int(os.environ.get('COMPRESSION_MIN_SIZE', '1024')),
+        level=int(os.environ.get('COMPRESSION_LEVEL', '6'))
+    )
+    api = Api(app, prefix='/api/v1/')
+
+    api.add_resource(Dataset, '/datasets/<dataset_id>', resource_class_kwargs={'datasets_service': datasets_service})
+    api.add_resource(DatasetList, '/datasets', resource_class_kwargs={'datasets_service': datasets_service})
+    api.add_resource(DatasetImport, '/datasets/import', '/datasets/<dataset_id>/documents', resource_class_kwargs={
+        'datasets_service': datasets_service,
+        'chunk_size': int(os.environ.get('IMPORT_CHUNK_SIZE', str(DatasetImport.DEFAULT_CHUNK_SIZE)))
+    })
+
+    return app
@@ -0,0 +1,128 @@
+import zlib
+from typing import Iterable, Iterator, Optional, Dict, Callable, Union
+
+from flask import Flask, Response, request
+
+from api.etags import with_coding
+
+try:
+    # part of the standard library since python 3.14
+    from compression import zstd
+except ImportError:
+    zstd = None
+
+
+class _ZlibEncoder:
+    def __init__(self, level: int, wbits: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush_block(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _ZstdEncoder:
+    def __init__(self, level: int):
+        self._compressor = zstd.ZstdCompressor(level=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush_block(self) -> bytes:
+        return self._compressor.flush(zstd.ZstdCompressor.FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zstd.ZstdCompressor.FLUSH_FRAME)
+
+
+Encoder = Union[_ZlibEncoder, _ZstdEncoder]
+
+# content codings by preference of the server, if a client accepts several with the same quality
+ENCODERS: Dict[str, Callable[[int], Encoder]] = {
+    'gzip': lambda level: _ZlibEncoder(level, 16 + zlib.MAX_WBITS),
+    'deflate': lambda level: _ZlibEncoder(level, zlib.MAX_WBITS),
+}
+if zstd is not None:
+    ENCODERS = {'zstd': _ZstdEncoder, **ENCODERS}
+
+
+class Compression:
+    """
+    Compresses responses with the best content coding the client accepts. Bodies smaller than
+    ``min_size`` bytes are sent as they are, bodies larger than ``stream_size`` bytes and
+    streamed responses are compressed while they are sent, one block per chunk of the body.
+    """
+
+    # size of the chunks of uncompressed data, that large bodies are sent in
+    BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, app: Optional[Flask] = None, min_size: int = 1024, level: int = 6,
+                 stream_size: int = 1024 * 1024):
+        self.min_size = min_size
+        self.level = level
+        self.stream_size = stream_size
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        app.after_request(self.compress)
+
+    def compress(self, response: Response) -> Response:
+        if response.status_code == 304:
+            # nothing to compress, but caches have to know the representation it validates varies by coding
+            response.vary.add('Accept-Encoding')
+            return response
+        if response.status_code < 200 or response.status_code in (204, 206):
+            return response
+        if 'Content-Encoding' in response.headers or response.direct_passthrough:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        coding = request.accept_encodings.best_match(list(ENCODERS.keys()))
+        if coding is None:
+            return response
+
+        if not response.is_streamed:
+            body = response.get_data()
+            if len(body) < self.min_size:
+                return response
+            if len(body) <= self.stream_size:
+                encoder = ENCODERS[coding](self.level)
+                response.set_data(encoder.compress(body) + encoder.finish())
+            else:
+                chunks = (body[i:i + self.BLOCK_SIZE] for i in range(0, len(body), self.BLOCK_SIZE))
+                self._stream(response, chunks, coding)
+        else:
+            self._stream(response, response.response, coding)
+
+        response.headers['Content-Encoding'] = coding
+        etag, weak = response.get_etag()
+        if etag is not None:
+            # each content coding is a different representation, which needs its own entity tag
+            response.set_etag(with_coding(etag, coding), weak)
+        return response
+
+    def _stream(self, response: Response, chunks: Iterable[Union[str, bytes]], coding: str) -> None:
+        response.response = self._compress_chunks(chunks, ENCODERS[coding](self.level), response.charset)
+        response.headers.pop('Content-Length', None)
+
+    def _compress_chunks(self, chunks: Iterable[Union[str, bytes]], encoder: Encoder,
+                         charset: str) -> Iterator[bytes]:
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode(charset)
+                if not chunk:
+                    continue
+                # send every chunk as soon as it is produced, e.g. each line of a listing or of import progress,
+                # instead of holding it back in the compressor until enough data followed
+                yield encoder.compress(chunk) + encoder.flush_block()
+            yield encoder.finish()
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
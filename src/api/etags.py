@@ -0,0 +1,63 @@
+import hashlib
+import json
+from typing import Optional, Any
+
+from werkzeug.datastructures import ETags
+
+# separates the content coding of a compressed representation from its entity tag
+CODING_SEPARATOR = '+'
+
+
+def dataset_etag(dataset_id: str, version: int, *representation: Any) -> str:
+    """
+    Builds a strong entity tag for a representation of a dataset. A dataset's content only changes
+    with its version, and so does every representation of it, given the same parameters.
+
+    :param representation: everything else the representation depends on, e.g. split parameters
+    """
+    digest = hashlib.sha1(json.dumps(representation).encode('utf-8')).hexdigest()[:16]
+    return f'{dataset_id}-{version}-{digest}'
+
+
+def with_coding(etag: str, coding: str) -> str:
+    return f'{etag}{CODING_SEPARATOR}{coding}'
+
+
+def _without_coding(etag: str) -> str:
+    return etag.split(CODING_SEPARATOR, 1)[0]
+
+
+def matching_etag(etags: ETags, etag: str) -> Optional[str]:
+    """
+    Finds the entity tag of the given representation in the given ones, in any content coding,
+    e.g. for If-None-Match.
+
+    :return: the matching tag as given by the client, None if none matches
+    """
+    for candidate in etags:
+        if _without_coding(candidate) == etag:
+            return candidate
+    return None
+
+
+def is_current(etags: ETags, dataset_id: str, version: Optional[int]) -> bool:
+    """
+    Checks, if any of the given entity tags belongs to a representation of the current version
+    of a dataset, regardless of the parameters of that representation, e.g. for If-Match.
+    """
+    if version is None:
+        return False
+    if etags.star_tag:
+        return True
+    # iterating entity tags only yields the strong ones
+    return any(_version_of(_without_coding(etag), dataset_id) == version for etag in etags)
+
+
+def _version_of(etag: str, dataset_id: str) -> Optional[int]:
+    parts = etag.split('-')
+    if len(parts) != 3 or parts[0] != dataset_id:
+        return None
+    try:
+        return int(parts[1])
+    except ValueError:
+        return None
@@ -0,0 +1,126 @@
+import json
+from typing import Iterable, Iterator, Dict, Any, Optional, List
+
+from eventsourcing.persistence import RecordConflictError
+from marshmallow import ValidationError
+from marshmallow.validate import URL
+
+from api.schemas import DatasetImportSchema
+from application.datasets import DocumentImport, RegistrationConflict
+from domain.registry import DocumentIdCollision
+from interface.service import DatasetsService
+
+
+class DatasetImporter:
+    """
+    Imports datasets from NDJSON lines. A line with a ``name`` creates a new dataset (with optional
+    ``description`` and ``mappings``), a line ``{"document": <url>, "test": <bool>}`` adds a document
+    to the dataset created last, or to the given one. Documents are appended ``chunk_size`` at a
+    time, one event per chunk, so memory doesn't grow with the number of imported documents.
+
+    Running the import yields a progress report after every chunk, a report per line that was
+    skipped as invalid, and the final counts last. Progress reports count the documents, that
+    were actually added so far, i.e. not those already part of their dataset.
+    """
+
+    def __init__(self, datasets_service: DatasetsService, chunk_size: int, dataset_id: Optional[str] = None):
+        self._datasets_service = datasets_service
+        # documents of a single existing dataset can't be mixed with new datasets
+        self._creates_datasets = dataset_id is None
+        self._chunk_size = chunk_size
+        self._dataset_id = dataset_id
+        self._import: Optional[DocumentImport] = None
+        self._train_documents: List[str] = []
+        self._test_documents: List[str] = []
+        self._num_datasets = 0
+        self._num_train_documents = 0
+        self._num_test_documents = 0
+        self._num_rejected = 0
+
+    def run(self, lines: Iterable[bytes]) -> Iterator[Dict[str, Any]]:
+        try:
+            yield from self._run(lines)
+        # chunks imported so far are kept, the client has to resume after the last reported progress
+        except RecordConflictError:
+            yield {'error': 'Dataset was changed during the import.'}
+        except RegistrationConflict:
+            yield {'error': 'Documents were registered by too many concurrent requests.'}
+        except DocumentIdCollision as e:
+            yield {'error': str(e)}
+
+    def _run(self, lines: Iterable[bytes]) -> Iterator[Dict[str, Any]]:
+        dataset_schema = DatasetImportSchema()
+        # document lines are validated without a schema, which would take most of the time of an import
+        validate_url = URL()
+
+        for line_number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+                if not isinstance(item, dict):
+                    raise ValidationError('Expected a JSON object.')
+                if 'name' in item and self._creates_datasets:
+                    params = dataset_schema.load(item, unknown='EXCLUDE')
+                    yield from self._finish_dataset()
+                    yield self._create_dataset(params)
+                    continue
+                document, test = validate_url(item.get('document')), item.get('test', False)
+                if not isinstance(test, bool):
+                    raise ValidationError('Not a valid boolean.', 'test')
+            except (ValueError, ValidationError) as e:
+                self._num_rejected += 1
+                messages = e.messages if isinstance(e, ValidationError) else str(e)
+                yield {'line': line_number, 'error': messages}
+                continue
+
+            if self._dataset_id is None:
+                self._num_rejected += 1
+                yield {'line': line_number, 'error': 'Expected a dataset before its documents.'}
+                continue
+
+            documents = self._test_documents if test else self._train_documents
+            documents.append(document)
+            if len(documents) >= self._chunk_size:
+                yield self._flush(test=test)
+
+        yield from self._finish_dataset()
+        yield {
+            'done': True,
+            'datasets': self._num_datasets,
+            'trainDocuments': self._num_train_documents,
+            'testDocuments': self._num_test_documents,
+            'rejected': self._num_rejected
+        }
+
+    def _create_dataset(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        dataset_id = self._datasets_service.create_dataset(params['name'], params['description'],
+                                                           mappings=params['mappings'])
+        self._dataset_id = dataset_id.hex
+        self._num_datasets += 1
+        return {'dataset': f'/datasets/{dataset_id}', 'created': True}
+
+    def _flush(self, test: bool) -> Dict[str, Any]:
+        if self._import is None:
+            self._import = self._datasets_service.import_documents(self._dataset_id)
+        if test:
+            self._num_test_documents += self._import.add_test_documents(self._test_documents)
+            self._test_documents = []
+        else:
+            self._num_train_documents += self._import.add_train_documents(self._train_documents)
+            self._train_documents = []
+        return {
+            'dataset': f'/datasets/{self._import.dataset_id}',
+            'trainDocuments': self._num_train_documents,
+            'testDocuments': self._num_test_documents
+        }
+
+    def _finish_dataset(self) -> Iterator[Dict[str, Any]]:
+        if self._train_documents:
+            yield self._flush(test=False)
+        if self._test_documents:
+            yield self._flush(test=True)
+        if self._import is not None:
+            self._import.finish()
+            self._import = None
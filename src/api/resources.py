@@ -1,18 +1,40 @@
-from collections import Counter
-from typing import Iterable, Any, Dict, List, Callable
+from functools import partial, wraps
+from typing import Any, Dict, List, Callable, Iterator, Optional
+from urllib.parse import urlencode
+from uuid import UUID
 
 from eventsourcing.application import AggregateNotFound
-from flask import request, jsonify
+from flask import request, jsonify, json, Response, stream_with_context
+from flask_hal.document import Document as HALDocument
 from flask_restful import abort, Resource
 from marshmallow import ValidationError
 
-from api.schemas import DatasetQuerySchema, DatasetPatchSchema, DatasetCreationSchema
-from domain.dataset import Dataset
+from api.etags import dataset_etag, is_current, matching_etag
+from api.imports import DatasetImporter
+from api.schemas import DatasetQuerySchema, DatasetPatchSchema, DatasetCreationSchema, DatasetListQuerySchema
+from application.datasets import DatasetChanged, DocumentNotRegistered, RegistrationConflict
+from domain.dataset import Dataset as DatasetAggregate
+from domain.mapping import Mapping
+from domain.registry import DocumentIdCollision
 from interface.service import DatasetsService
-from serializer import serialize_dataset
+from serializer import serialize_dataset, serialize_dataset_compact, serialize_dataset_summary
 from util import logwrapper
 
 
+# media type of dataset listings, that are streamed as one serialized dataset per line
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# media type of datasets, that list each document once and give folds as per-document fold numbers
+COMPACT_DATASET_MIMETYPE = 'application/vnd.gnuma.dataset.compact+json'
+
+
+def wants_compact_dataset(params: Dict[str, Any]) -> bool:
+    if 'representation' in params:
+        return params['representation'] == 'compact'
+    return request.accept_mimetypes.best_match(['application/json', COMPACT_DATASET_MIMETYPE]) == \
+        COMPACT_DATASET_MIMETYPE
+
+
 def abort_not_json():
     abort(400, message='Only accepting requests with mime type application/json.')
 
@@ -21,108 +43,104 @@ def abort_missing_parameter(parameter_name: str):
     abort(400, message=f'Expected "{parameter_name}" to be part of the request body.')
 
 
-def diff(a: Iterable, b: Iterable) -> Iterable:
+def handle_registry_errors(method: Callable) -> Callable:
     """
-    Calculates the asymmetric difference c between lists a and b,
-    so that a + c = b.
-
-    E.g.:
-    ```
-    > a = [1, 2, 3]
-    > b = [2, 3]
-    > c = diff(a, b)
-    > print(c)
-    [1]
-
-    > a = [1, 2, 3]
-    > b = [2, 3]
-    > c = diff(b, a)
-    > print(c)
-    []
-
-    > a = [1, 1, 1, 1]
-    > b = [2, 2, 2, 2]
-    > c = diff(a, b)
-    > print(c)
-    [1, 1, 1, 1]
-    ```
-
-    :param a: an iterable of hashable values
-    :param b: an iterable of hashable values
-    :return: the difference as iterable of differing values
+    Answers requests, that fail on the registry of documents, with an explicit status and message.
     """
-    a_counter = Counter(a)
-    b_counter = Counter(b)
-
-    difference = a_counter - b_counter
-
-    return list(difference.elements())
-
-
-def update_documents(dataset_id: str, new_documents: List[str], old_documents: List[str],
-                     add_func: Callable[[str, List[str]], None], remove_func: Callable[[str, List[str]], None]):
-    added_documents = list(diff(new_documents, old_documents))
-    removed_documents = list(diff(old_documents, new_documents))
-
-    add_func(dataset_id, added_documents)
-    remove_func(dataset_id, removed_documents)
-
-
-def patch_dataset(params: Dict[str, Any], dataset: Dataset, datasets_service: DatasetsService):
-    if 'train_data' in params:
-        old_documents = dataset.train_validate_documents
-        new_documents = params['train_data']
-        update_documents(dataset.id.hex, new_documents, old_documents,
-                         add_func=datasets_service.add_train_documents_to_dataset,
-                         remove_func=datasets_service.remove_train_documents_from_dataset)
-
-    if 'test_data' in params:
-        old_documents = dataset.test_documents
-        new_documents = params['test_data']
-        update_documents(dataset.id.hex, new_documents, old_documents,
-                         add_func=datasets_service.add_test_documents_to_dataset,
-                         remove_func=datasets_service.remove_test_documents_from_dataset)
-
-    if 'name' in params or 'description' in params:
-        name = params.get('name', None)
-        description = params.get('description', None)
-        datasets_service.update_meta(dataset.id.hex, name, description)
-
-    if 'mappings' in params:
-        mapping_ids = []
-        for mapping in params['mappings']:
-            mapping_id = datasets_service.create_mapping(mapping['name'], mapping['description'],
-                                                         mapping['aliases'], mapping['tasks'])
-            mapping_ids.append(str(mapping_id))
-        datasets_service.update_mappings(dataset.id.hex, mapping_ids)
+    @wraps(method)
+    def handle(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except DocumentNotRegistered as e:
+            logwrapper.error(f'{e} Register the documents of legacy events with "maintenance.py register-documents".')
+            return 'Documents of this dataset are not registered yet, try again after the service was migrated.', 503
+        except RegistrationConflict:
+            # the registry buckets are shared by all datasets, so concurrent requests may keep conflicting
+            return 'Documents were registered by too many concurrent requests, try again.', 503, {'Retry-After': '1'}
+        except DocumentIdCollision as e:
+            return str(e), 409
+    return handle
+
+
+def stream_lines(documents: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    try:
+        for document in documents:
+            yield json.dumps(document) + '\n'
+    except DocumentNotRegistered as e:
+        # the status was already sent, so end the stream with an error instead
+        logwrapper.error(f'{e} Register the documents of legacy events with "maintenance.py register-documents".')
+        yield json.dumps({'error': 'Documents of this dataset are not registered yet.'}) + '\n'
+
+
+def patch_dataset(params: Dict[str, Any], dataset_id: str, datasets_service: DatasetsService,
+                  expected_version: Optional[int] = None) -> DatasetAggregate:
+    return datasets_service.patch_dataset(
+        dataset_id, expected_version,
+        name=params.get('name'),
+        description=params.get('description'),
+        train_documents=params.get('train_data'),
+        test_documents=params.get('test_data'),
+        mappings=params.get('mappings')
+    )
 
 
 class Dataset(Resource):
+    method_decorators = [handle_registry_errors]
+
     def __init__(self, datasets_service: DatasetsService):
         logwrapper.info(f'Initializing API resource {self.__class__.__name__} '
                         f'with dataset service {hex(id(datasets_service))}')
         self._datasets_service = datasets_service
 
     def get(self, dataset_id):
-        dataset = self._datasets_service.get_dataset(dataset_id)
-        mappings = self._datasets_service.get_mappings_for_dataset(dataset)
-
         try:
             params = DatasetQuerySchema().load(request.args)
         except ValidationError as e:
             return e.messages, 400
 
+        split_params = (params.get('k_folds'), params.get('test_split'),
+                        params.get('validation_split'), params.get('seed'))
+        compact = wants_compact_dataset(params)
+
+        # unseeded test splits are random, so no two responses are the same
+        etag = None
+        if params.get('test_split') is None or params.get('seed') is not None:
+            version = self._datasets_service.get_dataset_version(dataset_id)
+            if version is not None:
+                etag = dataset_etag(UUID(dataset_id).hex, version, *split_params, compact)
+                client_etag = matching_etag(request.if_none_match, etag)
+                if client_etag is not None:
+                    # the client's copy is current, so don't even load the dataset
+                    response = Response(status=304)
+                    response.set_etag(client_etag)
+                    response.vary.add('Accept')
+                    return response
+
+        dataset = self._datasets_service.get_dataset(dataset_id)
+        mappings = self._datasets_service.get_mappings_for_dataset(dataset)
+
         if params.get('test_split') is not None and len(dataset.test_documents) > 0:
             return 'Got a test split ratio of document with predefined test set.', 400
 
         if params.get('validation_split') is not None and params.get('k_folds') is not None:
             return 'Both a validation and a k-fold split is requested, these are mutually exclusive.', 400
 
-        hal_document = serialize_dataset(dataset, mappings,
-                                         params.get('k_folds'), params.get('test_split'),
-                                         params.get('validation_split'), params.get('seed'))
-
-        return jsonify(hal_document.to_dict())
+        try:
+            split = self._datasets_service.split_dataset(dataset, *split_params)
+        except ValueError as e:
+            return str(e), 400
+        if compact:
+            response = jsonify(serialize_dataset_compact(dataset, mappings, self._datasets_service.get_document_urls,
+                                                         *split_params, split=split).to_dict())
+            response.mimetype = COMPACT_DATASET_MIMETYPE
+        else:
+            response = jsonify(serialize_dataset(dataset, mappings, self._datasets_service.get_document_urls,
+                                                 *split_params, split=split).to_dict())
+        if etag is not None:
+            # the dataset may have changed since we looked up its version, so tag what we actually serialized
+            response.set_etag(dataset_etag(dataset.id.hex, dataset.version, *split_params, compact))
+        response.vary.add('Accept')
+        return response
 
     def patch(self, dataset_id):
         if not request.is_json:
@@ -138,14 +156,26 @@ class Dataset(Resource):
         except AggregateNotFound:
             return f'No dataset with id {dataset_id}', 400
 
-        patch_dataset(params, dataset, self._datasets_service)
+        # optimistic concurrency: only change the dataset, if the client knows its current version
+        expected_version = None
+        if request.if_match:
+            if not is_current(request.if_match, dataset.id.hex, dataset.version):
+                return 'Dataset was changed since it was last fetched.', 412
+            expected_version = dataset.version
 
-        # TODO: here would be a good time to snapshot (?)
+        try:
+            dataset = patch_dataset(params, dataset_id, self._datasets_service, expected_version)
+        except DatasetChanged:
+            if expected_version is not None:
+                return 'Dataset was changed since it was last fetched.', 412
+            # without a precondition, the client may simply retry
+            return 'Dataset was changed while it was patched.', 409
 
-        dataset = self._datasets_service.get_dataset(dataset_id)
         mappings = self._datasets_service.get_mappings_for_dataset(dataset)
 
-        return jsonify(serialize_dataset(dataset, mappings).to_dict())
+        response = jsonify(serialize_dataset(dataset, mappings, self._datasets_service.get_document_urls).to_dict())
+        response.set_etag(dataset_etag(dataset.id.hex, dataset.version, None, None, None, None, False))
+        return response
 
     def delete(self, dataset_id):
         self._datasets_service.delete(dataset_id)
@@ -154,19 +184,50 @@ class Dataset(Resource):
 
 
 class DatasetList(Resource):
+    method_decorators = [handle_registry_errors]
+
     def __init__(self, datasets_service: DatasetsService):
         logwrapper.info(f'Initializing API resource {self.__class__.__name__} with '
                         f'dataset service {hex(id(datasets_service))}')
         self._datasets_service = datasets_service
 
     def get(self):
-        datasets = self._datasets_service.get_all_datasets()
+        try:
+            params = DatasetListQuerySchema().load(request.args)
+        except ValidationError as e:
+            return e.messages, 400
 
-        return jsonify([
-            serialize_dataset(dataset, self._datasets_service.get_mappings_for_dataset(dataset)).to_dict()
-            for dataset
-            in datasets
-        ])
+        limit = params.get('limit')
+        after = params.get('after')
+        dataset_ids = self._datasets_service.get_dataset_ids(limit, None if after is None else after.hex)
+
+        if params.get('view') == 'summary':
+            # summaries are maintained by a projection, so the datasets and their documents are never loaded
+            serialized = self._serialize_chunks(self._datasets_service.iter_summaries(dataset_ids),
+                                                serialize_dataset_summary)
+        else:
+            serialized = self._serialize_chunks(self._datasets_service.iter_datasets(dataset_ids),
+                                                partial(serialize_dataset,
+                                                        document_urls=self._datasets_service.get_document_urls))
+
+        if request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+            response = Response(stream_with_context(stream_lines(serialized)), mimetype=NDJSON_MIMETYPE)
+        else:
+            response = jsonify(list(serialized))
+        response.vary.add('Accept')
+
+        if limit is not None and len(dataset_ids) == limit:
+            next_page = f'{request.base_url}?{urlencode({"limit": limit, "after": dataset_ids[-1].hex})}'
+            response.headers['Link'] = f'<{next_page}>; rel="next"'
+        return response
+
+    def _serialize_chunks(self, chunks: Iterator[List[Any]],
+                          serialize: Callable[[Any, List[Mapping]], HALDocument]) -> Iterator[Dict[str, Any]]:
+        # serialize one chunk of datasets at a time, so memory doesn't grow with the number of datasets when streaming
+        for chunk in chunks:
+            mappings = self._datasets_service.get_mappings_for_datasets(chunk)
+            for dataset, dataset_mappings in zip(chunk, mappings):
+                yield serialize(dataset, dataset_mappings).to_dict()
 
     def post(self):
         if not request.is_json:
@@ -177,12 +238,36 @@ class DatasetList(Resource):
         except ValidationError as e:
             return e.messages, 400
 
-        dataset_id = self._datasets_service.create_dataset(params['name'], params['description'])
-        dataset = self._datasets_service.get_dataset(dataset_id.hex)
-
-        patch_dataset(params, dataset, self._datasets_service)
+        dataset_id = self._datasets_service.create_dataset(params['name'], params['description'],
+                                                           params['train_data'], params['test_data'],
+                                                           params['mappings'])
 
         # FIXME: generate uri properly (how?)
         return jsonify({
             'dataset': f'/datasets/{dataset_id}'
         })
+
+
+class DatasetImport(Resource):
+    """
+    Imports datasets and their documents from an NDJSON request body, see :class:`DatasetImporter`.
+    The body is read line by line while the import runs, progress is streamed back as NDJSON.
+    """
+
+    DEFAULT_CHUNK_SIZE = 10000
+
+    def __init__(self, datasets_service: DatasetsService, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        logwrapper.info(f'Initializing API resource {self.__class__.__name__} with '
+                        f'dataset service {hex(id(datasets_service))}')
+        self._datasets_service = datasets_service
+        self._chunk_size = chunk_size
+
+    def post(self, dataset_id: Optional[str] = None):
+        if request.mimetype != NDJSON_MIMETYPE:
+            return f'Only accepting requests with mime type {NDJSON_MIMETYPE}.', 415
+        if dataset_id is not None and self._datasets_service.get_dataset_version(dataset_id) is None:
+            return f'No dataset with id {dataset_id}', 404
+
+        importer = DatasetImporter(self._datasets_service, self._chunk_size, dataset_id)
+        lines = (json.dumps(report) + '\n' for report in importer.run(request.stream))
+        return Response(stream_with_context(lines), mimetype=NDJSON_MIMETYPE)
@@ -1,5 +1,5 @@
 from marshmallow import fields, Schema
-from marshmallow.validate import Length, Range
+from marshmallow.validate import Length, Range, OneOf
 
 
 class DatasetQuerySchema(Schema):
@@ -9,6 +9,13 @@ class DatasetQuerySchema(Schema):
     validation_split = fields.Float(strict=True, required=False, data_key='validationSplit',
                                     validate=Range(min=0.0, max=1.0, min_inclusive=False, max_inclusive=False))
     seed = fields.String(strict=False, required=False, data_key='seed')
+    representation = fields.String(required=False, validate=OneOf(['full', 'compact']))
+
+
+class DatasetListQuerySchema(Schema):
+    limit = fields.Integer(strict=False, required=False, validate=Range(min=1))
+    after = fields.UUID(required=False)
+    view = fields.String(required=False, validate=OneOf(['full', 'summary']))
 
 
 class MappingSchema(Schema):
@@ -33,3 +40,9 @@ class DatasetPatchSchema(Schema):
     train_data = fields.List(fields.URL(), required=False, data_key='trainDocuments')
     test_data = fields.List(fields.URL(), required=False, data_key='testDocuments')
     mappings = fields.List(fields.Nested(MappingSchema), required=False)
+
+
+class DatasetImportSchema(Schema):
+    name = fields.String(required=True, validate=Length(min=1))
+    description = fields.String(required=False, load_default='')
+    mappings = fields.List(fields.Nested(MappingSchema), required=False, load_default=list)
@@ -0,0 +1,91 @@
+from typing import Dict, Iterable, List, Optional
+from uuid import UUID
+
+from eventsourcing.persistence import AggregateRecorder, StoredEvent
+
+try:
+    from eventsourcing.postgres import PostgresAggregateRecorder
+except ImportError:
+    # postgres driver not installed, e.g. when running on the in-memory event store
+    PostgresAggregateRecorder = None
+
+
+def _is_postgres(recorder: AggregateRecorder) -> bool:
+    return PostgresAggregateRecorder is not None and isinstance(recorder, PostgresAggregateRecorder)
+
+
+def _to_stored_event(row) -> StoredEvent:
+    return StoredEvent(
+        originator_id=row['originator_id'],
+        originator_version=row['originator_version'],
+        topic=row['topic'],
+        state=bytes(row['state'])
+    )
+
+
+def _select(recorder: 'PostgresAggregateRecorder', statement: str, params: Iterable) -> List[StoredEvent]:
+    with recorder.datastore.transaction(commit=False) as conn:
+        with conn.cursor() as c:
+            c.execute(statement, params)
+            return [_to_stored_event(row) for row in c.fetchall()]
+
+
+def select_latest_events(recorder: AggregateRecorder, originator_ids: List[UUID]) -> Dict[UUID, StoredEvent]:
+    """
+    Selects the latest stored event (e.g. snapshot) of each of the given originators in a single query.
+
+    :param recorder: the recorder to select from
+    :param originator_ids: ids of the originators
+    :return: latest stored event by originator id, originators without any stored events are omitted
+    """
+    if len(originator_ids) == 0:
+        return {}
+
+    if not _is_postgres(recorder):
+        latest_events = {}
+        for originator_id in originator_ids:
+            for stored_event in recorder.select_events(originator_id, desc=True, limit=1):
+                latest_events[originator_id] = stored_event
+        return latest_events
+
+    statement = (
+        f'SELECT DISTINCT ON (originator_id) * FROM {recorder.events_table_name} '
+        f'WHERE originator_id = ANY(%s::uuid[]) '
+        f'ORDER BY originator_id, originator_version DESC'
+    )
+    stored_events = _select(recorder, statement, ([str(i) for i in originator_ids],))
+    return {stored_event.originator_id: stored_event for stored_event in stored_events}
+
+
+def select_events_after(recorder: AggregateRecorder,
+                        versions: Dict[UUID, Optional[int]]) -> Dict[UUID, List[StoredEvent]]:
+    """
+    Selects the stored events of many originators in a single query, each
+    starting after a given version of the respective originator.
+
+    :param recorder: the recorder to select from
+    :param versions: the version after which to start by originator id, None to select all events
+    :return: stored events in ascending order of version by originator id
+    """
+    stored_events_by_originator: Dict[UUID, List[StoredEvent]] = {originator_id: [] for originator_id in versions}
+    if len(versions) == 0:
+        return stored_events_by_originator
+
+    if not _is_postgres(recorder):
+        for originator_id, version in versions.items():
+            stored_events_by_originator[originator_id] = recorder.select_events(originator_id, gt=version)
+        return stored_events_by_originator
+
+    statement = (
+        f'SELECT e.* FROM {recorder.events_table_name} e '
+        f'JOIN unnest(%s::uuid[], %s::integer[]) AS v(originator_id, gt) '
+        f'ON e.originator_id = v.originator_id AND e.originator_version > v.gt '
+        f'ORDER BY e.originator_id, e.originator_version ASC'
+    )
+    params = (
+        [str(originator_id) for originator_id in versions.keys()],
+        [0 if version is None else version for version in versions.values()]
+    )
+    for stored_event in _select(recorder, statement, params):
+        stored_events_by_originator[stored_event.originator_id].append(stored_event)
+    return stored_events_by_originator
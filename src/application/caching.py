@@ -0,0 +1,113 @@
+import copy
+from typing import Dict, Iterable, List, TYPE_CHECKING
+from uuid import UUID
+
+from eventsourcing.application import Repository
+from eventsourcing.domain import Aggregate, AggregateEvent
+
+from util.cache import LRUCache
+
+if TYPE_CHECKING:
+    from application.snapshotting import SnapshottingRepository
+
+
+def clone_aggregate(aggregate: Aggregate) -> Aggregate:
+    """
+    Copies an aggregate deep enough, that triggering events on the copy
+    never changes the original: containers are copied, their (immutable)
+    items are shared.
+    """
+    clone = copy.copy(aggregate)
+    for attribute, value in vars(aggregate).items():
+        if hasattr(value, 'copy'):
+            setattr(clone, attribute, value.copy())
+    return clone
+
+
+class AggregateCache(LRUCache):
+    """
+    LRU cache of reconstructed aggregates. Cached aggregates are shared between
+    readers and must never be mutated, they are replaced by updated copies instead.
+    """
+
+    def __init__(self, max_size: int):
+        super().__init__(max_size)
+        self.refreshes = 0
+
+    def get_aggregate(self, aggregate_id: UUID, repository: Repository) -> Aggregate:
+        """
+        Returns the aggregate with given id, only reading events newer than
+        the cached version from the event store, if it is cached.
+        """
+        cached: Aggregate = self.get(aggregate_id)
+        if cached is None:
+            aggregate = repository.get(aggregate_id)
+            self.put_if_newer(aggregate)
+            return aggregate
+
+        new_events = list(repository.event_store.get(aggregate_id, gt=cached.version))
+        if len(new_events) == 0:
+            return cached
+
+        self.refreshes += 1
+        aggregate = clone_aggregate(cached)
+        for event in new_events:
+            event.mutate(aggregate)
+        self.put_if_newer(aggregate)
+        return aggregate
+
+    def get_aggregates(self, aggregate_ids: List[UUID], repository: 'SnapshottingRepository') -> List[Aggregate]:
+        """
+        Returns the aggregates with given ids, loading all of them in bulk. Aggregates,
+        that were not cached before, are not added to the cache, so that listing many
+        aggregates doesn't evict the frequently used ones.
+        """
+        known = {}
+        for aggregate_id in aggregate_ids:
+            cached = self.get(aggregate_id)
+            if cached is not None:
+                known[aggregate_id] = cached
+
+        aggregates = repository.get_many(aggregate_ids, known)
+        for aggregate_id, cached in known.items():
+            aggregate = aggregates[aggregate_id]
+            if aggregate is not cached:
+                self.refreshes += 1
+                self.put_if_newer(aggregate)
+        return [aggregates[aggregate_id] for aggregate_id in aggregate_ids if aggregate_id in aggregates]
+
+    def put_if_newer(self, aggregate: Aggregate) -> None:
+        with self._lock:
+            cached = self.peek(aggregate.id)
+            if cached is None or cached.version < aggregate.version:
+                self.put(aggregate.id, aggregate)
+
+    def apply_events(self, events: Iterable[AggregateEvent]) -> None:
+        """
+        Brings cached aggregates up to date with given, newly recorded events.
+        Aggregates, that can not be updated consistently, are evicted.
+        """
+        events_by_aggregate: Dict[UUID, List[AggregateEvent]] = {}
+        for event in events:
+            events_by_aggregate.setdefault(event.originator_id, []).append(event)
+
+        for aggregate_id, aggregate_events in events_by_aggregate.items():
+            with self._lock:
+                cached: Aggregate = self.peek(aggregate_id)
+                if cached is None:
+                    continue
+                if cached.version >= aggregate_events[-1].originator_version:
+                    continue
+                if cached.version + 1 != aggregate_events[0].originator_version:
+                    self.invalidate(aggregate_id)
+                    continue
+                aggregate = clone_aggregate(cached)
+                for event in aggregate_events:
+                    event.mutate(aggregate)
+                self.put(aggregate_id, aggregate)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            **super().stats(),
+            'refreshes': self.refreshes
+        }
@@ -0,0 +1,46 @@
+import zlib
+from typing import Optional
+
+from eventsourcing.persistence import Compressor, InfrastructureFactory
+
+# stored states are JSON objects, while zlib streams never start with this byte
+_JSON_OBJECT_START = b'{'
+
+
+class ThresholdCompressor(Compressor):
+    """
+    Compresses stored events and snapshots of at least ``min_size`` bytes with zlib, e.g. events
+    with long lists of document urls, and stores smaller ones as they are. Uncompressed states,
+    e.g. of events stored before compression was enabled, are read as they are, too.
+    """
+
+    ENABLED = 'EVENT_COMPRESSION'
+    MIN_SIZE = 'EVENT_COMPRESSION_MIN_SIZE'
+    LEVEL = 'EVENT_COMPRESSION_LEVEL'
+
+    DEFAULT_MIN_SIZE = 1024
+    DEFAULT_LEVEL = 6
+
+    def __init__(self, min_size: Optional[int] = DEFAULT_MIN_SIZE, level: int = DEFAULT_LEVEL):
+        """
+        :param min_size: size in bytes, from which states are compressed, None to never compress
+        """
+        self.min_size = min_size
+        self.level = level
+
+    @classmethod
+    def from_env(cls, factory: InfrastructureFactory, application_name: str = '') -> 'ThresholdCompressor':
+        enabled = factory.getenv(cls.ENABLED, 'n', application_name=application_name)
+        min_size = factory.getenv(cls.MIN_SIZE, str(cls.DEFAULT_MIN_SIZE), application_name=application_name)
+        level = factory.getenv(cls.LEVEL, str(cls.DEFAULT_LEVEL), application_name=application_name)
+        return cls(int(min_size) if enabled.lower() in ('y', 'yes', 't', 'true', 'on', '1') else None, int(level))
+
+    def compress(self, data: bytes) -> bytes:
+        if self.min_size is None or len(data) < self.min_size:
+            return data
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        if data[:1] == _JSON_OBJECT_START:
+            return data
+        return zlib.decompress(data)
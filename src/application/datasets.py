@@ -1,47 +1,330 @@
-from typing import Optional, List
+from typing import Optional, List, Mapping, Dict, Union
 from uuid import UUID
 
-from eventsourcing.application import Application
+import numpy
+from eventsourcing.domain import AggregateEvent
+from eventsourcing.persistence import Transcoder, RecordConflictError
+from eventsourcing.utils import get_topic
 
+from application.caching import AggregateCache, clone_aggregate
+from application.snapshotting import SnapshottingApplication
+from application.transcodings import DocumentCollectionAsList, DocumentIdArrayAsBase64
 from domain.dataset import Dataset
+from domain.documents import DocumentIdArray, document_ids
+from domain.registry import DocumentRegistryBucket
 
 
-class Datasets(Application):
-    def create_dataset(self, name: str, description: Optional[str] = '') -> UUID:
+class DatasetChanged(Exception):
+    """
+    Raised, if a dataset is not in the version a change was based on.
+    """
+
+
+class DocumentNotRegistered(Exception):
+    """
+    Raised, if the url of a document id is unknown, e.g. of documents added before
+    datasets stored ids, see :meth:`Datasets.register_legacy_documents`.
+    """
+
+
+class RegistrationConflict(Exception):
+    """
+    Raised, if documents could not be registered, because concurrent registrations kept
+    changing the same buckets of the registry, see :attr:`Datasets.MAX_REGISTRATION_ATTEMPTS`.
+    """
+
+
+class DocumentImport:
+    """
+    Appends documents to a dataset chunk by chunk, saving one event per chunk. The dataset
+    is kept loaded between chunks and only snapshotted once the import is finished, so
+    importing many documents doesn't copy or snapshot all documents for every chunk.
+    """
+
+    def __init__(self, datasets: 'Datasets', dataset_id: UUID):
+        self._datasets = datasets
+        self._dataset = datasets.get_dataset_for_update(dataset_id)
+        # the cache would apply every chunk to its own copy of the growing dataset, so let readers reload it instead
+        datasets.cache.invalidate(dataset_id)
+
+    @property
+    def dataset_id(self) -> UUID:
+        return self._dataset.id
+
+    def add_train_documents(self, document_urls: List[str]) -> int:
+        num_documents = len(self._dataset.train_validate_documents)
+        self._dataset.add_train_documents(self._datasets.register_documents(document_urls))
+        self._datasets.save(self._dataset, snapshot=False)
+        return len(self._dataset.train_validate_documents) - num_documents
+
+    def add_test_documents(self, document_urls: List[str]) -> int:
+        num_documents = len(self._dataset.test_documents)
+        self._dataset.add_test_documents(self._datasets.register_documents(document_urls))
+        self._datasets.save(self._dataset, snapshot=False)
+        return len(self._dataset.test_documents) - num_documents
+
+    def finish(self) -> Dataset:
+        self._datasets.snapshot_if_due(self._dataset)
+        return self._dataset
+
+
+class Datasets(SnapshottingApplication):
+    AGGREGATE_CACHE_SIZE = 'AGGREGATE_CACHE_SIZE'
+    DEFAULT_AGGREGATE_CACHE_SIZE = 128
+
+    # registering documents is retried this often, if buckets of the registry are changed concurrently
+    MAX_REGISTRATION_ATTEMPTS = 5
+
+    def __init__(self, env: Optional[Mapping] = None):
+        super().__init__(env)
+        cache_size = self.factory.getenv(self.AGGREGATE_CACHE_SIZE, str(self.DEFAULT_AGGREGATE_CACHE_SIZE))
+        self.cache = AggregateCache(int(cache_size))
+        # the registry is read for every serialized dataset, so all of its buckets are kept
+        self.registry_cache = AggregateCache(DocumentRegistryBucket.NUM_BUCKETS)
+
+    def register_transcodings(self, transcoder: Transcoder) -> None:
+        super().register_transcodings(transcoder)
+        transcoder.register(DocumentCollectionAsList())
+        transcoder.register(DocumentIdArrayAsBase64())
+
+    def notify(self, new_events: List[AggregateEvent]) -> None:
+        super().notify(new_events)
+        self.cache.apply_events(new_events)
+        self.registry_cache.apply_events(new_events)
+
+    def register_documents(self, document_urls: List[str]) -> List[int]:
+        """
+        Registers the urls of documents, so they can be looked up by their ids. Registering is
+        idempotent and ids only depend on the urls, so documents are registered (and retried on
+        conflicts) in their own transaction, before the datasets referencing them are saved.
+
+        :return: the ids of the documents, in the order of the urls
+        :raises RegistrationConflict: if concurrent registrations conflicted too often
+        :raises DocumentIdCollision: if a different document is registered with the id of any of the urls
+        """
+        ids = document_ids(document_urls)
+        urls_by_id = dict(zip(ids, document_urls))
+        ids_by_bucket = DocumentRegistryBucket.group_by_bucket(urls_by_id.keys())
+        for attempt in range(self.MAX_REGISTRATION_ATTEMPTS):
+            buckets = self._get_registry_buckets(list(ids_by_bucket.keys()))
+            changed_buckets = []
+            for bucket_id, bucket_document_ids in ids_by_bucket.items():
+                bucket = buckets.get(bucket_id)
+                if bucket is None:
+                    bucket = DocumentRegistryBucket.create(DocumentRegistryBucket.bucket_for(bucket_document_ids[0]))
+                else:
+                    bucket = clone_aggregate(bucket)
+                bucket.register((document_id, urls_by_id[document_id]) for document_id in bucket_document_ids)
+                if len(bucket.pending_events) > 0:
+                    changed_buckets.append(bucket)
+            if len(changed_buckets) == 0:
+                break
+            try:
+                self.save(*changed_buckets)
+                break
+            except RecordConflictError as e:
+                if attempt + 1 == self.MAX_REGISTRATION_ATTEMPTS:
+                    raise RegistrationConflict(f'Registering {len(ids)} documents conflicted with other changes '
+                                                 f'{self.MAX_REGISTRATION_ATTEMPTS} times.') from e
+                for bucket in changed_buckets:
+                    self.registry_cache.invalidate(bucket.id)
+        return ids
+
+    def _get_registry_buckets(self, bucket_ids: List[UUID]) -> Dict[UUID, DocumentRegistryBucket]:
+        buckets = self.registry_cache.get_aggregates(bucket_ids, self.repository)
+        for bucket in buckets:
+            self.registry_cache.put_if_newer(bucket)
+        return {bucket.id: bucket for bucket in buckets}
+
+    def get_document_urls(self, documents: Union[DocumentIdArray, List[int]]) -> List[str]:
+        """
+        :return: the urls of the given documents, in the order of the documents
+        :raises DocumentNotRegistered: if any of the documents is not registered
+        """
+        ids = documents.to_array() if isinstance(documents, DocumentIdArray) else numpy.asarray(documents, numpy.int64)
+        buckets = numpy.unique(ids % DocumentRegistryBucket.NUM_BUCKETS).tolist()
+        registry = self._get_registry_buckets([DocumentRegistryBucket.create_id(bucket) for bucket in buckets])
+        urls_by_bucket: Dict[int, Dict[int, str]] = {}
+        for bucket in buckets:
+            registered = registry.get(DocumentRegistryBucket.create_id(bucket))
+            if registered is not None:
+                urls_by_bucket[bucket] = registered.urls
+        try:
+            return [urls_by_bucket.get(document_id % DocumentRegistryBucket.NUM_BUCKETS, {})[document_id]
+                    for document_id in ids.tolist()]
+        except KeyError as e:
+            raise DocumentNotRegistered(f'No url is registered for document {e}.')
+
+    def register_legacy_documents(self, batch_size: int = 1000) -> int:
+        """
+        Registers the urls of documents added by events, that stored urls instead of ids.
+
+        :return: the number of added documents, whose urls were registered
+        """
+        topics = {get_topic(cls) for cls in (Dataset.TrainDocumentsAddedEvent, Dataset.TestDocumentsAddedEvent)}
+        num_documents = 0
+        start = 1
+        while True:
+            notifications = self.recorder.select_notifications(start, batch_size)
+            if len(notifications) == 0:
+                return num_documents
+            urls = []
+            for notification in notifications:
+                if notification.topic not in topics:
+                    continue
+                # decoded without upcasting, which would replace the urls with ids
+                state = notification.state
+                if self.mapper.cipher:
+                    state = self.mapper.cipher.decrypt(state)
+                if self.mapper.compressor:
+                    state = self.mapper.compressor.decompress(state)
+                event_state = self.mapper.transcoder.decode(state)
+                if event_state.get('class_version', 1) == 1:
+                    urls.extend(event_state['document_ids'])
+            if len(urls) > 0:
+                self.register_documents(urls)
+                num_documents += len(urls)
+            start = notifications[-1].id + 1
+
+    def _register_documents(self, document_urls: Optional[List[str]]) -> Optional[List[int]]:
+        return None if document_urls is None else self.register_documents(document_urls)
+
+    def create_dataset(self, name: str, description: Optional[str] = '',
+                       train_documents: Optional[List[str]] = None, test_documents: Optional[List[str]] = None,
+                       mappings: Optional[List[UUID]] = None) -> UUID:
+        """
+        :param train_documents: the urls of the train documents
+        :param test_documents: the urls of the test documents
+        """
         dataset = Dataset.create(name, description)
+        self._apply_changes(dataset, train_documents=self._register_documents(train_documents),
+                            test_documents=self._register_documents(test_documents), mappings=mappings)
         self.save(dataset)
         return dataset.id
 
+    def patch_dataset(self, dataset_id: UUID, expected_version: Optional[int] = None,
+                      name: Optional[str] = None, description: Optional[str] = None,
+                      train_documents: Optional[List[str]] = None, test_documents: Optional[List[str]] = None,
+                      mappings: Optional[List[UUID]] = None) -> Dataset:
+        """
+        Applies all given changes to the dataset and saves the resulting events at once. Changes,
+        that don't change the dataset, don't result in events, arguments, that are None, are ignored.
+
+        :param expected_version: the version the changes are based on, if any
+        :param train_documents: the urls of the new train documents, replacing the current ones
+        :param test_documents: the urls of the new test documents, replacing the current ones
+        :param mappings: the new mappings, replacing the current ones
+        :return: the changed dataset, which must not be changed by the caller
+        :raises DatasetChanged: if the dataset is not in the expected version, or was changed concurrently
+        """
+        dataset: Dataset = self.get_dataset_for_update(dataset_id)
+        if expected_version is not None and dataset.version != expected_version:
+            raise DatasetChanged(f'Expected version {expected_version} of dataset {dataset_id}, '
+                                 f'but it is in version {dataset.version}.')
+        self._apply_changes(dataset, name, description, self._register_documents(train_documents),
+                            self._register_documents(test_documents), mappings)
+        try:
+            self.save(dataset)
+        except RecordConflictError as e:
+            # another change was saved after the dataset was loaded
+            self.cache.invalidate(dataset_id)
+            raise DatasetChanged(f'Dataset {dataset_id} was changed while it was patched.') from e
+        return dataset
+
+    def import_documents(self, dataset_id: UUID) -> DocumentImport:
+        """
+        Starts appending many documents to the dataset. Other changes to the
+        dataset during the import make the import fail with a conflict.
+        """
+        return DocumentImport(self, dataset_id)
+
+    @staticmethod
+    def _apply_changes(dataset: Dataset, name: Optional[str] = None, description: Optional[str] = None,
+                       train_documents: Optional[List[int]] = None, test_documents: Optional[List[int]] = None,
+                       mappings: Optional[List[UUID]] = None) -> None:
+        if train_documents is not None:
+            dataset.replace_train_documents(train_documents)
+        if test_documents is not None:
+            dataset.replace_test_documents(test_documents)
+        if name is not None or description is not None:
+            dataset.update_meta(dataset.name if name is None else name,
+                                dataset.description if description is None else description)
+        if mappings is not None:
+            dataset.update_mappings(mappings)
+
     def get_dataset(self, dataset_id: UUID) -> Dataset:
-        return self.repository.get(dataset_id)
+        """
+        Returns the (shared) cached dataset, which must not be changed by the caller. Reads
+        never snapshot, long histories are snapshotted by the next write or by backfilling.
+        """
+        return self.cache.get_aggregate(dataset_id, self.repository)
+
+    def get_version(self, dataset_id: UUID) -> Optional[int]:
+        """
+        Returns the current version of the dataset from its latest stored event, without reconstructing it.
+
+        :return: the version, None if there is no dataset with given id
+        """
+        stored_events = self.recorder.select_events(dataset_id, desc=True, limit=1)
+        if len(stored_events) == 0:
+            return None
+        return stored_events[0].originator_version
+
+    def get_datasets(self, dataset_ids: List[UUID]) -> List[Dataset]:
+        return self.cache.get_aggregates(dataset_ids, self.repository)
+
+    def get_dataset_for_update(self, dataset_id: UUID) -> Dataset:
+        """
+        :return: a copy of the dataset, that can be changed and saved without changing the cached one
+        """
+        return clone_aggregate(self.get_dataset(dataset_id))
 
     def delete_dataset(self, dataset_id: UUID) -> None:
-        dataset: Dataset = self.repository.get(dataset_id)
+        dataset: Dataset = self.get_dataset_for_update(dataset_id)
         dataset.delete()
         self.save(dataset)
 
-    def add_train_documents(self, dataset_id: UUID, document_ids: List[str]):
-        dataset: Dataset = self.repository.get(dataset_id)
-        dataset.add_train_documents(document_ids)
+    def add_train_documents(self, dataset_id: UUID, document_urls: List[str]):
+        dataset: Dataset = self.get_dataset_for_update(dataset_id)
+        dataset.add_train_documents(self.register_documents(document_urls))
         self.save(dataset)
 
-    def add_test_documents(self, dataset_id: UUID, document_ids: List[str]):
-        dataset: Dataset = self.repository.get(dataset_id)
-        dataset.add_test_documents(document_ids)
+    def add_test_documents(self, dataset_id: UUID, document_urls: List[str]):
+        dataset: Dataset = self.get_dataset_for_update(dataset_id)
+        dataset.add_test_documents(self.register_documents(document_urls))
         self.save(dataset)
 
-    def remove_train_documents(self, dataset_id: UUID, document_ids: List[str]):
-        dataset: Dataset = self.repository.get(dataset_id)
-        dataset.remove_train_documents(document_ids)
+    def remove_train_documents(self, dataset_id: UUID, document_urls: List[str]):
+        dataset: Dataset = self.get_dataset_for_update(dataset_id)
+        dataset.remove_train_documents(document_ids(document_urls))
         self.save(dataset)
 
-    def remove_test_documents(self, dataset_id: UUID, document_ids: List[str]):
-        dataset: Dataset = self.repository.get(dataset_id)
-        dataset.remove_test_documents(document_ids)
+    def remove_test_documents(self, dataset_id: UUID, document_urls: List[str]):
+        dataset: Dataset = self.get_dataset_for_update(dataset_id)
+        dataset.remove_test_documents(document_ids(document_urls))
         self.save(dataset)
 
+    def remove_documents_from_datasets(self, document_urls_by_dataset: Dict[UUID, List[str]]) -> int:
+        """
+        Removes documents from the train and test documents of many datasets, emitting at most
+        one event per dataset and list, and saving all of them in a single transaction.
+
+        :param document_urls_by_dataset: the urls of the documents to remove by dataset id
+        :return: the number of changed datasets
+        """
+        changed_datasets = []
+        for dataset in self.get_datasets(list(document_urls_by_dataset.keys())):
+            dataset: Dataset = clone_aggregate(dataset)
+            ids = document_ids(document_urls_by_dataset[dataset.id])
+            dataset.remove_train_documents(ids)
+            dataset.remove_test_documents(ids)
+            if len(dataset.pending_events) > 0:
+                changed_datasets.append(dataset)
+        self.save(*changed_datasets)
+        return len(changed_datasets)
+
     def update_meta(self, dataset_id: UUID, name: Optional[str], description: Optional[str]):
-        dataset: Dataset = self.repository.get(dataset_id)
+        dataset: Dataset = self.get_dataset_for_update(dataset_id)
         if name is None:
             name = dataset.name
         if description is None:
@@ -50,6 +333,6 @@ class Datasets(Application):
         self.save(dataset)
 
     def update_mappings(self, dataset_id: UUID, mappings: List[UUID]):
-        dataset: Dataset = self.repository.get(dataset_id)
+        dataset: Dataset = self.get_dataset_for_update(dataset_id)
         dataset.update_mappings(mappings)
         self.save(dataset)
@@ -1,16 +1,18 @@
-from functools import singledispatchmethod
-from typing import List, Union
+from functools import singledispatchmethod, partial
+from typing import List, Union, Dict, Callable, Set
 from uuid import UUID
 
 from eventsourcing.application import AggregateNotFound
 from eventsourcing.domain import AggregateEvent
-from eventsourcing.system import ProcessEvent, ProcessApplication
+from eventsourcing.system import ProcessEvent
 
+from application.snapshotting import SnapshottingProcessApplication
 from domain.dataset import Dataset
-from domain.index import ByDocumentIndex, DatasetIndex
+from domain.documents import document_id
+from domain.index import ByDocumentIndex, DocumentIndexBucket, DatasetIndex, DatasetIndexShard
 
 
-class ByDocumentIndices(ProcessApplication):
+class ByDocumentIndices(SnapshottingProcessApplication):
     @singledispatchmethod
     def policy(self, domain_event: AggregateEvent, process_event: ProcessEvent) -> None:
         pass
@@ -22,14 +24,8 @@ class ByDocumentIndices(ProcessApplication):
                                process_event: ProcessEvent):
         assert isinstance(domain_event, Dataset.TrainDocumentsAddedEvent) or \
                isinstance(domain_event, Dataset.TestDocumentsAddedEvent)
-        for document_id in domain_event.document_ids:
-            index_id = ByDocumentIndex.create_id(document_id)
-            try:
-                index: ByDocumentIndex = self.repository.get(index_id)
-            except AggregateNotFound:
-                index: ByDocumentIndex = ByDocumentIndex.create(document_id)
-            index.add_dataset_to_index(domain_event.dataset_id)
-            process_event.save(index)
+        buckets = self._add_dataset_to_buckets(domain_event.dataset_id, domain_event.document_ids)
+        process_event.save(*buckets)
 
     @policy.register(Dataset.TrainDocumentsRemovedEvent)
     @policy.register(Dataset.TestDocumentsRemovedEvent)
@@ -39,33 +35,66 @@ class ByDocumentIndices(ProcessApplication):
                                     process_event: ProcessEvent):
         assert isinstance(domain_event, Dataset.TrainDocumentsRemovedEvent) or \
                isinstance(domain_event, Dataset.TestDocumentsRemovedEvent)
-        for document_id in domain_event.document_ids:
-            index_id = ByDocumentIndex.create_id(document_id)
-            try:
-                index: ByDocumentIndex = self.repository.get(index_id)
-                index.remove_dataset_from_index(domain_event.dataset_id)
-                process_event.save(index)
-            except AggregateNotFound:
-                continue
-
-    def create_index(self, document_id: str) -> UUID:
-        index = ByDocumentIndex.create(document_id)
-        self.save(index)
-        return index.id
-
-    def get_datasets_by_document(self, document_id: str) -> List[UUID]:
-        index_id = ByDocumentIndex.create_id(document_id)
+        documents_by_bucket = DocumentIndexBucket.group_by_bucket(domain_event.document_ids)
+        buckets = self.repository.get_many(list(documents_by_bucket.keys()))
+        for bucket_id, bucket in buckets.items():
+            bucket.remove_dataset_from_documents(domain_event.dataset_id, documents_by_bucket[bucket_id])
+        process_event.save(*buckets.values())
+
+    def _add_dataset_to_buckets(self, dataset_id: UUID, document_ids: List[int]) -> List[DocumentIndexBucket]:
+        # one event per touched bucket instead of one aggregate per document
+        documents_by_bucket = DocumentIndexBucket.group_by_bucket(document_ids)
+        buckets = self.repository.get_many(list(documents_by_bucket.keys()))
+        for bucket_id, bucket_document_ids in documents_by_bucket.items():
+            if bucket_id not in buckets:
+                buckets[bucket_id] = DocumentIndexBucket.create(DocumentIndexBucket.bucket_for(bucket_document_ids[0]))
+            buckets[bucket_id].add_dataset_to_documents(dataset_id, bucket_document_ids)
+        return list(buckets.values())
+
+    def index_dataset(self, dataset: Dataset) -> None:
+        """
+        Adds all documents of the given dataset to the index, e.g. when rebuilding it.
+        """
+        document_ids = list(dataset.train_validate_documents) + list(dataset.test_documents)
+        self.save(*self._add_dataset_to_buckets(dataset.id, document_ids))
+
+    def create_index(self, document_url: str) -> UUID:
+        bucket = DocumentIndexBucket.bucket_for(document_id(document_url))
+        bucket_id = DocumentIndexBucket.create_id(bucket)
         try:
-            index: ByDocumentIndex = self.repository.get(index_id)
-            return list(index.datasets)
+            self.repository.get(bucket_id)
         except AggregateNotFound:
-            return []
+            self.save(DocumentIndexBucket.create(bucket))
+        return bucket_id
+
+    def get_datasets_by_document(self, document_url: str) -> List[UUID]:
+        return self.get_datasets_by_documents([document_url])[document_url]
+
+    def get_datasets_by_documents(self, document_urls: List[str]) -> Dict[str, List[UUID]]:
+        ids_by_url = {document_url: document_id(document_url) for document_url in document_urls}
+        documents_by_bucket = DocumentIndexBucket.group_by_bucket(ids_by_url.values())
+        buckets = self.repository.get_many(list(documents_by_bucket.keys()))
+        datasets_by_document = {}
+        for document_url, url_id in ids_by_url.items():
+            bucket = buckets.get(DocumentIndexBucket.create_id(DocumentIndexBucket.bucket_for(url_id)))
+            datasets_by_document[document_url] = [] if bucket is None else list(bucket.get_datasets(url_id))
+
+        # documents indexed before the buckets existed are only found in the legacy index, until it is rebuilt.
+        # it is not updated anymore, so it may still list datasets the documents were removed from since
+        unindexed = [document_url for document_url, dataset_ids in datasets_by_document.items() if not dataset_ids]
+        if unindexed:
+            legacy_indices = self.repository.get_many([ByDocumentIndex.create_id(url) for url in unindexed])
+            for document_url in unindexed:
+                legacy_index = legacy_indices.get(ByDocumentIndex.create_id(document_url))
+                if legacy_index is not None:
+                    datasets_by_document[document_url] = list(legacy_index.datasets)
+        return datasets_by_document
 
     def get_index(self, index_id: UUID):
         return self.repository.get(index_id)
 
 
-class DatasetIndices(ProcessApplication):
+class DatasetIndices(SnapshottingProcessApplication):
     @singledispatchmethod
     def policy(self, domain_event: AggregateEvent, process_event: ProcessEvent) -> None:
         pass
@@ -73,37 +102,73 @@ class DatasetIndices(ProcessApplication):
     @policy.register(Dataset.Created)
     def _add_dataset_to_index(self, domain_event: Dataset.Created, process_event: ProcessEvent):
         assert isinstance(domain_event, Dataset.Created)
-        index_id = DatasetIndex.create_id()
-        try:
-            index: DatasetIndex = self.repository.get(index_id)
-        except AggregateNotFound:
-            index: DatasetIndex = DatasetIndex.get()
+        index = self._get_or_create_shard(domain_event.originator_id)
         index.add_dataset_to_index(domain_event.originator_id)
         process_event.save(index)
 
     @policy.register(Dataset.Deleted)
     def _remove_dataset_from_index(self, domain_event: Dataset.Deleted, process_event: ProcessEvent):
         assert isinstance(domain_event, Dataset.Deleted)
-        index_id = DatasetIndex.create_id()
-        try:
-            index: DatasetIndex = self.repository.get(index_id)
-        except AggregateNotFound:
-            index: DatasetIndex = DatasetIndex.get()
+        index = self._get_or_create_shard(domain_event.originator_id)
         index.remove_dataset_from_index(domain_event.originator_id)
         process_event.save(index)
 
-    def create_index(self) -> UUID:
-        index = DatasetIndex.get()
-        self.save(index)
-        return index.id
+    def record(self, process_event: ProcessEvent) -> None:
+        super().record(process_event)
+        # compact shards on deletion, so reads start from the live datasets instead of the add/remove log
+        for event in process_event.events:
+            if not isinstance(event, DatasetIndexShard.DatasetRemovedEvent):
+                continue
+            num_events, _ = self.events.replay_costs.get(event.originator_id)
+            if num_events > 0:
+                self._put_snapshot(event.originator_id, partial(self.take_snapshot, event.originator_id))
 
-    def get_all_dataset_ids(self) -> List[UUID]:
-        index_id = DatasetIndex.create_id()
+    def _get_or_create_shard(self, dataset_id: UUID) -> DatasetIndexShard:
+        shard = DatasetIndexShard.shard_for(dataset_id)
+        try:
+            return self.repository.get(DatasetIndexShard.create_id(shard))
+        except AggregateNotFound:
+            return DatasetIndexShard.create(shard)
+
+    def migrate_legacy_index(self, live_dataset_ids: Callable[[List[UUID]], Set[UUID]]) -> int:
+        """
+        Copies the datasets of the single, unsharded index into the shards.
+
+        :param live_dataset_ids: returns those of the given ids, whose datasets exist and are not deleted,
+                                 as the unsharded index may still list others
+        :return: the number of datasets added to the shards
+        """
         try:
-            index: DatasetIndex = self.repository.get(index_id)
-            return list(index.datasets)
+            legacy_index: DatasetIndex = self.repository.get(DatasetIndex.create_id())
         except AggregateNotFound:
-            return []
+            return 0
+
+        indexed_ids = set(self.get_all_dataset_ids())
+        missing_ids = live_dataset_ids([dataset_id for dataset_id in legacy_index.datasets
+                                        if dataset_id not in indexed_ids])
+        shards = {}
+        for dataset_id in missing_ids:
+            shard_id = DatasetIndexShard.create_id(DatasetIndexShard.shard_for(dataset_id))
+            if shard_id not in shards:
+                shards[shard_id] = self._get_or_create_shard(dataset_id)
+            shards[shard_id].add_dataset_to_index(dataset_id)
+        self.save(*shards.values())
+        return len(missing_ids)
+
+    def create_index(self) -> List[UUID]:
+        shards = []
+        for shard, shard_id in enumerate(DatasetIndexShard.all_ids()):
+            try:
+                self.repository.get(shard_id)
+            except AggregateNotFound:
+                shards.append(DatasetIndexShard.create(shard))
+        self.save(*shards)
+        return DatasetIndexShard.all_ids()
+
+    def get_all_dataset_ids(self) -> List[UUID]:
+        # loads all shards with one query for their snapshots and one for their subsequent events
+        shards = self.repository.get_many(DatasetIndexShard.all_ids())
+        return [dataset_id for shard in shards.values() for dataset_id in shard.datasets]
 
     def get_index(self, index_id: UUID):
         return self.repository.get(index_id)
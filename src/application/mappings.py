@@ -1,12 +1,29 @@
-from typing import Optional, List
+from typing import Optional, List, Mapping as MappingType, Dict, Any
 from uuid import UUID
 
-from eventsourcing.application import Application
+from eventsourcing.application import Application, AggregateNotFound
+from eventsourcing.domain import AggregateEvent
 
+from application.bulk import select_events_after
 from domain.mapping import Mapping
+from util.cache import LRUCache
 
 
 class Mappings(Application):
+    MAPPING_CACHE_SIZE = 'MAPPING_CACHE_SIZE'
+    DEFAULT_MAPPING_CACHE_SIZE = 1024
+
+    def __init__(self, env: Optional[MappingType] = None):
+        super().__init__(env)
+        cache_size = self.factory.getenv(self.MAPPING_CACHE_SIZE, str(self.DEFAULT_MAPPING_CACHE_SIZE))
+        # mappings are (almost) never changed after their creation, so they are memoized as they are
+        self.cache = LRUCache(int(cache_size))
+
+    def notify(self, new_events: List[AggregateEvent]) -> None:
+        super().notify(new_events)
+        for event in new_events:
+            self.cache.invalidate(event.originator_id)
+
     def create_mapping(self, name: str, description: Optional[str] = '',
                        aliases: List[str] = None, tasks: List[str] = None) -> UUID:
         if aliases is None:
@@ -19,8 +36,41 @@ class Mappings(Application):
         self.save(mapping)
         return mapping.id
 
+    def create_mappings(self, mappings: List[MappingType[str, Any]]) -> List[UUID]:
+        """
+        Creates many mappings at once, saving them in a single transaction.
+
+        :param mappings: name, description, aliases and tasks of each mapping
+        """
+        created = [
+            Mapping.create(m['name'], m.get('description', ''), m.get('aliases', []), m.get('tasks', []))
+            for m in mappings
+        ]
+        self.save(*created)
+        return [mapping.id for mapping in created]
+
     def get_mapping(self, mapping_id: UUID) -> Mapping:
-        return self.repository.get(mapping_id)
+        return self.get_mappings([mapping_id])[0]
 
     def get_mappings(self, mapping_ids: List[UUID]) -> List[Mapping]:
-        return [self.repository.get(mapping_id) for mapping_id in mapping_ids]
+        mappings: Dict[UUID, Mapping] = {}
+        missing_ids = []
+        for mapping_id in mapping_ids:
+            mapping = self.cache.get(mapping_id)
+            if mapping is None:
+                missing_ids.append(mapping_id)
+            else:
+                mappings[mapping_id] = mapping
+
+        # load all mappings, that are not cached yet, with a single query
+        stored_events_by_mapping = select_events_after(self.recorder, {mapping_id: None for mapping_id in missing_ids})
+        for mapping_id, stored_events in stored_events_by_mapping.items():
+            mapping: Optional[Mapping] = None
+            for stored_event in stored_events:
+                mapping = self.mapper.to_domain_event(stored_event).mutate(mapping)
+            if mapping is None:
+                raise AggregateNotFound((mapping_id, None))
+            self.cache.put(mapping_id, mapping)
+            mappings[mapping_id] = mapping
+
+        return [mappings[mapping_id] for mapping_id in mapping_ids]
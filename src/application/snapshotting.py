@@ -0,0 +1,289 @@
+from collections import OrderedDict
+from functools import partial
+from threading import RLock
+from typing import Optional, Tuple, Set, Any, List, Dict, Callable
+from uuid import UUID
+
+from eventsourcing.application import Application, Repository, AggregateNotFound
+from eventsourcing.domain import Aggregate, AggregateEvent, Snapshot
+from eventsourcing.persistence import EventStore, Transcoder, InfrastructureFactory, Mapper, AggregateRecorder, \
+    RecordConflictError
+from eventsourcing.system import ProcessApplication, ProcessEvent
+
+from application.bulk import select_latest_events, select_events_after
+from application.caching import clone_aggregate
+from application.compressors import ThresholdCompressor
+from application.transcodings import SetAsList, CompactJSONTranscoder
+from util import logwrapper
+
+
+class SnapshottingPolicy:
+    """
+    Decides when an aggregate should be snapshotted, based on the number of
+    events and the number of stored bytes that have to be replayed on top of
+    its latest snapshot. A limit of 0 disables the respective criterion.
+    """
+
+    INTERVAL = 'SNAPSHOTTING_INTERVAL'
+    MAX_REPLAY_BYTES = 'SNAPSHOTTING_MAX_REPLAY_BYTES'
+
+    DEFAULT_INTERVAL = 50
+    DEFAULT_MAX_REPLAY_BYTES = 256 * 1024
+
+    def __init__(self, interval: int = DEFAULT_INTERVAL, max_replay_bytes: int = DEFAULT_MAX_REPLAY_BYTES):
+        self.interval = interval
+        self.max_replay_bytes = max_replay_bytes
+
+    @classmethod
+    def from_env(cls, factory: InfrastructureFactory) -> 'SnapshottingPolicy':
+        interval = factory.getenv(cls.INTERVAL, str(cls.DEFAULT_INTERVAL))
+        max_replay_bytes = factory.getenv(cls.MAX_REPLAY_BYTES, str(cls.DEFAULT_MAX_REPLAY_BYTES))
+        return cls(int(interval), int(max_replay_bytes))
+
+    def is_due(self, num_events: int, num_bytes: int) -> bool:
+        if self.interval > 0 and num_events >= self.interval:
+            return True
+        if self.max_replay_bytes > 0 and num_bytes >= self.max_replay_bytes:
+            return True
+        return False
+
+
+class ReplayCosts:
+    """
+    Remembers how many events (and stored bytes) have to be replayed on top of
+    the latest snapshot of recently loaded or changed aggregates.
+    """
+
+    MAX_TRACKED_AGGREGATES = 4096
+
+    def __init__(self):
+        self._costs: 'OrderedDict[UUID, Tuple[int, int]]' = OrderedDict()
+        self._lock = RLock()
+
+    def get(self, aggregate_id: UUID) -> Tuple[int, int]:
+        return self._costs.get(aggregate_id, (0, 0))
+
+    def set(self, aggregate_id: UUID, num_events: int, num_bytes: int) -> None:
+        with self._lock:
+            self._costs[aggregate_id] = (num_events, num_bytes)
+            self._costs.move_to_end(aggregate_id)
+            while len(self._costs) > self.MAX_TRACKED_AGGREGATES:
+                self._costs.popitem(last=False)
+
+    def add(self, aggregate_id: UUID, num_events: int, num_bytes: int) -> None:
+        with self._lock:
+            old_events, old_bytes = self.get(aggregate_id)
+            self.set(aggregate_id, old_events + num_events, old_bytes + num_bytes)
+
+    def reset(self, aggregate_id: UUID) -> None:
+        with self._lock:
+            self._costs.pop(aggregate_id, None)
+
+
+class ReplayCostEventStore(EventStore):
+    def __init__(self, mapper: Mapper, recorder: AggregateRecorder, replay_costs: ReplayCosts):
+        super().__init__(mapper, recorder)
+        self.replay_costs = replay_costs
+
+    def put(self, events: List[AggregateEvent], **kwargs: Any) -> None:
+        stored_events = [self.mapper.from_domain_event(event) for event in events]
+        self.recorder.insert_events(stored_events, **kwargs)
+        for stored_event in stored_events:
+            self.replay_costs.add(stored_event.originator_id, 1, len(stored_event.state))
+
+
+class SnapshottingRepository(Repository):
+    event_store: ReplayCostEventStore
+
+    def __init__(self, event_store: ReplayCostEventStore, snapshot_store: Optional[EventStore],
+                 policy: SnapshottingPolicy):
+        super().__init__(event_store, snapshot_store)
+        self.policy = policy
+
+    def get(self, aggregate_id: UUID, version: Optional[int] = None) -> Any:
+        aggregate: Optional[Aggregate] = None
+        gt: Optional[int] = None
+
+        if self.snapshot_store is not None:
+            snapshots = self.snapshot_store.get(originator_id=aggregate_id, desc=True, limit=1, lte=version)
+            for snapshot in snapshots:
+                gt = snapshot.originator_version
+                aggregate = snapshot.mutate()
+
+        # read stored events directly from the recorder, so we know how many bytes were replayed
+        stored_events = self.event_store.recorder.select_events(originator_id=aggregate_id, gt=gt, lte=version)
+        num_bytes = 0
+        for stored_event in stored_events:
+            num_bytes += len(stored_event.state)
+            aggregate = self.event_store.mapper.to_domain_event(stored_event).mutate(aggregate)
+
+        if aggregate is None:
+            raise AggregateNotFound((aggregate_id, version))
+
+        if version is None:
+            self.event_store.replay_costs.set(aggregate_id, len(stored_events), num_bytes)
+        return aggregate
+
+    def get_many(self, aggregate_ids: List[UUID],
+                 known: Optional[Dict[UUID, Aggregate]] = None) -> Dict[UUID, Aggregate]:
+        """
+        Reconstructs many aggregates at once, selecting their latest snapshots and
+        all subsequent events with one query each. Aggregates, that are already known
+        in some version, are brought up to date by applying newer events to copies.
+
+        :param aggregate_ids: ids of the aggregates to reconstruct
+        :param known: already reconstructed aggregates by id, these are never changed
+        :return: the aggregates by id, ids of aggregates that don't exist are omitted
+        """
+        if known is None:
+            known = {}
+        aggregates: Dict[UUID, Aggregate] = {}
+
+        unknown_ids = [aggregate_id for aggregate_id in aggregate_ids if aggregate_id not in known]
+        if self.snapshot_store is not None:
+            snapshots = select_latest_events(self.snapshot_store.recorder, unknown_ids)
+            for aggregate_id, stored_snapshot in snapshots.items():
+                aggregates[aggregate_id] = self.snapshot_store.mapper.to_domain_event(stored_snapshot).mutate()
+
+        versions: Dict[UUID, Optional[int]] = {}
+        for aggregate_id in aggregate_ids:
+            aggregate = known.get(aggregate_id, aggregates.get(aggregate_id))
+            versions[aggregate_id] = None if aggregate is None else aggregate.version
+
+        stored_events_by_aggregate = select_events_after(self.event_store.recorder, versions)
+        for aggregate_id in aggregate_ids:
+            stored_events = stored_events_by_aggregate[aggregate_id]
+            if aggregate_id in known:
+                aggregate = known[aggregate_id]
+                if len(stored_events) > 0:
+                    aggregate = clone_aggregate(aggregate)
+            else:
+                aggregate = aggregates.get(aggregate_id)
+                self.event_store.replay_costs.set(aggregate_id, len(stored_events),
+                                                  sum(len(e.state) for e in stored_events))
+            for stored_event in stored_events:
+                aggregate = self.event_store.mapper.to_domain_event(stored_event).mutate(aggregate)
+            if aggregate is not None:
+                aggregates[aggregate_id] = aggregate
+        return aggregates
+
+    def is_snapshot_due(self, aggregate_id: UUID) -> bool:
+        if self.snapshot_store is None:
+            return False
+        num_events, num_bytes = self.event_store.replay_costs.get(aggregate_id)
+        return self.policy.is_due(num_events, num_bytes)
+
+
+class SnapshottingApplication(Application):
+    """
+    Application, that automatically snapshots its aggregates according to a
+    :class:`SnapshottingPolicy` configured via the environment variables
+    ``SNAPSHOTTING_INTERVAL`` and ``SNAPSHOTTING_MAX_REPLAY_BYTES`` (optionally
+    prefixed with the upper-cased application name). Stored events and snapshots are compressed
+    according to ``EVENT_COMPRESSION``, see :class:`ThresholdCompressor`.
+    """
+
+    is_snapshotting_enabled = True
+    events: ReplayCostEventStore
+    repository: SnapshottingRepository
+
+    def construct_transcoder(self) -> Transcoder:
+        transcoder = CompactJSONTranscoder()
+        self.register_transcodings(transcoder)
+        return transcoder
+
+    def register_transcodings(self, transcoder: Transcoder) -> None:
+        super().register_transcodings(transcoder)
+        transcoder.register(SetAsList())
+
+    def construct_mapper(self, application_name: str = '') -> Mapper:
+        mapper = super().construct_mapper(application_name)
+        if mapper.compressor is None:
+            # installed even if compression is off, so states compressed earlier can still be read
+            mapper.compressor = ThresholdCompressor.from_env(self.factory, application_name)
+        return mapper
+
+    def construct_event_store(self) -> ReplayCostEventStore:
+        return ReplayCostEventStore(
+            mapper=self.mapper,
+            recorder=self.recorder,
+            replay_costs=ReplayCosts()
+        )
+
+    def construct_repository(self) -> SnapshottingRepository:
+        return SnapshottingRepository(
+            event_store=self.events,
+            snapshot_store=self.snapshots,
+            policy=SnapshottingPolicy.from_env(self.factory)
+        )
+
+    def save(self, *aggregates: Aggregate, snapshot: bool = True, **kwargs: Any) -> None:
+        """
+        :param snapshot: False to not snapshot the aggregates now, e.g. while they are changed
+                         by many subsequent saves, which would each snapshot them otherwise
+        """
+        super().save(*aggregates, **kwargs)
+        if snapshot:
+            for aggregate in aggregates:
+                self.snapshot_if_due(aggregate)
+
+    def snapshot_if_due(self, aggregate: Aggregate) -> bool:
+        """
+        Snapshots the given aggregate, if the replay cost recorded by the repository
+        warrants it. The aggregate must not have any pending events. Snapshots are
+        best-effort, failing to store one never fails the read or write taking it.
+
+        :param aggregate: an aggregate in the state last persisted
+        :return: True, if a snapshot was taken
+        """
+        if not self.repository.is_snapshot_due(aggregate.id):
+            return False
+        assert len(aggregate.pending_events) == 0
+        return self._put_snapshot(aggregate.id, lambda: self.snapshots.put([Snapshot.take(aggregate)]))
+
+    def _put_snapshot(self, aggregate_id: UUID, put: Callable[[], None]) -> bool:
+        try:
+            put()
+        except RecordConflictError:
+            # replay costs are tracked per process, so another process (or thread) may have taken the same snapshot
+            logwrapper.info(f'{self.__class__.__name__}: Aggregate {aggregate_id} was already snapshotted.')
+            return False
+        finally:
+            self.events.replay_costs.reset(aggregate_id)
+        return True
+
+    def backfill_snapshots(self, page_size: int = 500) -> int:
+        """
+        Loads every aggregate recorded by this application and snapshots those,
+        whose replay cost warrants a snapshot according to the policy.
+
+        :param page_size: number of event notifications read from the recorder at once
+        :return: the number of snapshots taken
+        """
+        aggregate_ids: Set[UUID] = set()
+        start = 1
+        while True:
+            notifications = self.recorder.select_notifications(start, page_size)
+            aggregate_ids.update(n.originator_id for n in notifications)
+            if len(notifications) < page_size:
+                break
+            start = notifications[-1].id + 1
+
+        num_snapshots = 0
+        for aggregate_id in aggregate_ids:
+            aggregate = self.repository.get(aggregate_id)
+            if self.snapshot_if_due(aggregate):
+                num_snapshots += 1
+        logwrapper.info(f'{self.__class__.__name__}: Took {num_snapshots} snapshots '
+                        f'of {len(aggregate_ids)} aggregates.')
+        return num_snapshots
+
+
+class SnapshottingProcessApplication(SnapshottingApplication, ProcessApplication):
+    def record(self, process_event: ProcessEvent) -> None:
+        super().record(process_event)
+        aggregate_ids = dict.fromkeys(event.originator_id for event in process_event.events)
+        for aggregate_id in aggregate_ids:
+            if self.repository.is_snapshot_due(aggregate_id):
+                # process events don't hand us the aggregates, so reload them from their latest snapshot
+                self._put_snapshot(aggregate_id, partial(self.take_snapshot, aggregate_id))
@@ -0,0 +1,78 @@
+from functools import singledispatchmethod
+from typing import List
+from uuid import UUID
+
+from eventsourcing.domain import AggregateEvent
+from eventsourcing.system import ProcessEvent
+
+from application.snapshotting import SnapshottingProcessApplication
+from domain.dataset import Dataset
+from domain.summary import DatasetSummary
+
+
+class DatasetSummaries(SnapshottingProcessApplication):
+    @singledispatchmethod
+    def policy(self, domain_event: AggregateEvent, process_event: ProcessEvent) -> None:
+        pass
+
+    @policy.register(Dataset.Created)
+    def _create_summary(self, domain_event: Dataset.Created, process_event: ProcessEvent):
+        assert isinstance(domain_event, Dataset.Created)
+        summary = DatasetSummary.create(domain_event.originator_id, domain_event.name, domain_event.description)
+        process_event.save(summary)
+
+    @policy.register(Dataset.MetaDataUpdatedEvent)
+    def _update_meta(self, domain_event: Dataset.MetaDataUpdatedEvent, process_event: ProcessEvent):
+        assert isinstance(domain_event, Dataset.MetaDataUpdatedEvent)
+        summary = self._get_summary(domain_event)
+        summary.update_meta(domain_event.name, domain_event.description)
+        process_event.save(summary)
+
+    @policy.register(Dataset.MappingsUpdatedEvent)
+    def _update_mappings(self, domain_event: Dataset.MappingsUpdatedEvent, process_event: ProcessEvent):
+        assert isinstance(domain_event, Dataset.MappingsUpdatedEvent)
+        summary = self._get_summary(domain_event)
+        summary.update_mappings(domain_event.mappings)
+        process_event.save(summary)
+
+    @policy.register(Dataset.TrainDocumentsAddedEvent)
+    @policy.register(Dataset.TrainDocumentsRemovedEvent)
+    @policy.register(Dataset.TestDocumentsAddedEvent)
+    @policy.register(Dataset.TestDocumentsRemovedEvent)
+    def _count_documents(self, domain_event: AggregateEvent, process_event: ProcessEvent):
+        delta = len(domain_event.document_ids)
+        if isinstance(domain_event, (Dataset.TrainDocumentsRemovedEvent, Dataset.TestDocumentsRemovedEvent)):
+            delta = -delta
+        summary = self._get_summary(domain_event)
+        if isinstance(domain_event, (Dataset.TrainDocumentsAddedEvent, Dataset.TrainDocumentsRemovedEvent)):
+            summary.count_documents(delta, 0)
+        else:
+            summary.count_documents(0, delta)
+        process_event.save(summary)
+
+    @policy.register(Dataset.Deleted)
+    def _delete_summary(self, domain_event: Dataset.Deleted, process_event: ProcessEvent):
+        assert isinstance(domain_event, Dataset.Deleted)
+        summary = self._get_summary(domain_event)
+        summary.delete()
+        process_event.save(summary)
+
+    def _get_summary(self, domain_event: AggregateEvent) -> DatasetSummary:
+        return self.repository.get(DatasetSummary.create_id(domain_event.originator_id))
+
+    def recount_documents(self, dataset: Dataset) -> None:
+        """
+        Sets the document counts of the summary of the given dataset, e.g. to correct
+        counts of datasets, whose history contains documents added more than once.
+        """
+        summary: DatasetSummary = self.repository.get(DatasetSummary.create_id(dataset.id))
+        num_train_documents, num_test_documents = len(dataset.train_validate_documents), len(dataset.test_documents)
+        if (summary.num_train_documents, summary.num_test_documents) != (num_train_documents, num_test_documents):
+            summary.recount_documents(num_train_documents, num_test_documents)
+            self.save(summary)
+
+    def get_summaries(self, dataset_ids: List[UUID]) -> List[DatasetSummary]:
+        # loads all summaries with one query for their snapshots and one for their subsequent events
+        summary_ids = [DatasetSummary.create_id(dataset_id) for dataset_id in dataset_ids]
+        summaries = self.repository.get_many(summary_ids)
+        return [summaries[s] for s in summary_ids if s in summaries and not summaries[s].deleted]
@@ -0,0 +1,209 @@
+from array import array
+from base64 import b64encode, b64decode
+from typing import Any, Dict, List, Union
+from uuid import UUID
+
+import numpy
+from eventsourcing.persistence import Transcoding, JSONTranscoder
+
+from domain.documents import DocumentCollection, DocumentIdArray
+
+
+class SetAsList(Transcoding):
+    type = set
+    name = 'set_list'
+
+    def encode(self, obj: set) -> list:
+        return list(obj)
+
+    def decode(self, data: list) -> set:
+        return set(data)
+
+
+class DocumentCollectionAsList(Transcoding):
+    type = DocumentCollection
+    name = 'document_collection_list'
+
+    def encode(self, obj: DocumentCollection) -> list:
+        return obj.to_list()
+
+    def decode(self, data: list) -> DocumentCollection:
+        return DocumentCollection(data)
+
+
+class DocumentIdArrayAsBase64(Transcoding):
+    type = DocumentIdArray
+    name = 'document_id_array'
+
+    def encode(self, obj: DocumentIdArray) -> str:
+        return b64encode(obj.to_array().astype('<i8').tobytes()).decode('ascii')
+
+    def decode(self, data: str) -> DocumentIdArray:
+        return DocumentIdArray.from_array(numpy.frombuffer(b64decode(data), dtype='<i8').astype(numpy.int64))
+
+
+class PackedUUIDs:
+    """
+    List of uuids, that is stored as one base64 string of their 16 byte
+    representations, instead of one tagged hex string per uuid.
+    """
+
+    __slots__ = ('uuids',)
+
+    def __init__(self, uuids: List[UUID]):
+        self.uuids = uuids
+
+
+class PrefixCodedStrings:
+    """
+    List of strings, that is stored as runs of strings sharing the same prefix up to
+    their last ``/``, e.g. the urls of documents in the same folder, giving each
+    prefix only once per run and the rest of the strings as one line each.
+
+    No longer used for new events and snapshots, as decoding them is slower than decoding
+    plain lists, but kept to decode those stored before.
+    """
+
+    __slots__ = ('strings',)
+
+    def __init__(self, strings: List[str]):
+        self.strings = strings
+
+
+class PackedInts:
+    """
+    List of 64 bit integers, e.g. document ids, that is stored as one base64 string of their bytes.
+    """
+
+    __slots__ = ('ints',)
+
+    def __init__(self, ints: array):
+        self.ints = ints
+
+
+class IntKeyedDict:
+    """
+    Dict with integer keys, e.g. document ids, that is stored as a list of its keys and a list
+    of its values, as JSON objects only have string keys.
+    """
+
+    __slots__ = ('keys', 'values')
+
+    def __init__(self, keys: Any, values: Any):
+        self.keys = keys
+        self.values = values
+
+
+class PackedUUIDsAsBase64(Transcoding):
+    type = PackedUUIDs
+    name = 'uuids_packed'
+
+    def encode(self, obj: PackedUUIDs) -> str:
+        return b64encode(b''.join(uuid.bytes for uuid in obj.uuids)).decode('ascii')
+
+    def decode(self, data: str) -> List[UUID]:
+        packed = b64decode(data)
+        return [UUID(bytes=packed[i:i + 16]) for i in range(0, len(packed), 16)]
+
+
+class PackedIntsAsBase64(Transcoding):
+    type = PackedInts
+    name = 'ints_packed'
+
+    def encode(self, obj: PackedInts) -> str:
+        return b64encode(numpy.asarray(obj.ints, dtype='<i8').tobytes()).decode('ascii')
+
+    def decode(self, data: str) -> List[int]:
+        return numpy.frombuffer(b64decode(data), dtype='<i8').tolist()
+
+
+class IntKeyedDictAsLists(Transcoding):
+    type = IntKeyedDict
+    name = 'int_keyed_dict'
+
+    def encode(self, obj: IntKeyedDict) -> list:
+        return [obj.keys, obj.values]
+
+    def decode(self, data: list) -> Dict[int, Any]:
+        keys, values = data
+        return dict(zip(keys, values))
+
+
+class PrefixCodedStringsAsRuns(Transcoding):
+    type = PrefixCodedStrings
+    name = 'strings_prefix_coded'
+
+    def encode(self, obj: PrefixCodedStrings) -> List[Union[str, List[str]]]:
+        strings = obj.strings
+        if '\n'.join(strings).count('\n') != len(strings) - 1:
+            # suffixes are joined by line breaks, so strings containing them are stored as they are
+            return ['', strings]
+
+        # alternating prefixes and the line separated suffixes of the strings starting with them
+        runs: List[Union[str, List[str]]] = []
+        prefix = None
+        suffixes: List[str] = []
+        for string in strings:
+            length = string.rfind('/') + 1
+            if string[:length] != prefix:
+                if prefix is not None:
+                    runs.extend((prefix, '\n'.join(suffixes)))
+                prefix = string[:length]
+                suffixes = []
+            suffixes.append(string[length:])
+        runs.extend((prefix, '\n'.join(suffixes)))
+        return runs
+
+    def decode(self, data: List[Union[str, List[str]]]) -> List[str]:
+        strings: List[str] = []
+        for i in range(0, len(data), 2):
+            prefix, suffixes = data[i], data[i + 1]
+            if isinstance(suffixes, list):
+                strings.extend(suffixes)
+            else:
+                # prefixes every line, without looping over the strings in python
+                strings.extend((prefix + suffixes.replace('\n', '\n' + prefix)).split('\n'))
+        return strings
+
+
+class CompactJSONTranscoder(JSONTranscoder):
+    """
+    JSON transcoder, that stores lists of uuids (e.g. mappings) and of integers (e.g. document
+    ids) packed, be they attributes of events, of snapshotted aggregates, or encoded by another
+    transcoding (e.g. sets). Dicts with integer keys keep them. States encoded by the plain JSON
+    transcoder (or with prefix coded strings) are decoded as well.
+    """
+
+    # shorter lists of integers are stored as they are
+    MIN_PACKED_INTS = 8
+
+    def __init__(self):
+        super().__init__()
+        self.register(PackedUUIDsAsBase64())
+        self.register(PackedIntsAsBase64())
+        self.register(IntKeyedDictAsLists())
+        self.register(PrefixCodedStringsAsRuns())
+
+    def encode(self, obj: Any) -> bytes:
+        return super().encode(self._compact(obj))
+
+    def _encode_obj(self, o: Any) -> Dict[str, Any]:
+        encoded = super()._encode_obj(o)
+        if not isinstance(o, (PackedUUIDs, PackedInts, IntKeyedDict, PrefixCodedStrings)):
+            encoded['_data_'] = self._compact(encoded['_data_'])
+        return encoded
+
+    def _compact(self, obj: Any) -> Any:
+        if isinstance(obj, dict):
+            if len(obj) > 0 and all(type(key) is int for key in obj):
+                return IntKeyedDict(self._compact(list(obj.keys())), self._compact(list(obj.values())))
+            return {key: self._compact(value) for key, value in obj.items()}
+        if type(obj) is list and len(obj) > 0:
+            if all(type(item) is UUID for item in obj):
+                return PackedUUIDs(obj)
+            if len(obj) >= self.MIN_PACKED_INTS and all(type(item) is int for item in obj):
+                try:
+                    return PackedInts(array('q', obj))
+                except OverflowError:
+                    return obj
+        return obj
@@ -0,0 +1,79 @@
+"""
+Measures stored bytes and load times of datasets with event compression off and on.
+
+Run from the src directory, e.g. ``python -m benchmarks.event_compression --documents 10000``.
+Uses the infrastructure configured via the environment (in memory by default).
+"""
+import argparse
+import json
+import time
+from typing import Dict, Any, Optional
+
+from application.datasets import Datasets
+
+
+def measure(compression: bool, num_datasets: int, num_documents: int, chunk_size: int,
+            min_size: int, repeat: int) -> Dict[str, Any]:
+    env = {
+        'EVENT_COMPRESSION': 'y' if compression else 'n',
+        'EVENT_COMPRESSION_MIN_SIZE': str(min_size),
+        # replay every event when loading, snapshots would hide the costs of decoding them
+        'IS_SNAPSHOTTING_ENABLED': 'n',
+        'SNAPSHOTTING_INTERVAL': '0',
+        'SNAPSHOTTING_MAX_REPLAY_BYTES': '0',
+    }
+    datasets = Datasets(env=env)
+
+    dataset_ids = []
+    start = time.perf_counter()
+    for i in range(num_datasets):
+        dataset_id = datasets.create_dataset(f'dataset {i}')
+        for offset in range(0, num_documents, chunk_size):
+            end = min(offset + chunk_size, num_documents)
+            datasets.add_train_documents(dataset_id, [f'https://documents.example.com/corpus/{i}/{j}.txt'
+                                                      for j in range(offset, end)])
+        dataset_ids.append(dataset_id)
+    save_seconds = time.perf_counter() - start
+
+    num_events, stored_bytes = 0, 0
+    last_id: Optional[int] = None
+    max_id = datasets.recorder.max_notification_id()
+    while last_id is None or last_id < max_id:
+        notifications = datasets.recorder.select_notifications((last_id or 0) + 1, 1000)
+        num_events += len(notifications)
+        stored_bytes += sum(len(n.state) for n in notifications)
+        last_id = notifications[-1].id
+
+    load_seconds = []
+    for _ in range(repeat):
+        datasets.cache.clear()
+        start = time.perf_counter()
+        for dataset_id in dataset_ids:
+            datasets.get_dataset(dataset_id)
+        load_seconds.append(time.perf_counter() - start)
+
+    return {
+        'compression': compression,
+        'events': num_events,
+        'storedBytes': stored_bytes,
+        'saveSeconds': save_seconds,
+        'loadSeconds': min(load_seconds),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--datasets', type=int, default=10)
+    parser.add_argument('--documents', type=int, default=10000, help='documents per dataset')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='documents added per event')
+    parser.add_argument('--min-size', type=int, default=1024, help='see EVENT_COMPRESSION_MIN_SIZE')
+    parser.add_argument('--repeat', type=int, default=3, help='loads of all datasets, the fastest one is reported')
+    args = parser.parse_args()
+
+    results = [measure(compression, args.datasets, args.documents, args.chunk_size, args.min_size, args.repeat)
+               for compression in (False, True)]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
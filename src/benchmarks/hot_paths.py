@@ -0,0 +1,247 @@
+"""
+Measures the hot paths of the dataset service on the in memory event store, for datasets of 10^3 - 10^6 documents.
+
+Run from the src directory, e.g. ``python -m benchmarks.hot_paths --output baseline.json``, then compare later
+changes with ``python -m benchmarks.hot_paths --baseline baseline.json``, which exits with status 1, if any
+benchmark got slower than in the baseline by more than ``--tolerance``. Baselines are only comparable, if they
+were measured on the same machine, with the same sizes.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from functools import lru_cache
+from typing import Dict, Any, Callable, Iterator, List, Tuple, Optional
+
+import numpy
+from eventsourcing.persistence import Tracking
+from eventsourcing.system import ProcessEvent
+from flask import Flask
+
+from application.datasets import Datasets
+from application.indices import ByDocumentIndices
+from domain.dataset import Dataset
+from domain.documents import document_ids
+from interface import runners
+from interface.service import DatasetsService
+from serializer import serialize_dataset
+from util.datasplitter import split_data
+
+# pinned, so results don't depend on the environment the benchmarks are run in
+ENVIRONMENT = {
+    'INFRASTRUCTURE_FACTORY': 'eventsourcing.popo:Factory',
+    'PROJECTIONS_MODE': runners.SYNC,
+    'SNAPSHOTTING_INTERVAL': '50',
+    'SNAPSHOTTING_MAX_REPLAY_BYTES': str(256 * 1024),
+    'EVENT_COMPRESSION': 'n',
+}
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+# documents added per event, when datasets are filled before a benchmark
+CHUNK_SIZE = 1000
+# datasets containing the documents, that are removed from all datasets
+NUM_DATASETS = 4
+
+SPLIT_MODES: Dict[str, Dict[str, Any]] = {
+    'none': {},
+    'folds': {'num_folds': 5},
+    'validate': {'validate_split': 0.2},
+    'test': {'test_split': 0.2, 'seed': 'benchmark'},
+    'test-folds': {'num_folds': 5, 'test_split': 0.2, 'seed': 'benchmark'},
+}
+
+# a benchmark prepares its data for the given number of documents, yields the function to measure
+# and cleans up, once it is resumed
+Benchmark = Callable[[int], Iterator[Callable[[], Any]]]
+
+
+def document_urls(num_documents: int, corpus: int = 0) -> List[str]:
+    return [f'https://documents.example.com/corpus/{corpus}/{i // 1000}/{i}.txt' for i in range(num_documents)]
+
+
+def fill(datasets: Datasets, dataset_id, urls: List[str]) -> None:
+    for offset in range(0, len(urls), CHUNK_SIZE):
+        datasets.add_train_documents(dataset_id, urls[offset:offset + CHUNK_SIZE])
+
+
+@lru_cache(maxsize=1)
+def filled_dataset(num_documents: int) -> Tuple[Datasets, Dataset]:
+    # shared by benchmarks, that only read the dataset
+    datasets = Datasets()
+    dataset_id = datasets.create_dataset('dataset', '')
+    fill(datasets, dataset_id, document_urls(num_documents))
+    datasets.add_test_documents(dataset_id, document_urls(num_documents // 10, corpus=1))
+    return datasets, datasets.get_dataset(dataset_id)
+
+
+def create_dataset(num_documents: int) -> Iterator[Callable[[], Any]]:
+    datasets, urls = Datasets(), document_urls(num_documents)
+    yield lambda: datasets.create_dataset('dataset', '', train_documents=urls)
+
+
+def add_documents(num_documents: int) -> Iterator[Callable[[], Any]]:
+    datasets, urls = Datasets(), document_urls(num_documents)
+    dataset_id = datasets.create_dataset('dataset', '')
+    yield lambda: datasets.add_train_documents(dataset_id, urls)
+
+
+def remove_documents(num_documents: int) -> Iterator[Callable[[], Any]]:
+    datasets, urls = Datasets(), document_urls(num_documents)
+    dataset_id = datasets.create_dataset('dataset', '')
+    fill(datasets, dataset_id, urls)
+    yield lambda: datasets.remove_train_documents(dataset_id, urls[::2])
+
+
+def reload_dataset(num_documents: int) -> Iterator[Callable[[], Any]]:
+    datasets, dataset = filled_dataset(num_documents)
+    datasets.cache.clear()
+    yield lambda: datasets.get_dataset(dataset.id)
+
+
+def split_dataset(params: Dict[str, Any]) -> Benchmark:
+    def benchmark(num_documents: int) -> Iterator[Callable[[], Any]]:
+        _, dataset = filled_dataset(num_documents)
+        yield lambda: split_data(dataset, **params)
+    return benchmark
+
+
+def serialize(num_documents: int) -> Iterator[Callable[[], Any]]:
+    datasets, dataset = filled_dataset(num_documents)
+    app = Flask(__name__)
+
+    def run():
+        # serialized datasets link themselves, which needs the url of a request
+        with app.test_request_context(f'/api/v1/datasets/{dataset.id.hex}'):
+            return json.dumps(serialize_dataset(dataset, [], datasets.get_document_urls).to_dict())
+    yield run
+
+
+def index_documents(num_documents: int) -> Iterator[Callable[[], Any]]:
+    indices = ByDocumentIndices()
+    dataset = Dataset.create('dataset', '')
+    dataset.add_train_documents(document_ids(document_urls(num_documents)))
+    domain_event = dataset.collect_events()[-1]
+
+    def run():
+        process_event = ProcessEvent(Tracking(Datasets.__name__, 1))
+        indices.policy(domain_event, process_event)
+        indices.record(process_event)
+    yield run
+
+
+def remove_documents_from_all_datasets(num_documents: int) -> Iterator[Callable[[], Any]]:
+    service = DatasetsService(projections_mode=runners.SYNC)
+    datasets, urls = service._runner.get(Datasets), document_urls(num_documents)
+    for i in range(NUM_DATASETS):
+        fill(datasets, service.create_dataset(f'dataset {i}'), urls)
+    try:
+        yield lambda: service.remove_documents_from_all_datasets(urls[::10])
+    finally:
+        service.shutdown()
+
+
+BENCHMARKS: Dict[str, Benchmark] = {
+    'dataset.create': create_dataset,
+    'dataset.add': add_documents,
+    'dataset.remove': remove_documents,
+    'dataset.reload': reload_dataset,
+    **{f'split.{mode}': split_dataset(params) for mode, params in SPLIT_MODES.items()},
+    'serialize': serialize,
+    'index.policy': index_documents,
+    'service.removeFromAllDatasets': remove_documents_from_all_datasets,
+}
+
+
+def measure(benchmark: Benchmark, num_documents: int, repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        runs = benchmark(num_documents)
+        function = next(runs)
+        # like timeit, keep the garbage collector from interrupting the measured function
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+            runs.close()
+    return timings
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """
+    Adds the baseline timings to the given results.
+
+    :return: the results, that are slower than their baseline by more than the tolerance
+    """
+    baseline_seconds = {(r['benchmark'], r['documents']): r['seconds'] for r in baseline['results']}
+    regressions = []
+    for result in results:
+        seconds = baseline_seconds.get((result['benchmark'], result['documents']))
+        if seconds is None:
+            continue
+        result['baselineSeconds'] = seconds
+        result['change'] = result['seconds'] / seconds - 1
+        if result['change'] > tolerance:
+            regressions.append(result)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='documents per dataset')
+    parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS.keys()), default=list(BENCHMARKS.keys()))
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement, the fastest one is compared')
+    parser.add_argument('--output', help='file to write the results to, instead of stdout')
+    parser.add_argument('--baseline', help='results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='slowdown relative to the baseline, that is not reported as a regression')
+    args = parser.parse_args()
+
+    os.environ.update(ENVIRONMENT)
+
+    results = []
+    for num_documents in args.sizes:
+        for name in args.benchmarks:
+            timings = measure(BENCHMARKS[name], num_documents, args.repeat)
+            results.append({
+                'benchmark': name,
+                'documents': num_documents,
+                'seconds': min(timings),
+                'medianSeconds': statistics.median(timings),
+            })
+        filled_dataset.cache_clear()
+
+    regressions: Optional[List[Dict[str, Any]]] = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+    report = {
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'results': results,
+    }
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if regressions:
+        for result in regressions:
+            print(f'{result["benchmark"]} with {result["documents"]} documents: {result["seconds"]:.6f}s, '
+                  f'{result["change"]:+.0%} compared to {result["baselineSeconds"]:.6f}s', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
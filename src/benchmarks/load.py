@@ -0,0 +1,233 @@
+"""
+Load test of the api and the consumer of document events, without the database or the message broker.
+
+Run from the src directory, e.g. ``python -m benchmarks.load --requests 2000 --concurrency 8``. Serves the api
+on a local port, with the event store in memory and the consumer reading document deletions from an in-process
+stand-in for the message broker. Clients send a random mix of requests and deletion messages (``--mix``),
+throughput and latency are reported per route as JSON. Deletions are measured from publishing a message until
+it is acknowledged. Other configuration, e.g. ``PROJECTIONS_MODE`` or ``AMQP_BATCH_SIZE``, is read from the
+environment, like the service does.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import time
+from threading import Thread, Lock
+from typing import Dict, List, Callable, Tuple, Optional, Any
+
+import numpy
+from werkzeug.serving import make_server
+
+from api.app import create_app
+from dispatcher import MessageDispatcher
+from interface.service import DatasetsService
+from messages.consumer import create_local_listener
+from messages.local import LocalChannel
+
+OPERATIONS = ['create', 'patch', 'get', 'list', 'delete']
+DEFAULT_MIX = 'create=1,patch=2,get=10,list=2,delete=2'
+
+DELETED_ROUTE = 'AMQP document.event.deleted'
+
+# sends a prepared request, returns the status of the response
+Request = Callable[[http.client.HTTPConnection], int]
+
+
+class LoadTest:
+    def __init__(self, channel: LocalChannel, dataset_ids: List[str], documents: List[str],
+                 num_documents: int, list_limit: int):
+        self._channel = channel
+        self._dataset_ids = dataset_ids
+        self._documents = documents
+        self._num_documents = num_documents
+        self._list_limit = list_limit
+        self._lock = Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def operations(self) -> Dict[str, Callable[[random.Random], Tuple[str, Optional[Request]]]]:
+        return {
+            'create': self._create,
+            'patch': self._patch,
+            'get': self._get,
+            'list': self._list,
+            'delete': self._delete,
+        }
+
+    def _sample_documents(self, rng: random.Random) -> List[str]:
+        return rng.sample(self._documents, min(self._num_documents, len(self._documents)))
+
+    def _create(self, rng: random.Random) -> Tuple[str, Optional[Request]]:
+        body = json.dumps({'name': 'load test dataset', 'trainDocuments': self._sample_documents(rng)})
+
+        def request(connection: http.client.HTTPConnection) -> int:
+            response = send(connection, 'POST', '/api/v1/datasets', body)
+            if response.status == 200:
+                with self._lock:
+                    self._dataset_ids.append(json.loads(response.data)['dataset'].split('/')[-1])
+            return response.status
+        return 'POST /datasets', request
+
+    def _patch(self, rng: random.Random) -> Tuple[str, Optional[Request]]:
+        dataset_id = rng.choice(self._dataset_ids)
+        body = json.dumps({'id': dataset_id, 'trainDocuments': self._sample_documents(rng)})
+        return 'PATCH /datasets/<id>', lambda c: send(c, 'PATCH', f'/api/v1/datasets/{dataset_id}', body).status
+
+    def _get(self, rng: random.Random) -> Tuple[str, Optional[Request]]:
+        dataset_id = rng.choice(self._dataset_ids)
+        return 'GET /datasets/<id>', lambda c: send(c, 'GET', f'/api/v1/datasets/{dataset_id}').status
+
+    def _list(self, rng: random.Random) -> Tuple[str, Optional[Request]]:
+        return 'GET /datasets', lambda c: send(c, 'GET', f'/api/v1/datasets?limit={self._list_limit}').status
+
+    def _delete(self, rng: random.Random) -> Tuple[str, Optional[Request]]:
+        # measured until the consumer acknowledges the message, see LocalChannel
+        body = json.dumps({'id': rng.choice(self._documents)}).encode('utf-8')
+        self._channel.publish('document.event.deleted', body)
+        return DELETED_ROUTE, None
+
+    def run_client(self, port: int, mix: Dict[str, int], num_requests: int, seed: int) -> None:
+        rng = random.Random(seed)
+        operations = self.operations()
+        names, weights = list(mix.keys()), list(mix.values())
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        try:
+            for name in rng.choices(names, weights, k=num_requests):
+                route, request = operations[name](rng)
+                if request is None:
+                    continue
+                start = time.perf_counter()
+                try:
+                    status = request(connection)
+                except (http.client.HTTPException, OSError):
+                    connection.close()
+                    status = None
+                self.record(route, time.perf_counter() - start, status is None or status >= 400)
+        finally:
+            connection.close()
+
+    def record(self, route: str, seconds: float, failed: bool) -> None:
+        with self._lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            if failed:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+
+class Response:
+    def __init__(self, status: int, data: bytes):
+        self.status = status
+        self.data = data
+
+
+def send(connection: http.client.HTTPConnection, method: str, url: str, body: Optional[str] = None) -> Response:
+    headers = {'Accept-Encoding': 'identity'}
+    if body is not None:
+        headers['Content-Type'] = 'application/json'
+    connection.request(method, url, body, headers)
+    response = connection.getresponse()
+    # read the whole body, so the time until the last byte arrived is measured
+    return Response(response.status, response.read())
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        weights[name.strip()] = int(weight)
+    return weights
+
+
+def summarize(route: str, latencies: List[float], errors: int, seconds: float) -> Dict[str, Any]:
+    p50, p95, p99 = numpy.percentile(latencies, [50, 95, 99]).tolist()
+    return {
+        'route': route,
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': len(latencies) / seconds,
+        'p50Seconds': p50,
+        'p95Seconds': p95,
+        'p99Seconds': p99,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000, help='requests and messages sent by all clients')
+    parser.add_argument('--concurrency', type=int, default=4, help='clients sending requests at the same time')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help=f'relative weights of the operations {", ".join(OPERATIONS)}')
+    parser.add_argument('--datasets', type=int, default=20, help='datasets created before the load test')
+    parser.add_argument('--documents', type=int, default=1000, help='documents per dataset')
+    parser.add_argument('--corpus', type=int, default=10000, help='documents the datasets are drawn from')
+    parser.add_argument('--list-limit', type=int, default=20, help='datasets per page of dataset listings')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file to write the results to, instead of stdout')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    unknown = set(mix.keys()) - set(OPERATIONS)
+    if unknown:
+        parser.error(f'unknown operations in mix: {", ".join(sorted(unknown))}')
+
+    # the in memory recorder orders concurrently inserted events like the postgres one, unlike the sqlite one
+    os.environ['INFRASTRUCTURE_FACTORY'] = 'eventsourcing.popo:Factory'
+    report = run(args, mix)
+
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+def run(args: argparse.Namespace, mix: Dict[str, int]) -> Dict[str, Any]:
+    datasets_service = DatasetsService()
+    channel = LocalChannel()
+    listener = create_local_listener(MessageDispatcher(datasets_service), channel)
+    server = make_server('127.0.0.1', 0, create_app(datasets_service), threaded=True)
+    server_thread = Thread(target=server.serve_forever)
+
+    rng = random.Random(args.seed)
+    documents = [f'https://documents.example.com/corpus/{i}.txt' for i in range(args.corpus)]
+    dataset_ids = [datasets_service.create_dataset(f'dataset {i}', '', rng.sample(documents, args.documents)).hex
+                   for i in range(args.datasets)]
+    load_test = LoadTest(channel, dataset_ids, documents, args.documents, args.list_limit)
+
+    listener.start()
+    server_thread.start()
+    try:
+        clients = []
+        for i in range(args.concurrency):
+            num_requests = args.requests // args.concurrency + (1 if i < args.requests % args.concurrency else 0)
+            clients.append(Thread(target=load_test.run_client,
+                                  args=(server.server_port, mix, num_requests, args.seed + i + 1)))
+        start = time.perf_counter()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        acknowledged = channel.wait_until_acknowledged(timeout=60)
+        seconds = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server_thread.join()
+        listener.stop()
+        listener.join()
+        datasets_service.shutdown()
+
+    if channel.acknowledgement_seconds:
+        load_test.latencies[DELETED_ROUTE] = channel.acknowledgement_seconds
+    return {
+        'concurrency': args.concurrency,
+        'mix': mix,
+        'seconds': seconds,
+        'allMessagesAcknowledged': acknowledged,
+        'routes': [summarize(route, latencies, load_test.errors.get(route, 0), seconds)
+                   for route, latencies in sorted(load_test.latencies.items())],
+    }
+
+
+if __name__ == '__main__':
+    main()
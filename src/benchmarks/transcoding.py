@@ -0,0 +1,79 @@
+"""
+Compares size, encoding and decoding times of event states with the plain and the compact JSON transcoder.
+
+Run from the src directory, e.g. ``python -m benchmarks.transcoding --documents 10000``.
+"""
+import argparse
+import json
+import time
+from typing import Dict, Any, Callable
+from uuid import uuid4
+
+from eventsourcing.persistence import JSONTranscoder, Transcoder
+
+from application.datasets import Datasets
+from application.transcodings import CompactJSONTranscoder
+from domain.documents import document_ids
+
+
+def transcoders() -> Dict[str, Transcoder]:
+    # the same transcodings, as registered by the datasets application
+    plain, compact = JSONTranscoder(), CompactJSONTranscoder()
+    datasets = Datasets()
+    datasets.register_transcodings(plain)
+    datasets.register_transcodings(compact)
+    return {'plain': plain, 'compact': compact}
+
+
+def states(num_documents: int, num_uuids: int) -> Dict[str, Dict[str, Any]]:
+    urls = [f'https://documents.example.com/corpus/{i // 1000}/{i}.txt' for i in range(num_documents)]
+    ids = document_ids(urls)
+    dataset_id = uuid4()
+    return {
+        # e.g. Dataset.TrainDocumentsAddedEvent
+        'documentsAdded': {'originator_id': dataset_id, 'originator_version': 2, 'timestamp': 0,
+                           'dataset_id': dataset_id, 'document_ids': ids},
+        # e.g. DocumentRegistryBucket.DocumentsRegisteredEvent
+        'documentsRegistered': {'originator_id': uuid4(), 'originator_version': 2, 'timestamp': 0,
+                                'document_ids': ids, 'urls': urls},
+        # e.g. Dataset.MappingsUpdatedEvent
+        'mappingsUpdated': {'originator_id': dataset_id, 'originator_version': 3, 'timestamp': 0,
+                            'mappings': [uuid4() for _ in range(num_uuids)]},
+        # e.g. a snapshot of a DocumentIndexBucket
+        'indexSnapshot': {'originator_id': uuid4(), 'originator_version': 10, 'timestamp': 0,
+                          'state': {'datasets': {i: {dataset_id, uuid4()} for i in ids}}},
+    }
+
+
+def seconds(function: Callable[[], Any], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--documents', type=int, default=10000, help='document urls per state')
+    parser.add_argument('--uuids', type=int, default=100, help='uuids per list of uuids')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement, the fastest one is reported')
+    args = parser.parse_args()
+
+    results = []
+    for state_name, state in states(args.documents, args.uuids).items():
+        for transcoder_name, transcoder in transcoders().items():
+            encoded = transcoder.encode(state)
+            results.append({
+                'state': state_name,
+                'transcoder': transcoder_name,
+                'bytes': len(encoded),
+                'encodeSeconds': seconds(lambda: transcoder.encode(state), args.repeat),
+                'decodeSeconds': seconds(lambda: transcoder.decode(encoded), args.repeat),
+            })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
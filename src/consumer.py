@@ -0,0 +1,28 @@
+import signal
+from threading import Event
+
+from dispatcher import MessageDispatcher
+from interface.service import DatasetsService
+from messages.consumer import create_listener
+from util import logwrapper
+from util.environment import configure_event_store
+
+if __name__ == '__main__':
+    configure_event_store()
+
+    # consumes document events from the message broker, separately from the api workers
+    datasets_service = DatasetsService()
+    listener = create_listener(MessageDispatcher(datasets_service))
+
+    stopped = Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+
+    logwrapper.info('Consumer: Listening to document events...')
+    listener.start()
+    try:
+        stopped.wait()
+    finally:
+        listener.stop()
+        listener.join()
+        datasets_service.shutdown()
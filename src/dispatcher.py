@@ -1,23 +1,40 @@
 import json
+from typing import List
 
 from pika.adapters.blocking_connection import BlockingChannel
 from pika.spec import Basic, BasicProperties
 
 from interface.service import DatasetsService
+from messages.listener import Message
+from util import logwrapper
 
 
 class MessageDispatcher:
     def __init__(self, datasets_service: DatasetsService):
-        print(f'Building AMQP message dispatcher, using dataset service with id {hex(id(datasets_service))}....')
+        logwrapper.info(f'Building AMQP message dispatcher, '
+                        f'using dataset service with id {hex(id(datasets_service))}....')
         self._datasets_service = datasets_service
 
     def dispatch(self, channel: BlockingChannel, method: Basic.Deliver, properties: BasicProperties, body: bytes):
-        print(f'Got AMQP message with routing key {method.routing_key}.')
+        self.dispatch_batch(channel, [(method, properties, body)])
+
+    def dispatch_batch(self, channel: BlockingChannel, messages: List[Message]):
+        logwrapper.debug(f'Got batch of {len(messages)} AMQP messages.')
         # TODO: use factory for building and handling different messages based on routing key
-        if method.routing_key == 'document.event.deleted':
-            body = body.decode('utf-8')
-            body = json.loads(body)
-            document_id = body['id']
-            self._datasets_service.remove_documents_from_all_datasets([document_id])
+        deleted_document_ids = []
+        for method, properties, body in messages:
+            if method.routing_key == 'document.event.deleted':
+                try:
+                    document_id = json.loads(body.decode('utf-8'))['id']
+                    if not isinstance(document_id, str):
+                        raise TypeError(f'Expected the id of the document to be a string, got {document_id!r}.')
+                    deleted_document_ids.append(document_id)
+                except (ValueError, KeyError, TypeError) as e:
+                    logwrapper.warning(f'Skipping malformed AMQP message {method.delivery_tag} ({e!r}).')
+
+        if len(deleted_document_ids) > 0:
+            self._datasets_service.remove_documents_from_all_datasets(list(dict.fromkeys(deleted_document_ids)))
+
         # TODO: should we always acknowledge the message, even if it was not handled properly?
-        channel.basic_ack(delivery_tag=method.delivery_tag)
+        # acknowledges all messages up to (and including) the last one of this batch at once
+        channel.basic_ack(delivery_tag=messages[-1][0].delivery_tag, multiple=True)
@@ -1,15 +1,28 @@
-from typing import List, Optional
+from typing import List, Optional, Dict, Any
 from uuid import uuid4, UUID
 
 from eventsourcing.domain import Aggregate, AggregateCreated, AggregateEvent
 
+from domain.documents import DocumentCollection, DocumentIdArray, document_ids
+
+
+def _upcast_document_urls(state: Dict[str, Any]) -> None:
+    # events of version 1 stored the documents' urls instead of their ids
+    state['document_ids'] = document_ids(state['document_ids'])
+
 
 class Dataset(Aggregate):
+    """
+    Dataset of documents, given by their ids (see :func:`domain.documents.document_id`).
+    """
+
+    class_version = 3
+
     def __init__(self, name, description: Optional[str] = '', field_mappings: Optional[List[UUID]] = None):
         self.name = name
         self.description = description
-        self.train_validate_documents: List[str] = []
-        self.test_documents: List[str] = []
+        self.train_validate_documents = DocumentIdArray()
+        self.test_documents = DocumentIdArray()
 
         if field_mappings is None:
             self.field_mappings: List[UUID] = []
@@ -18,27 +31,59 @@ class Dataset(Aggregate):
 
         self.deleted = False
 
+    @staticmethod
+    def upcast_v1_v2(state: Dict[str, Any]) -> None:
+        # snapshots of version 1 stored documents as plain lists
+        state['train_validate_documents'] = DocumentCollection(state['train_validate_documents'])
+        state['test_documents'] = DocumentCollection(state['test_documents'])
+
+    @staticmethod
+    def upcast_v2_v3(state: Dict[str, Any]) -> None:
+        # snapshots of version 2 stored the documents' urls instead of their ids
+        state['train_validate_documents'] = DocumentIdArray(document_ids(state['train_validate_documents']))
+        state['test_documents'] = DocumentIdArray(document_ids(state['test_documents']))
+
     @classmethod
     def create(cls, name: str, description: Optional[str]) -> 'Dataset':
         return cls._create(cls.Created, id=uuid4(), name=name, description=description)
 
-    def add_train_documents(self, document_ids: List[str]):
-        self.trigger_event(self.TrainDocumentsAddedEvent, document_ids=document_ids, dataset_id=self.id)
+    def add_train_documents(self, document_ids: List[int]):
+        # only record documents, that are actually added, and nothing at all if none are
+        document_ids = self.train_validate_documents.missing(document_ids)
+        if len(document_ids) > 0:
+            self.trigger_event(self.TrainDocumentsAddedEvent, document_ids=document_ids, dataset_id=self.id)
 
-    def add_test_documents(self, document_ids: List[str]):
-        self.trigger_event(self.TestDocumentsAddedEvent, document_ids=document_ids, dataset_id=self.id)
+    def add_test_documents(self, document_ids: List[int]):
+        document_ids = self.test_documents.missing(document_ids)
+        if len(document_ids) > 0:
+            self.trigger_event(self.TestDocumentsAddedEvent, document_ids=document_ids, dataset_id=self.id)
 
-    def remove_train_documents(self, document_ids: List[str]):
-        self.trigger_event(self.TrainDocumentsRemovedEvent, document_ids=document_ids, dataset_id=self.id)
+    def remove_train_documents(self, document_ids: List[int]):
+        document_ids = self.train_validate_documents.existing(document_ids)
+        if len(document_ids) > 0:
+            self.trigger_event(self.TrainDocumentsRemovedEvent, document_ids=document_ids, dataset_id=self.id)
 
-    def remove_test_documents(self, document_ids: List[str]):
-        self.trigger_event(self.TestDocumentsRemovedEvent, document_ids=document_ids, dataset_id=self.id)
+    def remove_test_documents(self, document_ids: List[int]):
+        document_ids = self.test_documents.existing(document_ids)
+        if len(document_ids) > 0:
+            self.trigger_event(self.TestDocumentsRemovedEvent, document_ids=document_ids, dataset_id=self.id)
+
+    def replace_train_documents(self, document_ids: List[int]):
+        # removes the documents not part of the new ones, and adds the new ones, that are missing
+        self.remove_train_documents(self.train_validate_documents.difference(document_ids))
+        self.add_train_documents(document_ids)
+
+    def replace_test_documents(self, document_ids: List[int]):
+        self.remove_test_documents(self.test_documents.difference(document_ids))
+        self.add_test_documents(document_ids)
 
     def update_meta(self, name: str, description: str):
-        self.trigger_event(self.MetaDataUpdatedEvent, name=name, description=description)
+        if name != self.name or description != self.description:
+            self.trigger_event(self.MetaDataUpdatedEvent, name=name, description=description)
 
     def update_mappings(self, mappings: List[UUID]):
-        self.trigger_event(self.MappingsUpdatedEvent, mappings=mappings)
+        if mappings != self.field_mappings:
+            self.trigger_event(self.MappingsUpdatedEvent, mappings=mappings)
 
     def delete(self):
         self.trigger_event(self.Deleted)
@@ -52,40 +97,44 @@ class Dataset(Aggregate):
             dataset.deleted = True
 
     class TrainDocumentsRemovedEvent(AggregateEvent):
-        document_ids: List[str]
+        class_version = 2
+        upcast_v1_v2 = staticmethod(_upcast_document_urls)
+
+        document_ids: List[int]
         dataset_id: UUID
 
         def apply(self, dataset: 'Dataset') -> None:
-            dataset.train_validate_documents = [
-                d
-                for d in dataset.train_validate_documents
-                if d not in self.document_ids
-            ]
+            dataset.train_validate_documents.remove_all(self.document_ids)
 
     class TestDocumentsRemovedEvent(AggregateEvent):
-        document_ids: List[str]
+        class_version = 2
+        upcast_v1_v2 = staticmethod(_upcast_document_urls)
+
+        document_ids: List[int]
         dataset_id: UUID
 
         def apply(self, dataset: 'Dataset') -> None:
-            dataset.test_documents = [
-                d
-                for d in dataset.test_documents
-                if d not in self.document_ids
-            ]
+            dataset.test_documents.remove_all(self.document_ids)
 
     class TrainDocumentsAddedEvent(AggregateEvent):
-        document_ids: List[str]
+        class_version = 2
+        upcast_v1_v2 = staticmethod(_upcast_document_urls)
+
+        document_ids: List[int]
         dataset_id: UUID
 
         def apply(self, dataset: 'Dataset') -> None:
-            dataset.train_validate_documents.extend(self.document_ids)
+            dataset.train_validate_documents.add_all(self.document_ids)
 
     class TestDocumentsAddedEvent(AggregateEvent):
-        document_ids: List[str]
+        class_version = 2
+        upcast_v1_v2 = staticmethod(_upcast_document_urls)
+
+        document_ids: List[int]
         dataset_id: UUID
 
         def apply(self, dataset: 'Dataset') -> None:
-            dataset.test_documents.extend(self.document_ids)
+            dataset.test_documents.add_all(self.document_ids)
 
     class MetaDataUpdatedEvent(AggregateEvent):
         name: str
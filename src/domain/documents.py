@@ -0,0 +1,177 @@
+import hashlib
+from typing import Dict, Iterable, Iterator, List, Union
+
+import numpy
+
+
+def document_id(url: str) -> int:
+    """
+    Stable 64 bit id of the document with given url. Ids are derived from the url,
+    so they are known without looking them up, see :class:`DocumentRegistryBucket`
+    for looking up the url of an id.
+    """
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+
+def document_ids(urls: Iterable[str]) -> List[int]:
+    return [document_id(url) for url in urls]
+
+
+def _unique(document_ids: Union[Iterable[int], numpy.ndarray]) -> numpy.ndarray:
+    # the first occurrence of every id, in their original order
+    if not isinstance(document_ids, numpy.ndarray):
+        document_ids = list(document_ids)
+    ids = numpy.asarray(document_ids, dtype=numpy.int64)
+    if len(ids) < 2:
+        return ids
+    _, first = numpy.unique(ids, return_index=True)
+    if len(first) == len(ids):
+        return ids
+    return ids[numpy.sort(first)]
+
+
+class DocumentIdArray:
+    """
+    Insertion ordered set of document ids (see :func:`document_id`), backed by two arrays:
+    the ids in order, and sorted for membership tests by binary search. Arrays are never
+    changed in place, but replaced, so that copies share them until either is changed.
+    """
+
+    def __init__(self, document_ids: Iterable[int] = ()):
+        self._ids = _unique(document_ids)
+        self._sorted = numpy.sort(self._ids)
+
+    @classmethod
+    def from_array(cls, ids: numpy.ndarray) -> 'DocumentIdArray':
+        """
+        :param ids: unique ids, e.g. from :meth:`to_array`
+        """
+        collection = cls()
+        collection._ids = ids
+        collection._sorted = numpy.sort(ids)
+        return collection
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._ids.tolist())
+
+    def __contains__(self, document_id: object) -> bool:
+        if not isinstance(document_id, (int, numpy.integer)):
+            return False
+        return bool(self._contained(numpy.asarray([document_id], dtype=numpy.int64))[0])
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, DocumentIdArray):
+            return numpy.array_equal(self._ids, other._ids)
+        if isinstance(other, (list, tuple)):
+            return self._ids.tolist() == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self._ids.tolist()!r})'
+
+    def _contained(self, ids: numpy.ndarray) -> numpy.ndarray:
+        if len(self._sorted) == 0:
+            return numpy.zeros(len(ids), dtype=bool)
+        positions = numpy.searchsorted(self._sorted, ids)
+        positions[positions == len(self._sorted)] = 0
+        return self._sorted[positions] == ids
+
+    def missing(self, document_ids: Iterable[int]) -> List[int]:
+        """
+        :return: the given ids, that are not part of the collection, without duplicates
+        """
+        ids = _unique(document_ids)
+        return ids[~self._contained(ids)].tolist()
+
+    def existing(self, document_ids: Iterable[int]) -> List[int]:
+        """
+        :return: the given ids, that are part of the collection, without duplicates
+        """
+        ids = _unique(document_ids)
+        return ids[self._contained(ids)].tolist()
+
+    def difference(self, document_ids: Iterable[int]) -> List[int]:
+        """
+        :return: the ids of the collection, that are not given
+        """
+        return self._ids[~numpy.isin(self._ids, _unique(document_ids))].tolist()
+
+    def add_all(self, document_ids: Iterable[int]) -> None:
+        ids = _unique(document_ids)
+        ids = ids[~self._contained(ids)]
+        if len(ids) == 0:
+            return
+        self._ids = numpy.concatenate([self._ids, ids])
+        ids.sort()
+        self._sorted = numpy.insert(self._sorted, numpy.searchsorted(self._sorted, ids), ids)
+
+    def remove_all(self, document_ids: Iterable[int]) -> None:
+        ids = _unique(document_ids)
+        self._ids = self._ids[~numpy.isin(self._ids, ids)]
+        self._sorted = self._sorted[~numpy.isin(self._sorted, ids)]
+
+    def copy(self) -> 'DocumentIdArray':
+        collection = DocumentIdArray()
+        collection._ids = self._ids
+        collection._sorted = self._sorted
+        return collection
+
+    def to_array(self) -> numpy.ndarray:
+        """
+        :return: the ids in order, the array must not be changed
+        """
+        return self._ids
+
+    def to_list(self) -> List[int]:
+        return self._ids.tolist()
+
+
+class DocumentCollection:
+    """
+    Insertion ordered set of document ids, backed by a dict, so that membership
+    tests are O(1) and removing m documents is O(m), regardless of the size of
+    the collection. Adding a document, that is already part of the collection,
+    keeps its original position.
+
+    Only read from snapshots of datasets, that stored their documents' urls.
+    """
+
+    def __init__(self, document_ids: Iterable[str] = ()):
+        self._documents: Dict[str, None] = dict.fromkeys(document_ids)
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._documents)
+
+    def __contains__(self, document_id: object) -> bool:
+        return document_id in self._documents
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, DocumentCollection):
+            return list(self._documents) == list(other._documents)
+        if isinstance(other, (list, tuple)):
+            return list(self._documents) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({list(self._documents)!r})'
+
+    def add_all(self, document_ids: Iterable[str]) -> None:
+        self._documents.update(dict.fromkeys(document_ids))
+
+    def remove_all(self, document_ids: Iterable[str]) -> None:
+        for document_id in document_ids:
+            self._documents.pop(document_id, None)
+
+    def copy(self) -> 'DocumentCollection':
+        collection = DocumentCollection()
+        collection._documents = self._documents.copy()
+        return collection
+
+    def to_list(self) -> List[str]:
+        return list(self._documents)
@@ -1,9 +1,10 @@
-from typing import Set
+from typing import Set, Dict, List, Iterable
 from uuid import uuid5, NAMESPACE_URL, UUID
 
 from eventsourcing.domain import Aggregate, AggregateEvent, AggregateCreated
 
 
+# superseded by DocumentIndexBucket, kept to look up documents indexed before the buckets existed
 class ByDocumentIndex(Aggregate):
     def __init__(self):
         self.datasets: Set[UUID] = set()
@@ -40,6 +41,129 @@ class ByDocumentIndex(Aggregate):
                 index.datasets.remove(self.dataset_id)
 
 
+class DocumentIndexBucket(Aggregate):
+    """
+    Reverse index from documents to the datasets containing them. Documents are
+    spread across a fixed number of buckets by their id, so that adding or
+    removing many documents touches every bucket at most once.
+
+    In turn, every change of the documents of any dataset appends to (almost)
+    all buckets, so concurrent changes contend for them, and each bucket (and
+    its snapshots) grows with the whole corpus, not with a single dataset.
+    """
+
+    # changing the number of buckets requires rebuilding the index
+    NUM_BUCKETS = 256
+
+    def __init__(self):
+        self.datasets: Dict[int, Set[UUID]] = {}
+
+    @classmethod
+    def bucket_for(cls, document_id: int) -> int:
+        return document_id % cls.NUM_BUCKETS
+
+    @classmethod
+    def create_id(cls, bucket: int):
+        # buckets of the index by document url ('/index/documents/{bucket}') are superseded, see rebuild-document-index
+        return uuid5(NAMESPACE_URL, f'/index/document-ids/{bucket}')
+
+    @classmethod
+    def create(cls, bucket: int) -> 'DocumentIndexBucket':
+        return cls._create(cls.Created, id=cls.create_id(bucket))
+
+    @classmethod
+    def group_by_bucket(cls, document_ids: Iterable[int]) -> Dict[UUID, List[int]]:
+        documents_by_bucket: Dict[int, List[int]] = {}
+        for document_id in document_ids:
+            documents_by_bucket.setdefault(cls.bucket_for(document_id), []).append(document_id)
+        return {cls.create_id(bucket): documents for bucket, documents in documents_by_bucket.items()}
+
+    def get_datasets(self, document_id: int) -> Set[UUID]:
+        return self.datasets.get(document_id, set())
+
+    def add_dataset_to_documents(self, dataset_id: UUID, document_ids: List[int]):
+        self.trigger_event(self.DatasetAddedEvent, dataset_id=dataset_id, document_ids=document_ids)
+
+    def remove_dataset_from_documents(self, dataset_id: UUID, document_ids: List[int]):
+        self.trigger_event(self.DatasetRemovedEvent, dataset_id=dataset_id, document_ids=document_ids)
+
+    class Created(AggregateCreated):
+        pass
+
+    class DatasetAddedEvent(AggregateEvent):
+        dataset_id: UUID
+        document_ids: List[int]
+
+        def apply(self, index: 'DocumentIndexBucket') -> None:
+            for document_id in self.document_ids:
+                index.datasets.setdefault(document_id, set()).add(self.dataset_id)
+
+    class DatasetRemovedEvent(AggregateEvent):
+        dataset_id: UUID
+        document_ids: List[int]
+
+        def apply(self, index: 'DocumentIndexBucket') -> None:
+            for document_id in self.document_ids:
+                datasets = index.datasets.get(document_id)
+                if datasets is None:
+                    continue
+                datasets.discard(self.dataset_id)
+                if len(datasets) == 0:
+                    del index.datasets[document_id]
+
+
+class DatasetIndexShard(Aggregate):
+    """
+    Shard of the index of all (not deleted) datasets. Datasets are spread across
+    a fixed number of shards by their id, so that concurrently created datasets
+    rarely append to the same aggregate.
+    """
+
+    # changing the number of shards requires rebuilding the index
+    NUM_SHARDS = 16
+
+    def __init__(self):
+        self.datasets: Set[UUID] = set()
+
+    @classmethod
+    def shard_for(cls, dataset_id: UUID) -> int:
+        return dataset_id.int % cls.NUM_SHARDS
+
+    @classmethod
+    def create_id(cls, shard: int):
+        return uuid5(NAMESPACE_URL, f'/index/datasets/{shard}')
+
+    @classmethod
+    def all_ids(cls) -> List[UUID]:
+        return [cls.create_id(shard) for shard in range(cls.NUM_SHARDS)]
+
+    @classmethod
+    def create(cls, shard: int) -> 'DatasetIndexShard':
+        return cls._create(cls.Created, id=cls.create_id(shard))
+
+    def add_dataset_to_index(self, dataset_id: UUID):
+        self.trigger_event(self.DatasetAddedEvent, dataset_id=dataset_id)
+
+    def remove_dataset_from_index(self, dataset_id: UUID):
+        self.trigger_event(self.DatasetRemovedEvent, dataset_id=dataset_id)
+
+    class Created(AggregateCreated):
+        pass
+
+    class DatasetAddedEvent(AggregateEvent):
+        dataset_id: UUID
+
+        def apply(self, index: 'DatasetIndexShard') -> None:
+            index.datasets.add(self.dataset_id)
+
+    class DatasetRemovedEvent(AggregateEvent):
+        dataset_id: UUID
+
+        def apply(self, index: 'DatasetIndexShard') -> None:
+            index.datasets.discard(self.dataset_id)
+
+
+# superseded by DatasetIndexShard, kept to read existing events and snapshots
 class DatasetIndex(Aggregate):
     def __init__(self):
         self.datasets: Set[UUID] = set()
@@ -0,0 +1,71 @@
+from typing import Dict, List, Iterable, Tuple
+from uuid import UUID, uuid5, NAMESPACE_URL
+
+from eventsourcing.domain import Aggregate, AggregateCreated, AggregateEvent
+
+
+class DocumentIdCollision(Exception):
+    pass
+
+
+class DocumentRegistryBucket(Aggregate):
+    """
+    Urls of documents by their id (see :func:`domain.documents.document_id`), so that
+    datasets and their events only need to store the ids. Documents are spread across
+    a fixed number of buckets by their id, like in the document index.
+
+    Every request adding documents appends to the buckets of any new documents, so
+    concurrent imports and changes of different datasets contend for the same buckets.
+    """
+
+    NUM_BUCKETS = 256
+
+    def __init__(self):
+        self.urls: Dict[int, str] = {}
+
+    @classmethod
+    def bucket_for(cls, document_id: int) -> int:
+        return document_id % cls.NUM_BUCKETS
+
+    @classmethod
+    def create_id(cls, bucket: int) -> UUID:
+        return uuid5(NAMESPACE_URL, f'/registry/documents/{bucket}')
+
+    @classmethod
+    def create(cls, bucket: int) -> 'DocumentRegistryBucket':
+        return cls._create(cls.Created, id=cls.create_id(bucket))
+
+    @classmethod
+    def group_by_bucket(cls, document_ids: Iterable[int]) -> Dict[UUID, List[int]]:
+        documents_by_bucket: Dict[int, List[int]] = {}
+        for document_id in document_ids:
+            documents_by_bucket.setdefault(cls.bucket_for(document_id), []).append(document_id)
+        return {cls.create_id(bucket): documents for bucket, documents in documents_by_bucket.items()}
+
+    def register(self, documents: Iterable[Tuple[int, str]]):
+        """
+        Registers the urls of documents, that are not registered yet.
+
+        :param documents: ids and urls of documents of this bucket
+        :raises DocumentIdCollision: if a different document is registered with the same id
+        """
+        new_documents: Dict[int, str] = {}
+        for document_id, url in documents:
+            registered = self.urls.get(document_id, new_documents.get(document_id))
+            if registered is None:
+                new_documents[document_id] = url
+            elif registered != url:
+                raise DocumentIdCollision(f'Documents {registered} and {url} have the same id {document_id}.')
+        if len(new_documents) > 0:
+            self.trigger_event(self.DocumentsRegisteredEvent,
+                               document_ids=list(new_documents.keys()), urls=list(new_documents.values()))
+
+    class Created(AggregateCreated):
+        pass
+
+    class DocumentsRegisteredEvent(AggregateEvent):
+        document_ids: List[int]
+        urls: List[str]
+
+        def apply(self, bucket: 'DocumentRegistryBucket') -> None:
+            bucket.urls.update(zip(self.document_ids, self.urls))
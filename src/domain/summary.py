@@ -0,0 +1,84 @@
+from typing import List
+from uuid import UUID, uuid5, NAMESPACE_URL
+
+from eventsourcing.domain import Aggregate, AggregateCreated, AggregateEvent
+
+
+class DatasetSummary(Aggregate):
+    """
+    Read model of a dataset for listings: its meta data, mappings and the number of
+    its train and test documents, without the documents themselves.
+    """
+
+    def __init__(self, dataset_id: UUID, name: str, description: str):
+        self.dataset_id = dataset_id
+        self.name = name
+        self.description = description
+        self.field_mappings: List[UUID] = []
+        self.num_train_documents = 0
+        self.num_test_documents = 0
+        self.deleted = False
+
+    @classmethod
+    def create_id(cls, dataset_id: UUID) -> UUID:
+        return uuid5(NAMESPACE_URL, f'/summaries/datasets/{dataset_id}')
+
+    @classmethod
+    def create(cls, dataset_id: UUID, name: str, description: str) -> 'DatasetSummary':
+        return cls._create(cls.Created, id=cls.create_id(dataset_id),
+                           dataset_id=dataset_id, name=name, description=description)
+
+    def update_meta(self, name: str, description: str):
+        self.trigger_event(self.MetaDataUpdatedEvent, name=name, description=description)
+
+    def update_mappings(self, mappings: List[UUID]):
+        self.trigger_event(self.MappingsUpdatedEvent, mappings=mappings)
+
+    def count_documents(self, train_delta: int, test_delta: int):
+        self.trigger_event(self.DocumentsCountedEvent, train_delta=train_delta, test_delta=test_delta)
+
+    def recount_documents(self, num_train_documents: int, num_test_documents: int):
+        self.trigger_event(self.DocumentsRecountedEvent,
+                           num_train_documents=num_train_documents, num_test_documents=num_test_documents)
+
+    def delete(self):
+        self.trigger_event(self.Deleted)
+
+    class Created(AggregateCreated):
+        dataset_id: UUID
+        name: str
+        description: str
+
+    class Deleted(AggregateEvent):
+        def apply(self, summary: 'DatasetSummary') -> None:
+            summary.deleted = True
+
+    class MetaDataUpdatedEvent(AggregateEvent):
+        name: str
+        description: str
+
+        def apply(self, summary: 'DatasetSummary') -> None:
+            summary.name = self.name
+            summary.description = self.description
+
+    class MappingsUpdatedEvent(AggregateEvent):
+        mappings: List[UUID]
+
+        def apply(self, summary: 'DatasetSummary') -> None:
+            summary.field_mappings = self.mappings
+
+    class DocumentsCountedEvent(AggregateEvent):
+        train_delta: int
+        test_delta: int
+
+        def apply(self, summary: 'DatasetSummary') -> None:
+            summary.num_train_documents += self.train_delta
+            summary.num_test_documents += self.test_delta
+
+    class DocumentsRecountedEvent(AggregateEvent):
+        num_train_documents: int
+        num_test_documents: int
+
+        def apply(self, summary: 'DatasetSummary') -> None:
+            summary.num_train_documents = self.num_train_documents
+            summary.num_test_documents = self.num_test_documents
@@ -0,0 +1,25 @@
+import multiprocessing
+import os
+
+# production server for the api, run with "gunicorn -c gunicorn.conf.py wsgi:app"
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', str(multiprocessing.cpu_count() * 2 + 1)))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+
+# don't import the app before forking, so no worker shares database connections with another
+preload_app = False
+
+
+def worker_exit(server, worker):
+    import wsgi
+    wsgi.datasets_service.shutdown()
+
+
+def on_starting(server):
+    # workers of several processes must not process the dataset events concurrently, see wsgi.py
+    mode = os.environ.get('PROJECTIONS_MODE', 'process').lower()
+    if server.cfg.workers > 1 and mode != 'process':
+        raise RuntimeError(f'Serving the api with {server.cfg.workers} workers requires PROJECTIONS_MODE=process, '
+                           f'got PROJECTIONS_MODE={mode}.')
@@ -0,0 +1,105 @@
+import os
+import time
+from threading import RLock
+from typing import Dict, Type
+
+from eventsourcing.application import Application
+from eventsourcing.system import Runner, SingleThreadedRunner, MultiThreadedRunner, System, Follower, A
+
+# process applications (projections) run inline with every save
+SYNC = 'sync'
+# process applications follow their leaders in background threads of this process
+THREAD = 'thread'
+# process applications are run by a separate projector process (see projector.py)
+PROCESS = 'process'
+
+PROJECTIONS_MODES = [SYNC, THREAD, PROCESS]
+
+
+class SynchronizedRunner(SingleThreadedRunner):
+    """
+    Single threaded runner, that can be prompted by several threads (e.g. of a multi-threaded
+    web server), processing the prompts of one thread at a time.
+    """
+
+    def __init__(self, system: System):
+        super().__init__(system)
+        self._lock = RLock()
+
+    def receive_prompt(self, leader_name: str) -> None:
+        with self._lock:
+            super().receive_prompt(leader_name)
+
+
+class ReadOnlyRunner(Runner):
+    """
+    Constructs every application of the system, but doesn't let followers follow their
+    leaders. Their state is kept up to date by some other process and is only read here.
+    """
+
+    def __init__(self, system: System):
+        super().__init__(system)
+        self.apps: Dict[str, Application] = {}
+
+    def start(self) -> None:
+        super().start()
+        for name in self.system.followers:
+            self.apps[name] = self.system.follower_cls(name)()
+        for name in self.system.leaders_only:
+            self.apps[name] = self.system.get_app_cls(name)()
+
+    def stop(self) -> None:
+        self.apps.clear()
+
+    def get(self, cls: Type[A]) -> A:
+        app = self.apps[cls.__name__]
+        assert isinstance(app, cls)
+        return app
+
+
+def projections_mode_from_env() -> str:
+    mode = os.environ.get('PROJECTIONS_MODE', SYNC).lower()
+    if mode not in PROJECTIONS_MODES:
+        raise ValueError(f'Unknown projections mode "{mode}", expected one of {", ".join(PROJECTIONS_MODES)}.')
+    return mode
+
+
+def construct_runner(system: System, mode: str) -> Runner:
+    if mode == SYNC:
+        return SynchronizedRunner(system)
+    if mode == THREAD:
+        return MultiThreadedRunner(system)
+    if mode == PROCESS:
+        return ReadOnlyRunner(system)
+    raise ValueError(f'Unknown projections mode "{mode}", expected one of {", ".join(PROJECTIONS_MODES)}.')
+
+
+def projections_position(runner: Runner, leader_cls: Type[Application]) -> Dict[str, int]:
+    """
+    Returns the position in the notification log of the given leader, up to
+    which each of the followers of that leader has processed its events.
+    """
+    leader_name = leader_cls.__name__
+    positions = {}
+    for follower_name in runner.system.leads[leader_name]:
+        follower = runner.apps[follower_name]
+        assert isinstance(follower, Follower)
+        positions[follower_name] = follower.recorder.max_tracking_id(leader_name)
+    return positions
+
+
+def wait_for_projections(runner: Runner, leader_cls: Type[Application], position: int,
+                         timeout: float, poll_interval: float = 0.01) -> bool:
+    """
+    Blocks until all followers of the given leader processed its
+    notification log at least up to the given position.
+
+    :return: True, if the followers caught up within the timeout
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        if all(p >= position for p in projections_position(runner, leader_cls).values()):
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(poll_interval)
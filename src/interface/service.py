@@ -1,77 +1,276 @@
-from typing import List, Optional, Iterable
+import os
+from bisect import bisect_right
+from typing import List, Optional, Iterable, Dict, Iterator, Any, Union, Tuple, Set
 from uuid import UUID
 
-from eventsourcing.system import SingleThreadedRunner
 from eventsourcing.system import System
 
-from application.datasets import Datasets
+from application.datasets import Datasets, DocumentImport
 from application.indices import ByDocumentIndices, DatasetIndices
 from application.mappings import Mappings
+from application.summaries import DatasetSummaries
 from domain.dataset import Dataset
+from domain.documents import DocumentIdArray
 from domain.mapping import Mapping
+from domain.summary import DatasetSummary
+from interface import runners
 from util import logwrapper
+from util.datasplitter import SplitCache, DatasetSplit
+
+
+def build_system() -> System:
+    # pipes are the concept of chains of aggregate
+    # updates (events) triggered by a single event
+    # at the head of a pipe. here: Inserting a
+    # new document at a dataset will update the
+    # "document -> dataset" index (pipe 1)
+    # as well as the "all datasets" index (pipe 2)
+    # and the dataset's summary (pipe 3)
+    return System(pipes=[
+        [Datasets, ByDocumentIndices],  # pipe 1
+        [Datasets, DatasetIndices],  # pipe 2
+        [Datasets, DatasetSummaries],  # pipe 3
+    ])
 
 
 class DatasetsService:
-    def __init__(self):
+    # maximum number of aggregates, whose events are loaded with a single query
+    BULK_LOAD_SIZE = 100
+
+    # number of dataset splits kept in memory, splits of many documents are large
+    DEFAULT_SPLIT_CACHE_SIZE = 64
+
+    # seconds to wait for projections to catch up, before reading them anyway
+    PROJECTIONS_TIMEOUT = 10.0
+
+    def __init__(self, projections_mode: Optional[str] = None):
         logwrapper.info(f'Dataset service [{hex(id(self))}]: Initializing dataset service...')
 
-        # pipes are the concept of chains of aggregate
-        # updates (events) triggered by a single event
-        # at the head of a pipe. here: Inserting a
-        # new document at a dataset will update the
-        # "document -> dataset" index (pipe 1)
-        # as well as the "all datasets" index (pipe 2)
-        self._system = System(pipes=[
-            [Datasets, ByDocumentIndices],  # pipe 1
-            [Datasets, DatasetIndices],  # pipe 2
-            [Mappings]
-        ])
-        self._runner = SingleThreadedRunner(self._system)
+        if projections_mode is None:
+            projections_mode = runners.projections_mode_from_env()
+        self._projections_mode = projections_mode
+        self._system = build_system()
+        self._runner = runners.construct_runner(self._system, projections_mode)
         self._runner.start()
 
+        # mappings are not part of any pipe, so the runner doesn't construct them,
+        # share a single instance for all requests instead
+        self._mappings = Mappings()
+
+        self._splits = SplitCache(int(os.environ.get('SPLIT_CACHE_SIZE', str(self.DEFAULT_SPLIT_CACHE_SIZE))))
+
     def shutdown(self):
         logwrapper.info(f'Dataset service [{hex(id(self))}]: Shutting down dataset microservice...')
         self._runner.stop()
 
+    def position(self) -> int:
+        """
+        :return: position of the latest dataset event in the notification log, e.g. to wait for projections
+        """
+        datasets = self._runner.get(Datasets)
+        return datasets.recorder.max_notification_id()
+
+    def wait_for_projections(self, position: Optional[int] = None, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until the indices processed all dataset events up to the given position, by
+        default the latest one. Projections are always up to date in the synchronous mode.
+
+        :return: True, if the indices caught up within the timeout
+        """
+        if self._projections_mode == runners.SYNC:
+            return True
+        if position is None:
+            position = self.position()
+        if timeout is None:
+            timeout = self.PROJECTIONS_TIMEOUT
+        caught_up = runners.wait_for_projections(self._runner, Datasets, position, timeout)
+        if not caught_up:
+            logwrapper.warning(f'Dataset service [{hex(id(self))}]: Projections did not catch up '
+                               f'to position {position} within {timeout}s.')
+        return caught_up
+
+    def catch_up_projections(self) -> bool:
+        """
+        Lets all projections process the dataset events recorded so far, e.g. after adding a new
+        projection, that has to process all previous events before it can be read.
+        """
+        if self._projections_mode == runners.SYNC:
+            self._runner.receive_prompt(Datasets.__name__)
+            return True
+        return self.wait_for_projections()
+
+    def backfill_snapshots(self) -> Dict[str, int]:
+        logwrapper.info(f'Dataset service [{hex(id(self))}]: Back-filling snapshots...')
+        num_snapshots = {}
+        for app_cls in [Datasets, ByDocumentIndices, DatasetIndices, DatasetSummaries]:
+            app = self._runner.get(app_cls)
+            num_snapshots[app_cls.__name__] = app.backfill_snapshots()
+        return num_snapshots
+
+    def migrate_dataset_index(self) -> int:
+        logwrapper.info(f'Dataset service [{hex(id(self))}]: Migrating dataset index to shards...')
+        indices = self._runner.get(DatasetIndices)
+        return indices.migrate_legacy_index(self._live_dataset_ids)
+
+    def _live_dataset_ids(self, dataset_ids: List[UUID]) -> Set[UUID]:
+        return {dataset.id for chunk in self.iter_datasets(dataset_ids) for dataset in chunk if not dataset.deleted}
+
+    def rebuild_document_index(self) -> int:
+        logwrapper.info(f'Dataset service [{hex(id(self))}]: Rebuilding document index...')
+        indices = self._runner.get(ByDocumentIndices)
+        datasets = self.get_all_datasets()
+        for dataset in datasets:
+            indices.index_dataset(dataset)
+        return len(datasets)
+
+    def register_legacy_documents(self) -> int:
+        logwrapper.info(f'Dataset service [{hex(id(self))}]: Registering documents of legacy events...')
+        datasets = self._runner.get(Datasets)
+        return datasets.register_legacy_documents()
+
+    def recount_summaries(self) -> int:
+        logwrapper.info(f'Dataset service [{hex(id(self))}]: Recounting documents of dataset summaries...')
+        self.catch_up_projections()
+        summaries = self._runner.get(DatasetSummaries)
+        datasets = self.get_all_datasets()
+        for dataset in datasets:
+            summaries.recount_documents(dataset)
+        return len(datasets)
+
+    def cache_stats(self) -> Dict[str, int]:
+        datasets = self._runner.get(Datasets)
+        return datasets.cache.stats()
+
+    def split_stats(self) -> Dict[str, int]:
+        return self._splits.stats()
+
     def get_dataset(self, dataset_id: str) -> Dataset:
         logwrapper.info(f'Dataset service [{hex(id(self))}]: Loading dataset with id {dataset_id}...')
         dataset_id = UUID(dataset_id)
         datasets = self._runner.get(Datasets)
         return datasets.get_dataset(dataset_id)
 
-    # FIXME: paginate result
-    def get_all_datasets(self) -> List[Dataset]:
-        logwrapper.info(f'Dataset service [{hex(id(self))}]: Loading all datasets...')
+    def get_document_urls(self, documents: DocumentIdArray) -> List[str]:
+        datasets = self._runner.get(Datasets)
+        return datasets.get_document_urls(documents)
+
+    def get_dataset_version(self, dataset_id: str) -> Optional[int]:
+        """
+        :return: the version, None if there is no dataset with given id, e.g. because it is not a valid uuid
+        """
+        try:
+            dataset_id = UUID(dataset_id)
+        except ValueError:
+            return None
+        datasets = self._runner.get(Datasets)
+        return datasets.get_version(dataset_id)
+
+    def split_dataset(self, dataset: Dataset, num_folds: int = None, test_split: float = None,
+                      validate_split: float = None, seed: str = None) -> DatasetSplit:
+        return self._splits.get_split(dataset, num_folds, test_split, validate_split, seed)
+
+    def get_dataset_ids(self, limit: Optional[int] = None, after: Optional[str] = None) -> List[UUID]:
         indices = self._runner.get(DatasetIndices)
+
+        # datasets are ordered by id, so the id of the last dataset of a page is the cursor to the next one
+        dataset_ids = sorted(indices.get_all_dataset_ids(), key=lambda dataset_id: dataset_id.hex)
+        if after is not None:
+            start = bisect_right([dataset_id.hex for dataset_id in dataset_ids], UUID(after).hex)
+            dataset_ids = dataset_ids[start:]
+        if limit is not None:
+            dataset_ids = dataset_ids[:limit]
+        return dataset_ids
+
+    def iter_datasets(self, dataset_ids: List[UUID]) -> Iterator[List[Dataset]]:
+        """
+        Loads the datasets with given ids lazily in chunks of at most :attr:`BULK_LOAD_SIZE`
+        datasets, so only one chunk has to be kept in memory at a time.
+        """
         datasets = self._runner.get(Datasets)
-        dataset_ids = indices.get_all_dataset_ids()
-        return [datasets.get_dataset(dataset_id) for dataset_id in dataset_ids]
+        for start in range(0, len(dataset_ids), self.BULK_LOAD_SIZE):
+            yield datasets.get_datasets(dataset_ids[start:start + self.BULK_LOAD_SIZE])
 
-    @staticmethod
-    def get_mapping(mapping_id: str) -> Mapping:
-        mappings = Mappings()
-        return mappings.get_mapping(UUID(mapping_id))
+    def iter_summaries(self, dataset_ids: List[UUID]) -> Iterator[List[DatasetSummary]]:
+        """
+        Loads the summaries of the datasets with given ids in chunks, never loading the datasets themselves.
+        """
+        summaries = self._runner.get(DatasetSummaries)
+        for start in range(0, len(dataset_ids), self.BULK_LOAD_SIZE):
+            yield summaries.get_summaries(dataset_ids[start:start + self.BULK_LOAD_SIZE])
 
-    @staticmethod
-    def get_mappings(mapping_ids: List[str]) -> Iterable[Mapping]:
-        mappings = Mappings()
-        return mappings.get_mappings([UUID(m) for m in mapping_ids])
+    def get_all_datasets(self, limit: Optional[int] = None, after: Optional[str] = None) -> List[Dataset]:
+        logwrapper.info(f'Dataset service [{hex(id(self))}]: Loading all datasets (limit={limit}, after={after})...')
+        result = []
+        for chunk in self.iter_datasets(self.get_dataset_ids(limit, after)):
+            result.extend(chunk)
+        return result
 
-    @staticmethod
-    def get_mappings_for_dataset(dataset: Dataset) -> Iterable[Mapping]:
-        mappings = Mappings()
-        return mappings.get_mappings([m for m in dataset.field_mappings])
+    def get_mapping(self, mapping_id: str) -> Mapping:
+        return self._mappings.get_mapping(UUID(mapping_id))
 
-    def create_dataset(self, dataset_name: str, dataset_description: str = '') -> UUID:
+    def get_mappings(self, mapping_ids: List[str]) -> Iterable[Mapping]:
+        return self._mappings.get_mappings([UUID(m) for m in mapping_ids])
+
+    def get_mappings_for_dataset(self, dataset: Dataset) -> Iterable[Mapping]:
+        return self._mappings.get_mappings([m for m in dataset.field_mappings])
+
+    def get_mappings_for_datasets(self, datasets: List[Dataset]) -> List[List[Mapping]]:
+        mapping_ids = list({m: None for dataset in datasets for m in dataset.field_mappings})
+        mappings = dict(zip(mapping_ids, self._mappings.get_mappings(mapping_ids)))
+        return [[mappings[m] for m in dataset.field_mappings] for dataset in datasets]
+
+    def create_dataset(self, dataset_name: str, dataset_description: str = '',
+                       train_documents: Optional[List[str]] = None, test_documents: Optional[List[str]] = None,
+                       mappings: Optional[List[Dict[str, Any]]] = None) -> UUID:
+        mapping_ids = None
+        if mappings:
+            mapping_ids = self._mappings.create_mappings(mappings)
         datasets = self._runner.get(Datasets)
-        dataset_id = datasets.create_dataset(dataset_name, dataset_description)
+        dataset_id = datasets.create_dataset(dataset_name, dataset_description,
+                                             train_documents, test_documents, mapping_ids)
         logwrapper.info(f'Dataset service [{hex(id(self))}]: Created new dataset with id {dataset_id}...')
         return dataset_id
 
+    def import_documents(self, dataset_id: str) -> DocumentImport:
+        logwrapper.info(f'Dataset service [{hex(id(self))}]: Importing documents into dataset {dataset_id}...')
+        datasets = self._runner.get(Datasets)
+        return datasets.import_documents(UUID(dataset_id))
+
+    def patch_dataset(self, dataset_id: str, expected_version: Optional[int] = None,
+                      name: Optional[str] = None, description: Optional[str] = None,
+                      train_documents: Optional[List[str]] = None, test_documents: Optional[List[str]] = None,
+                      mappings: Optional[List[Dict[str, Any]]] = None) -> Dataset:
+        """
+        Changes the dataset with a single command, see :meth:`Datasets.patch_dataset`. Mappings
+        are given by their name, description, aliases and tasks, new ones are only created, if
+        they differ from the dataset's current ones.
+        """
+        logwrapper.info(f'Dataset service [{hex(id(self))}]: Patching dataset {dataset_id}...')
+        datasets = self._runner.get(Datasets)
+        mapping_ids = None
+        if mappings is not None:
+            dataset = datasets.get_dataset(UUID(dataset_id))
+            if self._describe_mappings(self.get_mappings_for_dataset(dataset)) == self._describe_mappings(mappings):
+                mapping_ids = list(dataset.field_mappings)
+            else:
+                # mappings are aggregates of their own, so they can't be created in the same transaction
+                mapping_ids = self._mappings.create_mappings(mappings)
+        return datasets.patch_dataset(UUID(dataset_id), expected_version, name, description,
+                                      train_documents, test_documents, mapping_ids)
+
+    @staticmethod
+    def _describe_mappings(mappings: Iterable[Union[Mapping, Dict[str, Any]]]) -> List[Tuple]:
+        descriptions = []
+        for m in mappings:
+            if isinstance(m, Mapping):
+                descriptions.append((m.name, m.description, list(m.aliases), list(m.tasks)))
+            else:
+                descriptions.append((m['name'], m.get('description', ''),
+                                     list(m.get('aliases', [])), list(m.get('tasks', []))))
+        return descriptions
+
     def create_mapping(self, name: str, description: str, aliases: List[str], tasks: List[str]) -> UUID:
-        mappings = Mappings()
-        mapping_id = mappings.create_mapping(name, description, aliases, tasks)
+        mapping_id = self._mappings.create_mapping(name, description, aliases, tasks)
         logwrapper.info(f'Dataset service [{hex(id(self))}]: Created new mapping with id {mapping_id}...')
         return mapping_id
 
@@ -115,10 +314,15 @@ class DatasetsService:
     def remove_documents_from_all_datasets(self, document_ids: List[str]):
         logwrapper.info(f'Dataset service [{hex(id(self))}]: Removing {len(document_ids)} '
                         f'train and test documents from all datasets...')
+        # the document index may lag behind recently added documents, if projections run asynchronously
+        self.wait_for_projections()
         indices = self._runner.get(ByDocumentIndices)
         datasets = self._runner.get(Datasets)
-        for document_id in document_ids:
-            dataset_ids = indices.get_datasets_by_document(document_id)
+
+        document_ids_by_dataset: Dict[UUID, List[str]] = {}
+        for document_id, dataset_ids in indices.get_datasets_by_documents(document_ids).items():
             for dataset_id in dataset_ids:
-                datasets.remove_train_documents(dataset_id, [document_id])
-                datasets.remove_test_documents(dataset_id, [document_id])
+                document_ids_by_dataset.setdefault(dataset_id, []).append(document_id)
+
+        num_changed = datasets.remove_documents_from_datasets(document_ids_by_dataset)
+        logwrapper.info(f'Dataset service [{hex(id(self))}]: Removed documents from {num_changed} datasets.')
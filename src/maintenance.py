@@ -0,0 +1,65 @@
+import argparse
+
+from interface.service import DatasetsService
+from util import logwrapper
+from util.environment import configure_event_store
+
+
+def snapshot(datasets_service: DatasetsService, _: argparse.Namespace):
+    num_snapshots = datasets_service.backfill_snapshots()
+    for app_name, num in num_snapshots.items():
+        logwrapper.info(f'{app_name}: {num} snapshots taken.')
+
+
+def migrate_dataset_index(datasets_service: DatasetsService, _: argparse.Namespace):
+    num_datasets = datasets_service.migrate_dataset_index()
+    logwrapper.info(f'Added {num_datasets} datasets to the sharded dataset index.')
+
+
+def rebuild_document_index(datasets_service: DatasetsService, _: argparse.Namespace):
+    num_datasets = datasets_service.rebuild_document_index()
+    logwrapper.info(f'Indexed documents of {num_datasets} datasets.')
+
+
+def register_documents(datasets_service: DatasetsService, _: argparse.Namespace):
+    num_documents = datasets_service.register_legacy_documents()
+    logwrapper.info(f'Registered urls of {num_documents} documents added by legacy events.')
+
+
+def recount_summaries(datasets_service: DatasetsService, _: argparse.Namespace):
+    num_datasets = datasets_service.recount_summaries()
+    logwrapper.info(f'Recounted documents of {num_datasets} dataset summaries.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintenance commands for the GNUMA dataset service.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    snapshot_parser = subparsers.add_parser('snapshot', help='back-fill snapshots for existing aggregates, '
+                                                             'whose event history exceeds the snapshotting policy')
+    snapshot_parser.set_defaults(func=snapshot)
+
+    migrate_parser = subparsers.add_parser('migrate-dataset-index', help='copy the datasets of the unsharded '
+                                                                         'dataset index into its shards')
+    migrate_parser.set_defaults(func=migrate_dataset_index)
+
+    index_parser = subparsers.add_parser('rebuild-document-index', help='add the documents of all datasets to the '
+                                                                         'document to datasets index')
+    index_parser.set_defaults(func=rebuild_document_index)
+
+    register_parser = subparsers.add_parser('register-documents', help='register the urls of documents added '
+                                                                        'before datasets stored document ids')
+    register_parser.set_defaults(func=register_documents)
+
+    recount_parser = subparsers.add_parser('recount-summaries', help='build the dataset summaries and correct their '
+                                                                      'document counts from the datasets')
+    recount_parser.set_defaults(func=recount_summaries)
+
+    args = parser.parse_args()
+
+    configure_event_store()
+    datasets_service = DatasetsService()
+    try:
+        args.func(datasets_service, args)
+    finally:
+        datasets_service.shutdown()
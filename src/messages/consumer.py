@@ -0,0 +1,28 @@
+import os
+
+from dispatcher import MessageDispatcher
+from messages.listener import AMQPListener
+from messages.local import LocalChannel, LocalAMQPListener
+
+
+def create_listener(dispatcher: MessageDispatcher) -> AMQPListener:
+    return AMQPListener(
+        host=os.environ["RABBITMQ_HOST"],
+        port=int(os.environ["RABBITMQ_PORT"]),
+        username=os.environ["RABBITMQ_USER"],
+        password=os.environ["RABBITMQ_PASS"],
+        on_messages=dispatcher.dispatch_batch,
+        prefetch_count=int(os.environ.get('AMQP_PREFETCH_COUNT', '100')),
+        batch_size=int(os.environ.get('AMQP_BATCH_SIZE', '100')),
+        batch_timeout_ms=int(os.environ.get('AMQP_BATCH_TIMEOUT_MS', '250'))
+    )
+
+
+def create_local_listener(dispatcher: MessageDispatcher, channel: LocalChannel) -> LocalAMQPListener:
+    # batches like the listener of the message broker, but doesn't need one
+    return LocalAMQPListener(
+        channel=channel,
+        on_messages=dispatcher.dispatch_batch,
+        batch_size=int(os.environ.get('AMQP_BATCH_SIZE', '100')),
+        batch_timeout_ms=int(os.environ.get('AMQP_BATCH_TIMEOUT_MS', '250'))
+    )
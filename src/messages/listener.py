@@ -1,36 +1,79 @@
-from threading import Thread
-from typing import Callable
+import time
+from threading import Thread, Event
+from typing import Callable, List, Tuple
 
 import pika
+import pika.exceptions
 from pika.adapters.blocking_connection import BlockingChannel
 from pika.exchange_type import ExchangeType
 from pika.spec import Basic, BasicProperties
 
-OnMessageListener = Callable[[BlockingChannel, Basic.Deliver, BasicProperties, bytes], None]
+from util import logwrapper
+
+Message = Tuple[Basic.Deliver, BasicProperties, bytes]
+OnMessagesListener = Callable[[BlockingChannel, List[Message]], None]
 
 
 class AMQPListener(Thread):
-    def __init__(self, host: str, port: int, username: str, password: str, on_message: OnMessageListener):
+    """
+    Consumes document events from the message broker and hands them to the listener in
+    micro-batches of up to ``batch_size`` messages, or whatever arrived within ``batch_timeout_ms``
+    after the first message of a batch. Lost connections are re-established with exponential backoff.
+    Batches, that can't be handled, are rejected and requeued, after backing off the same way.
+    """
+
+    def __init__(self, host: str, port: int, username: str, password: str, on_messages: OnMessagesListener,
+                 prefetch_count: int = 100, batch_size: int = 100, batch_timeout_ms: int = 250,
+                 min_reconnect_delay: float = 1.0, max_reconnect_delay: float = 60.0):
         super().__init__()
         self._credentials = pika.PlainCredentials(username, password)
         self._connection_params = pika.ConnectionParameters(host=host, port=port, credentials=self._credentials)
-        self._on_message = on_message
+        self._on_messages = on_messages
+        self._prefetch_count = prefetch_count
+        self._batch_size = batch_size
+        self._batch_timeout = batch_timeout_ms / 1000
+        self._min_reconnect_delay = min_reconnect_delay
+        self._max_reconnect_delay = max_reconnect_delay
         self._connection = None
         self._channel = None
-        self._document_removed_consumer = None
-        self._interrupted = True
+        self._stopped = Event()
+        self._failure_delay = min_reconnect_delay
 
     def stop(self):
-        print('Stopping AMQP listener...')
-        self._interrupted = True
+        logwrapper.info('Stopping AMQP listener...')
+        self._stopped.set()
 
     def run(self):
-        self._interrupted = False
-
+        reconnect_delay = self._min_reconnect_delay
+        while not self._stopped.is_set():
+            try:
+                self._connect()
+                # connected successfully, so start over with short delays the next time we lose the connection
+                reconnect_delay = self._min_reconnect_delay
+                self._consume(self._channel)
+                self._channel.cancel()
+                self._connection.close()
+            except (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError) as e:
+                logwrapper.warning(f'Lost connection to message broker ({e!r}), '
+                                   f'reconnecting in {reconnect_delay:.1f}s...')
+                self._close_quietly()
+                self._stopped.wait(reconnect_delay)
+                reconnect_delay = min(reconnect_delay * 2, self._max_reconnect_delay)
+            except Exception as e:
+                # never let the consumer die, unacknowledged messages are redelivered after reconnecting
+                logwrapper.error(f'Consuming messages failed ({e!r}), reconnecting in {reconnect_delay:.1f}s...')
+                self._close_quietly()
+                self._stopped.wait(reconnect_delay)
+                reconnect_delay = min(reconnect_delay * 2, self._max_reconnect_delay)
+
+    def _connect(self):
         self._connection = pika.BlockingConnection(self._connection_params)
 
         self._channel = self._connection.channel()
 
+        # only let the broker send as many unacknowledged messages as we are willing to batch
+        self._channel.basic_qos(prefetch_count=self._prefetch_count)
+
         # register a exchange at the message broker, where we publish events (e.g. when creating or deleting datasets)
         self._channel.exchange_declare(exchange='ms.datasets', exchange_type=ExchangeType.fanout.value, durable=True)
 
@@ -50,14 +93,43 @@ class AMQPListener(Thread):
         # bind the queue to the exchange of the document micro service
         self._channel.queue_bind(exchange=document_exchange, queue=document_update_queue, routing_key=routing_key)
 
+    def _consume(self, channel: BlockingChannel):
         # start listening to the document microservice
         # if it removes a document update our datasets accordingly
-        for deliver, properties, body in self._channel.consume(queue=document_update_queue, inactivity_timeout=1):
-            if self._interrupted:
+        batch: List[Message] = []
+        batch_started = 0.0
+        for deliver, properties, body in channel.consume(queue='propagate-document-deletions',
+                                                         inactivity_timeout=self._batch_timeout):
+            if deliver is not None:
+                if len(batch) == 0:
+                    batch_started = time.monotonic()
+                batch.append((deliver, properties, body))
+
+            batch_is_due = len(batch) >= self._batch_size or time.monotonic() - batch_started >= self._batch_timeout
+            if len(batch) > 0 and (deliver is None or batch_is_due):
+                self._handle(channel, batch)
+                batch = []
+
+            if self._stopped.is_set():
                 break
-            if deliver is None:
-                continue
-            self._on_message(self._channel, deliver, properties, body)
 
-        self._channel.cancel()
-        self._connection.close()
+    def _handle(self, channel: BlockingChannel, batch: List[Message]):
+        try:
+            self._on_messages(channel, batch)
+            self._failure_delay = self._min_reconnect_delay
+        except pika.exceptions.AMQPError:
+            raise
+        except Exception as e:
+            # e.g. conflicting writes of the datasets, requeue the batch so it is retried later
+            logwrapper.error(f'Failed to handle batch of {len(batch)} messages ({e!r}), '
+                             f'requeueing it in {self._failure_delay:.1f}s...')
+            self._stopped.wait(self._failure_delay)
+            self._failure_delay = min(self._failure_delay * 2, self._max_reconnect_delay)
+            channel.basic_nack(delivery_tag=batch[-1][0].delivery_tag, multiple=True, requeue=True)
+
+    def _close_quietly(self):
+        try:
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+        except pika.exceptions.AMQPError:
+            pass
@@ -0,0 +1,110 @@
+import time
+from collections import OrderedDict
+from queue import Queue, Empty
+from threading import Condition, Event
+from typing import Iterator, List, Tuple, Set
+
+from pika.spec import Basic, BasicProperties
+
+from messages.listener import AMQPListener, Message, OnMessagesListener
+
+EMPTY_DELIVERY = (None, None, None)
+
+
+class LocalChannel:
+    """
+    In-process stand-in for a channel to the message broker, e.g. for load tests without a broker.
+    Published messages are delivered to consumers in order, like the broker would, and the time
+    between publishing and acknowledging each of them is recorded.
+    """
+
+    def __init__(self):
+        self._deliveries: 'Queue[Message]' = Queue()
+        self._next_delivery_tag = 1
+        # publishing times and unacknowledged messages by delivery tag, in the order they were published
+        self._unacknowledged: 'OrderedDict[int, Tuple[float, Message]]' = OrderedDict()
+        # tags of the unacknowledged messages, that were delivered (and not requeued since)
+        self._delivered: Set[int] = set()
+        self._condition = Condition()
+        self._cancelled = Event()
+        self.acknowledgement_seconds: List[float] = []
+
+    def publish(self, routing_key: str, body: bytes) -> int:
+        """
+        :return: the delivery tag of the published message
+        """
+        with self._condition:
+            delivery_tag = self._next_delivery_tag
+            self._next_delivery_tag += 1
+            message = (Basic.Deliver(delivery_tag=delivery_tag, routing_key=routing_key), BasicProperties(), body)
+            self._unacknowledged[delivery_tag] = (time.perf_counter(), message)
+            # queued while holding the lock, so messages are delivered in the order of their tags
+            self._deliveries.put(message)
+        return delivery_tag
+
+    def consume(self, queue: str, inactivity_timeout: float) -> Iterator[Message]:
+        while not self._cancelled.is_set():
+            try:
+                message = self._deliveries.get(timeout=inactivity_timeout)
+            except Empty:
+                message = None
+            if message is not None:
+                with self._condition:
+                    self._delivered.add(message[0].delivery_tag)
+                yield message
+            else:
+                # the broker reports inactivity with an empty delivery
+                yield EMPTY_DELIVERY
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False):
+        acknowledged = time.perf_counter()
+        with self._condition:
+            for t in self._delivery_tags(delivery_tag, multiple):
+                published, _ = self._unacknowledged.pop(t)
+                self._delivered.discard(t)
+                self.acknowledgement_seconds.append(acknowledged - published)
+            self._condition.notify_all()
+
+    def basic_nack(self, delivery_tag: int, multiple: bool = False, requeue: bool = True):
+        with self._condition:
+            for t in self._delivery_tags(delivery_tag, multiple):
+                self._delivered.discard(t)
+                if requeue:
+                    # redelivered with the same tag, like the broker does within the same channel
+                    self._deliveries.put(self._unacknowledged[t][1])
+                else:
+                    self._unacknowledged.pop(t)
+            self._condition.notify_all()
+
+    def _delivery_tags(self, delivery_tag: int, multiple: bool) -> List[int]:
+        if multiple:
+            return [t for t in self._unacknowledged.keys() if t <= delivery_tag and t in self._delivered]
+        return [delivery_tag] if delivery_tag in self._delivered else []
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def wait_until_acknowledged(self, timeout: float) -> bool:
+        """
+        Blocks until every message published so far is acknowledged.
+
+        :return: True, if they were acknowledged within the timeout
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: len(self._unacknowledged) == 0, timeout)
+
+
+class LocalAMQPListener(AMQPListener):
+    """
+    Listener consuming the messages of a :class:`LocalChannel` instead of those of the message broker.
+    """
+
+    def __init__(self, channel: LocalChannel, on_messages: OnMessagesListener,
+                 batch_size: int = 100, batch_timeout_ms: int = 250):
+        super().__init__('localhost', 5672, '', '', on_messages, batch_size=batch_size,
+                         batch_timeout_ms=batch_timeout_ms)
+        self._channel = channel
+
+    def run(self):
+        self._consume(self._channel)
+        self._channel.cancel()
@@ -0,0 +1,36 @@
+import os
+import signal
+from threading import Event
+
+from eventsourcing.system import SingleThreadedRunner
+
+from application.datasets import Datasets
+from interface.service import build_system
+from util import logwrapper
+from util.environment import configure_event_store
+
+
+def run_projections(runner: SingleThreadedRunner, stopped: Event, poll_interval: float):
+    # the dataset service doesn't prompt us across process boundaries, so poll its notification log instead
+    while not stopped.is_set():
+        runner.receive_prompt(Datasets.__name__)
+        stopped.wait(poll_interval)
+
+
+if __name__ == '__main__':
+    configure_event_store()
+
+    # runs the indices of the dataset service, that was started with PROJECTIONS_MODE=process
+    runner = SingleThreadedRunner(build_system())
+    runner.start()
+
+    stopped = Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+
+    poll_interval = int(os.environ.get('PROJECTIONS_POLL_INTERVAL_MS', '200')) / 1000
+    logwrapper.info(f'Projector: Following dataset events every {poll_interval}s...')
+    try:
+        run_projections(runner, stopped, poll_interval)
+    finally:
+        runner.stop()
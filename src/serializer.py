@@ -1,11 +1,17 @@
-from typing import Iterable
+from typing import Iterable, Optional, Dict, Any, Callable, List
 
 from flask_hal.document import Document as HALDocument, Embedded
 from flask_hal.link import Link as HALLink, Collection as HALCollection
 
 from domain.dataset import Dataset
+from domain.documents import DocumentIdArray
 from domain.mapping import Mapping
-from util.datasplitter import split_data
+from domain.summary import DatasetSummary
+from util.datasplitter import split_dataset, DatasetSplit
+
+
+# looks up the urls of documents, datasets only know their ids
+DocumentUrls = Callable[[DocumentIdArray], List[str]]
 
 
 def serialize_mapping(mapping: Mapping) -> HALDocument:
@@ -19,11 +25,8 @@ def serialize_mapping(mapping: Mapping) -> HALDocument:
     )
 
 
-def serialize_dataset(dataset: Dataset, mappings: Iterable[Mapping],
-                      num_folds: int = None, test_split: float = None,
-                      valid_split: float = None, seed: str = None) -> HALDocument:
-    folds, test_data = split_data(dataset, num_folds, test_split, valid_split, seed)
-
+def _serialize_split_params(num_folds: int = None, test_split: float = None,
+                            valid_split: float = None, seed: str = None) -> Dict[str, Any]:
     data_info = {}
     if num_folds is not None:
         data_info['kFolds'] = num_folds
@@ -33,6 +36,17 @@ def serialize_dataset(dataset: Dataset, mappings: Iterable[Mapping],
         data_info['validationSplit'] = valid_split
     if seed is not None:
         data_info['seed'] = seed
+    return data_info
+
+
+def serialize_dataset(dataset: Dataset, mappings: Iterable[Mapping], document_urls: DocumentUrls,
+                      num_folds: int = None, test_split: float = None,
+                      valid_split: float = None, seed: str = None,
+                      split: Optional[DatasetSplit] = None) -> HALDocument:
+    if split is None:
+        split = split_dataset(dataset, num_folds, test_split, valid_split, seed)
+    documents = document_urls(dataset.train_validate_documents)
+    folds, test_data = split.gather(documents, document_urls(dataset.test_documents))
 
     data = {
         'folds': folds
@@ -42,7 +56,7 @@ def serialize_dataset(dataset: Dataset, mappings: Iterable[Mapping],
 
     return HALDocument(
         data={
-            **data_info,
+            **_serialize_split_params(num_folds, test_split, valid_split, seed),
             'id': dataset.id.hex,
             'name': dataset.name,
             'description': dataset.description,
@@ -53,5 +67,66 @@ def serialize_dataset(dataset: Dataset, mappings: Iterable[Mapping],
                 data=[serialize_mapping(m) for m in mappings]
             )
         },
-        links=HALCollection(*map(lambda l: HALLink(rel='', href=l), dataset.train_validate_documents)),
+        links=HALCollection(*map(lambda l: HALLink(rel='', href=l), documents)),
+    )
+
+
+def serialize_dataset_compact(dataset: Dataset, mappings: Iterable[Mapping], document_urls: DocumentUrls,
+                              num_folds: int = None, test_split: float = None,
+                              valid_split: float = None, seed: str = None,
+                              split: Optional[DatasetSplit] = None) -> HALDocument:
+    """
+    Serializes a dataset listing every document only once: train documents first, then
+    predefined test documents. Folds are given by the validation fold of each document
+    (-1 for documents, that are never validated on), the test documents by their indices.
+    Train documents of a fold are all documents, that are neither validated on in that
+    fold nor test documents.
+    """
+    if split is None:
+        split = split_dataset(dataset, num_folds, test_split, valid_split, seed)
+
+    documents = document_urls(dataset.train_validate_documents)
+    validation_folds = split.validation_folds().tolist()
+    if split.has_test_split:
+        test_indices = split.test_indices().tolist()
+    else:
+        test_indices = list(range(len(documents), len(documents) + len(dataset.test_documents)))
+        documents.extend(document_urls(dataset.test_documents))
+        validation_folds.extend([-1] * len(dataset.test_documents))
+
+    return HALDocument(
+        data={
+            **_serialize_split_params(num_folds, test_split, valid_split, seed),
+            'id': dataset.id.hex,
+            'name': dataset.name,
+            'description': dataset.description,
+            'data': {
+                'documents': documents,
+                'numFolds': split.num_folds,
+                'validationFolds': validation_folds,
+                'test': test_indices
+            }
+        },
+        embedded={
+            'mappings': Embedded(
+                data=[serialize_mapping(m) for m in mappings]
+            )
+        }
+    )
+
+
+def serialize_dataset_summary(summary: DatasetSummary, mappings: Iterable[Mapping]) -> HALDocument:
+    return HALDocument(
+        data={
+            'id': summary.dataset_id.hex,
+            'name': summary.name,
+            'description': summary.description,
+            'numTrainDocuments': summary.num_train_documents,
+            'numTestDocuments': summary.num_test_documents
+        },
+        embedded={
+            'mappings': Embedded(
+                data=[serialize_mapping(m) for m in mappings]
+            )
+        }
     )
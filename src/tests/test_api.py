@@ -0,0 +1,370 @@
+import gzip
+import json
+import zlib
+from unittest import TestCase
+from unittest.mock import patch
+from urllib.parse import urlsplit
+
+from flask import Flask
+from flask_restful import Api
+
+from api.compression import Compression, ENCODERS
+from api.resources import Dataset, DatasetList, DatasetImport, COMPACT_DATASET_MIMETYPE
+from application.datasets import DatasetChanged, DocumentNotRegistered, RegistrationConflict
+from domain.registry import DocumentIdCollision
+from interface.service import DatasetsService
+
+
+class ApiTestCase(TestCase):
+    def setUp(self):
+        self.datasets_service = DatasetsService()
+        app = self.app = Flask(__name__)
+        api = Api(app, prefix='/api/v1/')
+        resource_kwargs = {'datasets_service': self.datasets_service}
+        api.add_resource(Dataset, '/datasets/<dataset_id>', resource_class_kwargs=resource_kwargs)
+        api.add_resource(DatasetList, '/datasets', resource_class_kwargs=resource_kwargs)
+        api.add_resource(DatasetImport, '/datasets/import', '/datasets/<dataset_id>/documents',
+                         resource_class_kwargs={**resource_kwargs, 'chunk_size': 4})
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.datasets_service.shutdown()
+
+    def create_dataset(self, num_documents: int = 10) -> str:
+        dataset_id = self.datasets_service.create_dataset('dataset').hex
+        documents = [f'http://documents.org/{i}' for i in range(num_documents)]
+        self.datasets_service.add_train_documents_to_dataset(dataset_id, documents)
+        return dataset_id
+
+
+class TestConditionalRequests(ApiTestCase):
+    def test_unchanged_dataset_is_not_modified(self):
+        dataset_id = self.create_dataset()
+        url = f'/api/v1/datasets/{dataset_id}?kFolds=2&seed=1'
+
+        etag = self.client.get(url).headers['ETag']
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+
+        # other split parameters are another representation
+        response = self.client.get(f'/api/v1/datasets/{dataset_id}?kFolds=3&seed=1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+        self.datasets_service.update_meta(dataset_id, 'new name', '')
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_unseeded_random_splits_are_not_tagged(self):
+        dataset_id = self.create_dataset()
+        response = self.client.get(f'/api/v1/datasets/{dataset_id}?testSplit=0.2')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response.headers)
+
+    def test_patch_requires_current_version(self):
+        dataset_id = self.create_dataset()
+        etag = self.client.get(f'/api/v1/datasets/{dataset_id}').headers['ETag']
+
+        response = self.client.patch(f'/api/v1/datasets/{dataset_id}', json={'id': dataset_id, 'name': 'first'},
+                                     headers={'If-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.patch(f'/api/v1/datasets/{dataset_id}', json={'id': dataset_id, 'name': 'second'},
+                                     headers={'If-Match': etag})
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(self.datasets_service.get_dataset(dataset_id).name, 'first')
+
+
+    def test_concurrently_changed_dataset_is_a_conflict(self):
+        dataset_id = self.create_dataset()
+        with patch.object(self.datasets_service, 'patch_dataset', side_effect=DatasetChanged()):
+            response = self.client.patch(f'/api/v1/datasets/{dataset_id}', json={'id': dataset_id, 'name': 'new'})
+        self.assertEqual(response.status_code, 409)
+
+
+class TestCompactRepresentation(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset_id = self.create_dataset(10)
+        self.test_documents = ['http://documents.org/test/0', 'http://documents.org/test/1']
+        self.datasets_service.add_test_documents_to_dataset(self.dataset_id, self.test_documents)
+
+    def test_documents_are_listed_once(self):
+        response = self.client.get(f'/api/v1/datasets/{self.dataset_id}?representation=compact')
+        self.assertEqual(response.mimetype, COMPACT_DATASET_MIMETYPE)
+        data = response.json['data']
+        self.assertEqual(len(data['documents']), 12)
+        self.assertEqual(len(set(data['documents'])), 12)
+        self.assertEqual([data['documents'][i] for i in data['test']], self.test_documents)
+        # test documents are never validated on
+        self.assertEqual([data['validationFolds'][i] for i in data['test']], [-1, -1])
+
+    def test_compact_representation_is_negotiated(self):
+        url = f'/api/v1/datasets/{self.dataset_id}'
+        compact = self.client.get(url, headers={'Accept': COMPACT_DATASET_MIMETYPE})
+        self.assertEqual(compact.mimetype, COMPACT_DATASET_MIMETYPE)
+        self.assertIn('documents', compact.json['data'])
+
+        full = self.client.get(url)
+        self.assertEqual(full.mimetype, 'application/json')
+        self.assertIn('folds', full.json['data'])
+        self.assertNotEqual(compact.headers['ETag'], full.headers['ETag'])
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': compact.headers['ETag']}).status_code, 200)
+
+    def test_validation_folds_of_seeded_splits(self):
+        url = f'/api/v1/datasets/{self.dataset_id}?kFolds=5&seed=1'
+        data = self.client.get(f'{url}&representation=compact').json['data']
+        self.assertEqual(data['numFolds'], 5)
+        self.assertEqual(data, self.client.get(f'{url}&representation=compact').json['data'])
+
+        full = self.client.get(url).json['data']
+        for fold, folds in enumerate(full['folds']):
+            validated = [document for document, document_fold in zip(data['documents'], data['validationFolds'])
+                         if document_fold == fold]
+            self.assertEqual(validated, folds['valid'])
+        self.assertEqual([data['documents'][i] for i in data['test']], full['test'])
+
+
+class TestDatasetListing(ApiTestCase):
+    def test_datasets_are_streamed_as_ndjson(self):
+        dataset_ids = {self.create_dataset(i) for i in range(5)}
+        response = self.client.get('/api/v1/datasets', headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertIn('Accept', response.headers['Vary'])
+
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 5)
+        datasets = [json.loads(line) for line in lines]
+        self.assertTrue(all(isinstance(dataset, dict) for dataset in datasets))
+        self.assertEqual({dataset['id'] for dataset in datasets}, dataset_ids)
+        self.assertEqual(datasets, self.client.get('/api/v1/datasets').json)
+
+
+    def get_summaries(self, accept: str = 'application/json'):
+        response = self.client.get('/api/v1/datasets?view=summary', headers={'Accept': accept})
+        self.assertEqual(response.status_code, 200)
+        if response.mimetype == 'application/x-ndjson':
+            summaries = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        else:
+            summaries = response.json
+        return {summary['id']: summary for summary in summaries}
+
+    def test_summaries_are_listed(self):
+        dataset_id = self.create_dataset(10)
+        self.datasets_service.add_test_documents_to_dataset(dataset_id, ['http://documents.org/test'])
+
+        for accept in ('application/json', 'application/x-ndjson'):
+            summary = self.get_summaries(accept)[dataset_id]
+            self.assertEqual((summary['numTrainDocuments'], summary['numTestDocuments']), (10, 1))
+            self.assertEqual(summary['name'], 'dataset')
+            self.assertNotIn('data', summary)
+
+    def test_summaries_follow_changes(self):
+        dataset_id, other_dataset_id = self.create_dataset(10), self.create_dataset(3)
+        response = self.client.patch(f'/api/v1/datasets/{dataset_id}', json={
+            'id': dataset_id, 'name': 'patched', 'trainDocuments': ['http://documents.org/0', 'http://documents.org/1'],
+            'testDocuments': ['http://documents.org/test']
+        })
+        self.assertEqual(response.status_code, 200)
+        summary = self.get_summaries()[dataset_id]
+        self.assertEqual((summary['name'], summary['numTrainDocuments'], summary['numTestDocuments']),
+                         ('patched', 2, 1))
+
+        self.assertEqual(self.client.delete(f'/api/v1/datasets/{other_dataset_id}').status_code, 200)
+        self.assertEqual(list(self.get_summaries('application/x-ndjson').keys()), [dataset_id])
+
+
+    def test_datasets_are_paged(self):
+        dataset_ids = sorted(self.create_dataset(1) for _ in range(7))
+        url, pages = '/api/v1/datasets?limit=3', []
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([dataset['id'] for dataset in response.json])
+            link = response.headers.get('Link')
+            url = None
+            if link is not None:
+                self.assertTrue(link.endswith('; rel="next"'))
+                next_page = urlsplit(link[1:link.index('>')])
+                url = f'{next_page.path}?{next_page.query}'
+        self.assertEqual(pages, [dataset_ids[0:3], dataset_ids[3:6], dataset_ids[6:]])
+
+        # the link of a full last page leads to an empty one
+        last_page = self.client.get(f'/api/v1/datasets?limit=3&after={dataset_ids[-1]}')
+        self.assertEqual(last_page.json, [])
+        self.assertNotIn('Link', last_page.headers)
+
+    def test_malformed_cursors_are_rejected(self):
+        self.assertEqual(self.client.get('/api/v1/datasets?after=not-a-uuid').status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/datasets?limit=0').status_code, 400)
+
+
+class TestRegistryErrors(ApiTestCase):
+    def test_unregistered_documents_are_unavailable(self):
+        dataset_id = self.create_dataset()
+        with patch.object(self.datasets_service, 'get_document_urls', side_effect=DocumentNotRegistered()):
+            self.assertEqual(self.client.get(f'/api/v1/datasets/{dataset_id}').status_code, 503)
+            self.assertEqual(self.client.get('/api/v1/datasets').status_code, 503)
+
+            response = self.client.get('/api/v1/datasets', headers={'Accept': 'application/x-ndjson'})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('error', json.loads(response.get_data(as_text=True).splitlines()[-1]))
+
+    def test_conflicting_registrations_are_retried_by_the_client(self):
+        dataset_id = self.create_dataset()
+        with patch.object(self.datasets_service, 'patch_dataset', side_effect=RegistrationConflict()):
+            response = self.client.patch(f'/api/v1/datasets/{dataset_id}', json={'id': dataset_id, 'name': 'new'})
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+
+    def test_colliding_documents_are_a_conflict(self):
+        urls = ['http://documents.org/a', 'http://documents.org/b']
+        collision = DocumentIdCollision(f'Documents {urls[0]} and {urls[1]} have the same id 1.')
+        with patch.object(self.datasets_service, 'create_dataset', side_effect=collision):
+            response = self.client.post('/api/v1/datasets', json={'name': 'dataset', 'trainDocuments': urls})
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('same id', response.get_json())
+
+
+class TestCompression(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.compression = Compression(self.app, min_size=1024)
+
+    def test_large_responses_are_compressed(self):
+        dataset_id = self.create_dataset(100)
+        url = f'/api/v1/datasets/{dataset_id}?kFolds=5'
+        uncompressed = self.client.get(url)
+
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.data)), uncompressed.json)
+        self.assertLess(len(response.data), len(uncompressed.data) / 5)
+
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip;q=0.5, deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(json.loads(zlib.decompress(response.data)), uncompressed.json)
+
+    def test_small_responses_are_not_compressed(self):
+        dataset_id = self.create_dataset(1)
+        response = self.client.get(f'/api/v1/datasets/{dataset_id}', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_large_and_streamed_responses_are_compressed_in_blocks(self):
+        self.compression.stream_size = 0
+        self.compression.BLOCK_SIZE = 256
+        dataset_id = self.create_dataset(100)
+        url = f'/api/v1/datasets/{dataset_id}'
+        uncompressed = self.client.get(url)
+
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(json.loads(gzip.decompress(response.data)), uncompressed.json)
+
+        for _ in range(5):
+            self.create_dataset(10)
+        response = self.client.get('/api/v1/datasets', headers={'Accept-Encoding': 'gzip',
+                                                                'Accept': 'application/x-ndjson'})
+        lines = gzip.decompress(response.data).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 6)
+
+    def test_streamed_chunks_are_sent_as_they_are_produced(self):
+        produced = []
+
+        def lines():
+            for i in range(3):
+                produced.append(i)
+                yield json.dumps({'line': i}) + '\n'
+
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = self.compression._compress_chunks(lines(), ENCODERS['gzip'](6), 'utf-8')
+        for i, compressed in zip(range(3), chunks):
+            self.assertEqual(len(produced), i + 1)
+            self.assertEqual(json.loads(decompressor.decompress(compressed)), {'line': i})
+
+    def test_not_modified_responses_vary_by_coding(self):
+        dataset_id = self.create_dataset(100)
+        url = f'/api/v1/datasets/{dataset_id}'
+        etag = self.client.get(url, headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+
+    def test_compressed_representations_are_tagged_by_coding(self):
+        dataset_id = self.create_dataset(100)
+        url = f'/api/v1/datasets/{dataset_id}'
+        etag = self.client.get(url).headers['ETag']
+        compressed_etag = self.client.get(url, headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+        self.assertNotEqual(etag, compressed_etag)
+
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': compressed_etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], compressed_etag)
+
+
+class TestImport(ApiTestCase):
+    def post_lines(self, url: str, lines):
+        body = ''.join(json.dumps(line) + '\n' for line in lines)
+        response = self.client.post(url, data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    def test_import_datasets(self):
+        reports = self.post_lines('/api/v1/datasets/import', [
+            {'name': 'first', 'mappings': [{'name': 'PER'}]},
+            *({'document': f'http://documents.org/{i}'} for i in range(10)),
+            {'document': 'http://documents.org/test', 'test': True},
+            {'document': 'not a url'},
+            {'name': 'second', 'description': 'more documents'},
+            {'document': 'http://documents.org/0'},
+        ])
+
+        self.assertEqual(reports[-1], {'done': True, 'datasets': 2, 'trainDocuments': 11,
+                                       'testDocuments': 1, 'rejected': 1})
+        self.assertEqual([r['line'] for r in reports if 'error' in r], [13])
+
+        first_id, second_id = [r['dataset'].split('/')[-1] for r in reports if r.get('created')]
+        first = self.datasets_service.get_dataset(first_id)
+        document_urls = self.datasets_service.get_document_urls
+        self.assertEqual(document_urls(first.train_validate_documents), [f'http://documents.org/{i}' for i in range(10)])
+        self.assertEqual(document_urls(first.test_documents), ['http://documents.org/test'])
+        self.assertEqual(self.datasets_service.get_mappings_for_dataset(first)[0].name, 'PER')
+        self.assertEqual(self.datasets_service.get_dataset(second_id).description, 'more documents')
+
+        # creation, its mappings, then one event per chunk: three of train documents and one of test documents
+        self.assertEqual(first.version, 6)
+
+    def test_import_documents_into_dataset(self):
+        dataset_id = self.create_dataset(num_documents=2)
+        reports = self.post_lines(f'/api/v1/datasets/{dataset_id}/documents', [
+            {'document': f'http://documents.org/{i}'} for i in range(6)
+        ])
+        self.assertEqual(reports[-1]['trainDocuments'], 4)
+        self.assertEqual(reports[-1]['datasets'], 0)
+        self.assertEqual(len(self.datasets_service.get_dataset(dataset_id).train_validate_documents), 6)
+
+    def test_import_into_unknown_dataset(self):
+        for dataset_id in ['0' * 32, 'not-a-uuid']:
+            response = self.client.post(f'/api/v1/datasets/{dataset_id}/documents', data='',
+                                        content_type='application/x-ndjson')
+            self.assertEqual(response.status_code, 404)
+
+    def test_import_progress_is_compressed(self):
+        Compression(self.app)
+        lines = [{'name': 'dataset'}, *({'document': f'http://documents.org/{i}'} for i in range(10))]
+        response = self.client.post('/api/v1/datasets/import', data=''.join(json.dumps(line) + '\n' for line in lines),
+                                    content_type='application/x-ndjson', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        reports = [json.loads(line) for line in gzip.decompress(response.data).decode('utf-8').splitlines()]
+        self.assertEqual([r['trainDocuments'] for r in reports if 'trainDocuments' in r], [4, 8, 10, 10])
+        self.assertTrue(reports[-1]['done'])
+
+    def test_documents_need_a_dataset(self):
+        reports = self.post_lines('/api/v1/datasets/import', [{'document': 'http://documents.org/0'}])
+        self.assertIn('error', reports[0])
+        self.assertEqual(reports[-1]['rejected'], 1)
+
+        response = self.client.post('/api/v1/datasets/import', json={'name': 'dataset'})
+        self.assertEqual(response.status_code, 415)
@@ -1,14 +1,27 @@
+import os
 from unittest import TestCase
+from unittest.mock import patch
+from uuid import uuid4
 
-from application.datasets import Datasets
-from application.indices import ByDocumentIndices
+from eventsourcing.application import AggregateNotFound
+from eventsourcing.persistence import JSONTranscoder, IntegrityError
+
+from application.caching import clone_aggregate
+from application.datasets import Datasets, DatasetChanged, DocumentNotRegistered
+from application.indices import ByDocumentIndices, DatasetIndices
+from application.mappings import Mappings
+from application.transcodings import CompactJSONTranscoder, PrefixCodedStrings
+from domain.documents import document_id, document_ids
+from domain.index import ByDocumentIndex, DocumentIndexBucket, DatasetIndexShard, DatasetIndex
+from domain.registry import DocumentRegistryBucket
+from interface.service import DatasetsService
 
 
 class TestDatasetAggregate(TestCase):
     def test_datasets(self):
         datasets = Datasets()
 
-        dataset_id = datasets.create_dataset()
+        dataset_id = datasets.create_dataset('dataset')
         self.assertIsNotNone(dataset_id)
 
         dataset = datasets.get_dataset(dataset_id)
@@ -23,3 +36,403 @@ class TestDatasetAggregate(TestCase):
 
         index = indices.get_index(index_id)
         self.assertIsNotNone(index)
+
+
+class TestDatasetCommands(TestCase):
+    def test_patch_is_saved_at_once(self):
+        datasets = Datasets()
+        dataset_id = datasets.create_dataset('dataset', 'description', ['1', '2'], ['3'])
+        self.assertEqual(datasets.get_dataset(dataset_id).version, 3)
+
+        mapping_id = uuid4()
+        with patch.object(datasets.events, 'put', wraps=datasets.events.put) as put:
+            dataset = datasets.patch_dataset(dataset_id, name='new name', train_documents=['2', '4'],
+                                             test_documents=['3'], mappings=[mapping_id])
+            # new documents are registered beforehand, in a transaction of their own
+            dataset_puts = [c for c in put.call_args_list if any(e.originator_id == dataset_id for e in c.args[0])]
+            self.assertEqual(len(dataset_puts), 1)
+
+        # removal and addition of train documents, meta data and mappings
+        self.assertEqual(dataset.version, 7)
+        self.assertEqual(datasets.get_document_urls(dataset.train_validate_documents), ['2', '4'])
+        self.assertEqual(datasets.get_dataset(dataset_id).name, 'new name')
+        self.assertEqual(datasets.get_dataset(dataset_id).field_mappings, [mapping_id])
+
+    def test_empty_patch_has_no_events(self):
+        datasets = Datasets()
+        dataset_id = datasets.create_dataset('dataset', 'description', ['1', '2'])
+        version = datasets.get_dataset(dataset_id).version
+
+        dataset = datasets.patch_dataset(dataset_id, name='dataset', description='description',
+                                         train_documents=['2', '1'], test_documents=[], mappings=[])
+
+        self.assertEqual(dataset.version, version)
+
+    def test_concurrently_changed_dataset_is_not_patched(self):
+        datasets = Datasets()
+        dataset_id = datasets.create_dataset('dataset')
+        get_for_update = datasets.get_dataset_for_update
+
+        def load_then_change_concurrently(loaded_id):
+            dataset = get_for_update(loaded_id)
+            other = clone_aggregate(dataset)
+            other.update_meta('concurrent name', '')
+            datasets.save(other)
+            return dataset
+
+        with patch.object(datasets, 'get_dataset_for_update', side_effect=load_then_change_concurrently):
+            with self.assertRaises(DatasetChanged):
+                datasets.patch_dataset(dataset_id, name='other name')
+        self.assertEqual(datasets.get_dataset(dataset_id).name, 'concurrent name')
+
+    def test_patch_of_changed_dataset_is_rejected(self):
+        datasets = Datasets()
+        dataset_id = datasets.create_dataset('dataset')
+        version = datasets.get_dataset(dataset_id).version
+        datasets.update_meta(dataset_id, 'new name', None)
+
+        with self.assertRaises(DatasetChanged):
+            datasets.patch_dataset(dataset_id, version, name='other name')
+        self.assertEqual(datasets.get_dataset(dataset_id).name, 'new name')
+
+
+class TestDocumentRegistry(TestCase):
+    def test_document_urls_are_registered_once(self):
+        datasets = Datasets()
+        urls = [f'http://documents.org/{i}' for i in range(10)]
+        ids = datasets.register_documents(urls)
+        self.assertEqual(ids, [document_id(url) for url in urls])
+        self.assertEqual(datasets.get_document_urls(list(reversed(ids))), list(reversed(urls)))
+
+        position = datasets.recorder.max_notification_id()
+        self.assertEqual(datasets.register_documents(urls[:5]), ids[:5])
+        self.assertEqual(datasets.recorder.max_notification_id(), position)
+
+    def test_unknown_documents_are_rejected(self):
+        datasets = Datasets()
+        with self.assertRaises(DocumentNotRegistered):
+            datasets.get_document_urls([document_id('http://documents.org/unknown')])
+
+        # documents of buckets, that were loaded for other documents
+        registered_id = datasets.register_documents(['http://documents.org/0'])[0]
+        with self.assertRaises(DocumentNotRegistered):
+            datasets.get_document_urls([registered_id, registered_id + DocumentRegistryBucket.NUM_BUCKETS])
+
+
+class TestSnapshotting(TestCase):
+    def test_datasets_are_snapshotted_by_interval(self):
+        datasets = Datasets(env={'SNAPSHOTTING_INTERVAL': '3', 'SNAPSHOTTING_MAX_REPLAY_BYTES': '0'})
+
+        dataset_id = datasets.create_dataset('dataset', 'description')
+        datasets.add_train_documents(dataset_id, ['http://documents/1'])
+        self.assertEqual(len(list(datasets.snapshots.get(dataset_id))), 0)
+
+        datasets.add_train_documents(dataset_id, ['http://documents/2'])
+        snapshots = list(datasets.snapshots.get(dataset_id))
+        self.assertEqual(len(snapshots), 1)
+        self.assertEqual(snapshots[0].originator_version, 3)
+
+        datasets.remove_train_documents(dataset_id, ['http://documents/1'])
+        dataset = datasets.get_dataset(dataset_id)
+        self.assertEqual(dataset.version, 4)
+        self.assertEqual(datasets.get_document_urls(dataset.train_validate_documents), ['http://documents/2'])
+
+    def test_datasets_are_snapshotted_by_replay_size(self):
+        datasets = Datasets(env={'SNAPSHOTTING_INTERVAL': '0', 'SNAPSHOTTING_MAX_REPLAY_BYTES': '1000'})
+
+        dataset_id = datasets.create_dataset('dataset', 'description')
+        datasets.add_train_documents(dataset_id, ['http://documents/1'])
+        self.assertEqual(len(list(datasets.snapshots.get(dataset_id))), 0)
+
+        # the stored events now exceed the threshold
+        datasets.add_train_documents(dataset_id, [f'http://documents/{i}' for i in range(100)])
+        self.assertEqual(len(list(datasets.snapshots.get(dataset_id))), 1)
+
+    def test_conflicting_snapshots_are_ignored(self):
+        datasets = Datasets(env={'SNAPSHOTTING_INTERVAL': '2', 'SNAPSHOTTING_MAX_REPLAY_BYTES': '0'})
+        dataset_id = datasets.create_dataset('dataset', 'description')
+
+        # e.g. another process took the snapshot of the same version first
+        with patch.object(datasets.snapshots, 'put', side_effect=IntegrityError()) as put:
+            datasets.add_train_documents(dataset_id, ['http://documents/1'])
+            datasets.cache.clear()
+            self.assertEqual(datasets.get_dataset(dataset_id).version, 2)
+            self.assertTrue(put.called)
+        self.assertEqual(len(list(datasets.snapshots.get(dataset_id))), 0)
+
+    def test_reads_never_snapshot(self):
+        datasets = Datasets(env={'SNAPSHOTTING_INTERVAL': '0', 'SNAPSHOTTING_MAX_REPLAY_BYTES': '0'})
+        dataset_id = datasets.create_dataset('dataset', 'description')
+        for i in range(5):
+            datasets.add_train_documents(dataset_id, [f'http://documents/{i}'])
+
+        datasets.repository.policy.interval = 1
+        datasets.cache.clear()
+        with patch.object(datasets.snapshots, 'put') as put:
+            self.assertEqual(datasets.get_dataset(dataset_id).version, 6)
+        put.assert_not_called()
+        # the next write snapshots the long history instead
+        datasets.update_meta(dataset_id, 'other name', None)
+        self.assertEqual(len(list(datasets.snapshots.get(dataset_id))), 1)
+
+    def test_backfill_snapshots(self):
+        datasets = Datasets(env={'SNAPSHOTTING_INTERVAL': '0', 'SNAPSHOTTING_MAX_REPLAY_BYTES': '0'})
+        dataset_id = datasets.create_dataset('dataset', 'description')
+        for i in range(5):
+            datasets.add_train_documents(dataset_id, [f'http://documents/{i}'])
+
+        datasets.repository.policy.interval = 5
+        self.assertEqual(datasets.backfill_snapshots(), 1)
+        self.assertEqual(datasets.get_dataset(dataset_id).version, 6)
+        self.assertEqual(datasets.backfill_snapshots(), 0)
+
+    def test_indices_are_snapshotted(self):
+        with patch.dict(os.environ, {'SNAPSHOTTING_INTERVAL': '1'}):
+            datasets_service = DatasetsService()
+        dataset_id = datasets_service.create_dataset('dataset')
+        datasets_service.add_train_documents_to_dataset(dataset_id.hex, ['http://documents/1'])
+
+        indices = datasets_service._runner.get(ByDocumentIndices)
+        index_id = DocumentIndexBucket.create_id(DocumentIndexBucket.bucket_for(document_id('http://documents/1')))
+        snapshots = list(indices.snapshots.get(index_id))
+        self.assertEqual(len(snapshots), 1)
+        self.assertEqual(indices.get_datasets_by_document('http://documents/1'), [dataset_id])
+        datasets_service.shutdown()
+
+
+class TestEventCompression(TestCase):
+    def test_large_events_are_compressed(self):
+        datasets = Datasets(env={'EVENT_COMPRESSION': 'y', 'EVENT_COMPRESSION_MIN_SIZE': '500',
+                                 'SNAPSHOTTING_INTERVAL': '0', 'SNAPSHOTTING_MAX_REPLAY_BYTES': '0'})
+        dataset_id = datasets.create_dataset('dataset')
+        documents = [f'http://documents.org/{i}' for i in range(100)]
+        datasets.add_train_documents(dataset_id, documents)
+
+        created, added = datasets.recorder.select_events(dataset_id)
+        self.assertTrue(created.state.startswith(b'{'))
+        self.assertFalse(added.state.startswith(b'{'))
+        self.assertLess(len(added.state), len(''.join(documents)))
+
+        # events stored uncompressed, e.g. before compression was enabled, are read along with compressed ones
+        datasets.mapper.compressor.min_size = None
+        datasets.add_test_documents(dataset_id, documents[:50])
+        self.assertTrue(datasets.recorder.select_events(dataset_id)[-1].state.startswith(b'{'))
+
+        datasets.cache.clear()
+        dataset = datasets.get_dataset(dataset_id)
+        self.assertEqual(datasets.get_document_urls(dataset.train_validate_documents), documents)
+        self.assertEqual(len(dataset.test_documents), 50)
+
+    def test_compression_is_off_by_default(self):
+        datasets = Datasets()
+        dataset_id = datasets.create_dataset('dataset')
+        datasets.add_train_documents(dataset_id, [f'http://documents.org/{i}' for i in range(100)])
+        self.assertTrue(all(e.state.startswith(b'{') for e in datasets.recorder.select_events(dataset_id)))
+
+
+class TestTranscodings(TestCase):
+    def setUp(self):
+        self.plain, self.compact = JSONTranscoder(), CompactJSONTranscoder()
+        for transcoder in (self.plain, self.compact):
+            Datasets().register_transcodings(transcoder)
+
+    def test_lists_are_stored_compactly(self):
+        state = {
+            'mappings': [uuid4() for _ in range(5)],
+            'document_ids': document_ids([f'http://documents.org/{i // 10}/{i}' for i in range(30)]),
+            'urls': ['http://documents.org/0/0', 'no prefix', ''],
+            'state': {'datasets': {'http://documents.org/0': {uuid4(), uuid4()}}, 'tags': ['a', 'b']},
+        }
+        encoded = self.compact.encode(state)
+        self.assertEqual(self.compact.decode(encoded), state)
+        self.assertLess(len(encoded), len(self.plain.encode(state)) * 2 / 3)
+        self.assertNotIn(b'uuid_hex', encoded)
+
+    def test_prefix_coded_states_are_decoded(self):
+        urls = ['line\nbreak'] + [f'http://documents.org/{i // 10}/{i}' for i in range(30)] + ['no prefix', '']
+        self.assertNotIn(b'strings_prefix_coded', self.compact.encode({'urls': urls}))
+
+        for strings in (urls, urls[1:]):
+            encoded = self.compact.encode({'urls': PrefixCodedStrings(strings)})
+            self.assertIn(b'strings_prefix_coded', encoded)
+            self.assertEqual(self.compact.decode(encoded), {'urls': strings})
+
+    def test_plain_states_are_decoded(self):
+        state = {'mappings': [uuid4()], 'document_ids': [f'http://documents.org/{i}' for i in range(10)]}
+        self.assertEqual(self.compact.decode(self.plain.encode(state)), state)
+
+
+class TestAggregateCache(TestCase):
+    def test_repeated_reads_are_cached(self):
+        datasets = Datasets(env={'AGGREGATE_CACHE_SIZE': '2'})
+        dataset_id = datasets.create_dataset('dataset', 'description')
+
+        dataset = datasets.get_dataset(dataset_id)
+        self.assertIs(datasets.get_dataset(dataset_id), dataset)
+        self.assertEqual(datasets.cache.stats()['misses'], 1)
+        self.assertEqual(datasets.cache.stats()['hits'], 1)
+
+        # commands must not change the cached aggregate in place
+        datasets.add_train_documents(dataset_id, ['http://documents/1'])
+        self.assertEqual(len(dataset.train_validate_documents), 0)
+        updated_dataset = datasets.get_dataset(dataset_id)
+        self.assertEqual(datasets.get_document_urls(updated_dataset.train_validate_documents), ['http://documents/1'])
+        self.assertEqual(datasets.cache.stats()['misses'], 1)
+
+        for _ in range(2):
+            datasets.get_dataset(datasets.create_dataset('other dataset', ''))
+        self.assertEqual(datasets.cache.stats()['evictions'], 1)
+        self.assertNotIn(dataset_id, datasets.cache)
+
+    def test_cached_aggregates_are_refreshed(self):
+        datasets = Datasets()
+        dataset_id = datasets.create_dataset('dataset', 'description')
+        datasets.get_dataset(dataset_id)
+
+        # simulate a write by another process, which doesn't notify this application
+        dataset = datasets.repository.get(dataset_id)
+        dataset.update_meta('new name', 'new description')
+        datasets.events.put(dataset.collect_events())
+
+        self.assertEqual(datasets.get_dataset(dataset_id).name, 'new name')
+        self.assertEqual(datasets.cache.stats()['refreshes'], 1)
+
+    def test_bulk_loading_uses_snapshots(self):
+        datasets = Datasets(env={'SNAPSHOTTING_INTERVAL': '2', 'SNAPSHOTTING_MAX_REPLAY_BYTES': '0'})
+        dataset_ids = [datasets.create_dataset(f'dataset {i}', '') for i in range(3)]
+        for i, dataset_id in enumerate(dataset_ids):
+            datasets.add_train_documents(dataset_id, [f'http://documents/{j}' for j in range(i + 1)])
+            datasets.add_test_documents(dataset_id, ['http://documents/test'])
+
+        datasets.cache.clear()
+        loaded = datasets.get_datasets(dataset_ids)
+        self.assertEqual([d.id for d in loaded], dataset_ids)
+        self.assertEqual([len(d.train_validate_documents) for d in loaded], [1, 2, 3])
+        self.assertEqual([d.version for d in loaded], [3, 3, 3])
+
+
+class TestMappings(TestCase):
+    def test_mappings_are_fetched_in_batches_and_memoized(self):
+        mappings = Mappings()
+        mapping_ids = [mappings.create_mapping(f'mapping {i}', '', ['alias'], ['task']) for i in range(3)]
+
+        loaded = mappings.get_mappings(list(reversed(mapping_ids)))
+        self.assertEqual([m.name for m in loaded], ['mapping 2', 'mapping 1', 'mapping 0'])
+        self.assertEqual(mappings.cache.stats()['misses'], 3)
+
+        self.assertIs(mappings.get_mapping(mapping_ids[0]), loaded[2])
+        self.assertEqual(mappings.cache.stats()['hits'], 1)
+
+    def test_missing_mappings_are_not_found(self):
+        mappings = Mappings()
+        with self.assertRaises(AggregateNotFound):
+            mappings.get_mappings([uuid4()])
+
+
+class TestDocumentIndex(TestCase):
+    def setUp(self):
+        self.datasets_service = DatasetsService()
+        self.indices = self.datasets_service._runner.get(ByDocumentIndices)
+
+    def tearDown(self):
+        self.datasets_service.shutdown()
+
+    def test_documents_are_indexed_in_buckets(self):
+        document_ids = [f'http://documents/{i}' for i in range(1000)]
+        dataset_id = self.datasets_service.create_dataset('dataset')
+        other_dataset_id = self.datasets_service.create_dataset('other dataset')
+        num_events = self.indices.recorder.max_notification_id()
+
+        self.datasets_service.add_train_documents_to_dataset(dataset_id.hex, document_ids)
+        self.datasets_service.add_test_documents_to_dataset(other_dataset_id.hex, document_ids[:10])
+        # a single event per bucket, instead of one per document
+        self.assertLessEqual(self.indices.recorder.max_notification_id() - num_events,
+                             2 * DocumentIndexBucket.NUM_BUCKETS + 10)
+
+        datasets_by_document = self.indices.get_datasets_by_documents(document_ids[:20])
+        self.assertEqual(set(datasets_by_document[document_ids[0]]), {dataset_id, other_dataset_id})
+        self.assertEqual(datasets_by_document[document_ids[10]], [dataset_id])
+        self.assertEqual(self.indices.get_datasets_by_document('http://documents/unknown'), [])
+
+        self.datasets_service.remove_train_documents_from_dataset(dataset_id.hex, document_ids[:5])
+        self.assertEqual(self.indices.get_datasets_by_document(document_ids[0]), [other_dataset_id])
+        self.assertEqual(self.indices.get_datasets_by_document(document_ids[10]), [dataset_id])
+
+    def test_index_can_be_rebuilt(self):
+        dataset_id = self.datasets_service.create_dataset('dataset')
+        self.datasets_service.add_train_documents_to_dataset(dataset_id.hex, ['http://documents/1'])
+
+        self.assertEqual(self.datasets_service.rebuild_document_index(), 1)
+        self.assertEqual(self.indices.get_datasets_by_document('http://documents/1'), [dataset_id])
+
+    def test_documents_of_the_legacy_index_are_found(self):
+        dataset_id = self.datasets_service.create_dataset('dataset')
+        legacy_index = ByDocumentIndex.create('http://documents/legacy')
+        legacy_index.add_dataset_to_index(dataset_id)
+        self.indices.save(legacy_index)
+
+        self.assertEqual(self.indices.get_datasets_by_document('http://documents/legacy'), [dataset_id])
+        self.assertEqual(self.indices.get_datasets_by_document('http://documents/unknown'), [])
+
+
+class TestDatasetIndex(TestCase):
+    def setUp(self):
+        self.datasets_service = DatasetsService()
+        self.indices = self.datasets_service._runner.get(DatasetIndices)
+
+    def tearDown(self):
+        self.datasets_service.shutdown()
+
+    def test_datasets_are_indexed_in_shards(self):
+        dataset_ids = [self.datasets_service.create_dataset(f'dataset {i}') for i in range(40)]
+        self.assertEqual(set(self.indices.get_all_dataset_ids()), set(dataset_ids))
+
+        shards = [self.indices.get_index(shard_id) for shard_id in DatasetIndexShard.all_ids()
+                  if len(list(self.indices.events.get(shard_id))) > 0]
+        self.assertGreater(len(shards), 1)
+
+    def test_deletions_compact_the_index(self):
+        dataset_ids = [self.datasets_service.create_dataset(f'dataset {i}') for i in range(3)]
+        self.datasets_service.delete(dataset_ids[0].hex)
+        self.assertEqual(set(self.indices.get_all_dataset_ids()), set(dataset_ids[1:]))
+
+        shard_id = DatasetIndexShard.create_id(DatasetIndexShard.shard_for(dataset_ids[0]))
+        snapshot = next(self.indices.snapshots.get(shard_id, desc=True, limit=1))
+        self.assertNotIn(dataset_ids[0], snapshot.state['datasets'])
+
+    def test_shards_snapshotted_concurrently_are_compacted(self):
+        dataset_ids = [self.datasets_service.create_dataset(f'dataset {i}') for i in range(2)]
+        take_snapshot = self.indices.take_snapshot
+
+        def snapshot_twice(aggregate_id, version=None):
+            # another process snapshots the shard at the same version first
+            take_snapshot(aggregate_id, version)
+            take_snapshot(aggregate_id, version)
+
+        with patch.object(self.indices, 'take_snapshot', side_effect=snapshot_twice) as snapshot:
+            self.datasets_service.delete(dataset_ids[0].hex)
+        self.assertTrue(snapshot.called)
+        self.assertEqual(set(self.indices.get_all_dataset_ids()), set(dataset_ids[1:]))
+
+        self.datasets_service.delete(dataset_ids[1].hex)
+        self.assertEqual(self.indices.get_all_dataset_ids(), [])
+
+    def test_legacy_index_is_migrated(self):
+        legacy_dataset_id = self.datasets_service.create_dataset('legacy dataset')
+        deleted_dataset_id = self.datasets_service.create_dataset('deleted dataset')
+        self.datasets_service.delete(deleted_dataset_id.hex)
+        dataset_id = self.datasets_service.create_dataset('dataset')
+
+        # datasets created before the shards existed are only listed by the unsharded index
+        shard = self.indices.repository.get(DatasetIndexShard.create_id(DatasetIndexShard.shard_for(legacy_dataset_id)))
+        shard.remove_dataset_from_index(legacy_dataset_id)
+        self.indices.save(shard)
+        legacy_index = DatasetIndex.get()
+        for legacy_id in (legacy_dataset_id, deleted_dataset_id, uuid4()):
+            legacy_index.add_dataset_to_index(legacy_id)
+        self.indices.save(legacy_index)
+
+        # deleted and missing datasets are not copied
+        self.assertEqual(self.datasets_service.migrate_dataset_index(), 1)
+        self.assertEqual(set(self.indices.get_all_dataset_ids()), {legacy_dataset_id, dataset_id})
+        self.assertEqual(self.datasets_service.migrate_dataset_index(), 0)
@@ -1,59 +1,160 @@
+import json
 from unittest import TestCase
 from uuid import uuid4
 
+from eventsourcing.domain import Snapshot
+from eventsourcing.persistence import Mapper, JSONTranscoder, UUIDAsHex, DatetimeAsISO, StoredEvent
+
 from domain.dataset import Dataset
+from domain.documents import DocumentCollection, DocumentIdArray, document_id
 from domain.index import ByDocumentIndex
 
 
 class TestDatasetAggregate(TestCase):
     def test_dataset_can_be_managed(self):
-        dataset = Dataset.create()
+        dataset = Dataset.create('dataset', 'description')
         self.assertEqual(dataset.version, 1)
-        self.assertEqual(dataset.train_validate_documents, [])
+        self.assertEqual(dataset.train_validate_documents.to_list(), [])
 
-        dataset.add_document('1')
+        dataset.add_train_documents([1])
         self.assertEqual(dataset.version, 2)
-        self.assertEqual(dataset.train_validate_documents, ['1'])
+        self.assertEqual(dataset.train_validate_documents.to_list(), [1])
 
-        dataset.add_document('2')
+        dataset.add_train_documents([2])
         self.assertEqual(dataset.version, 3)
-        self.assertEqual(dataset.train_validate_documents, ['1', '2'])
+        self.assertEqual(dataset.train_validate_documents.to_list(), [1, 2])
 
-        dataset.remove_document('1')
+        dataset.remove_train_documents([1])
         self.assertEqual(dataset.version, 4)
-        self.assertEqual(dataset.train_validate_documents, ['2'])
+        self.assertEqual(dataset.train_validate_documents.to_list(), [2])
 
-        dataset.remove_document('3')
-        self.assertEqual(dataset.version, 5)
-        self.assertEqual(dataset.train_validate_documents, ['2'])
+        # removing documents, that are not part of the dataset, records nothing
+        dataset.remove_train_documents([3])
+        self.assertEqual(dataset.version, 4)
+        self.assertEqual(dataset.train_validate_documents.to_list(), [2])
 
     def test_index_can_be_updated(self):
         for_document = 'document1'
 
         index = ByDocumentIndex.create(for_document)
         self.assertEqual(index.version, 1)
-        self.assertEqual(index.datasets, [])
+        self.assertEqual(index.datasets, set())
 
         # add document to index, used in dataset 'dataset1'
         dataset_1_id = uuid4()
         index.add_dataset_to_index(dataset_1_id)
         self.assertEqual(index.version, 2)
-        self.assertEqual(index.datasets, [dataset_1_id])
+        self.assertEqual(index.datasets, {dataset_1_id})
 
         dataset_2_id = uuid4()
         index.add_dataset_to_index(dataset_2_id)
         self.assertEqual(index.version, 3)
-        self.assertEqual(index.datasets, [dataset_1_id, dataset_2_id])
+        self.assertEqual(index.datasets, {dataset_1_id, dataset_2_id})
 
         index.remove_dataset_from_index(dataset_1_id)
         self.assertEqual(index.version, 4)
-        self.assertEqual(index.datasets, [dataset_2_id])
+        self.assertEqual(index.datasets, {dataset_2_id})
 
         index.remove_dataset_from_index(uuid4())
         self.assertEqual(index.version, 5)
-        self.assertEqual(index.datasets, [dataset_2_id])
+        self.assertEqual(index.datasets, {dataset_2_id})
 
         irrelevant_index = ByDocumentIndex.create('document2')
         # make sure creating another index doesn't affect this one
         self.assertEqual(index.version, 5)
-        self.assertEqual(index.datasets, [dataset_2_id])
+        self.assertEqual(index.datasets, {dataset_2_id})
+
+
+class TestDocumentCollection(TestCase):
+    def test_documents_keep_their_order(self):
+        documents = DocumentCollection(['3', '1', '2'])
+        documents.add_all(['4', '1'])
+        self.assertEqual(documents, ['3', '1', '2', '4'])
+
+        documents.remove_all(['1', '5'])
+        self.assertEqual(documents, ['3', '2', '4'])
+        self.assertIn('2', documents)
+        self.assertNotIn('1', documents)
+        self.assertEqual(len(documents), 3)
+
+    def test_copies_are_independent(self):
+        documents = DocumentCollection(['1', '2'])
+        copy = documents.copy()
+        copy.remove_all(['1'])
+        self.assertEqual(documents, ['1', '2'])
+        self.assertEqual(copy, ['2'])
+
+
+class TestDatasetDocuments(TestCase):
+    def test_documents_can_be_added_and_removed(self):
+        dataset = Dataset.create('dataset', 'description')
+        dataset.add_train_documents([1, 2, 3])
+        dataset.add_test_documents([4, 5])
+
+        dataset.remove_train_documents([1, 3, 4])
+        dataset.remove_test_documents([5])
+        self.assertEqual(dataset.train_validate_documents, [2])
+        self.assertEqual(dataset.test_documents, [4])
+
+    def test_only_changed_documents_are_recorded(self):
+        dataset = Dataset.create('dataset', 'description')
+        dataset.add_train_documents([1, 2, 1])
+        dataset.add_train_documents([2, 3])
+        dataset.add_train_documents([3])
+        dataset.remove_train_documents([4])
+        events = dataset.collect_events()
+
+        self.assertEqual([e.document_ids for e in events[1:]], [[1, 2], [3]])
+
+    def test_version_1_snapshots_are_upcast(self):
+        dataset = Dataset.create('dataset', 'description')
+        snapshot = Snapshot.take(dataset)
+        state = dict(snapshot.state)
+        state.pop('class_version')
+        state['train_validate_documents'] = ['http://documents.org/1', 'http://documents.org/2']
+        state['test_documents'] = []
+        legacy_snapshot = Snapshot(originator_id=snapshot.originator_id, originator_version=snapshot.originator_version,
+                                   timestamp=snapshot.timestamp, topic=snapshot.topic, state=state)
+
+        restored = legacy_snapshot.mutate()
+        restored.remove_train_documents([document_id('http://documents.org/1')])
+        self.assertEqual(restored.train_validate_documents, [document_id('http://documents.org/2')])
+        self.assertIsInstance(restored.test_documents, DocumentIdArray)
+
+    def test_version_1_events_are_upcast(self):
+        mapper = Mapper(JSONTranscoder())
+        mapper.transcoder.register(UUIDAsHex())
+        mapper.transcoder.register(DatetimeAsISO())
+        dataset = Dataset.create('dataset', 'description')
+        dataset.add_train_documents([1])
+        stored_event = mapper.from_domain_event(dataset.collect_events()[1])
+        state = json.loads(stored_event.state)
+        state.pop('class_version')
+        state['document_ids'] = ['http://documents.org/1']
+        legacy_event = StoredEvent(stored_event.originator_id, stored_event.originator_version,
+                                   stored_event.topic, json.dumps(state).encode('utf-8'))
+
+        self.assertEqual(mapper.to_domain_event(legacy_event).document_ids, [document_id('http://documents.org/1')])
+
+
+class TestDocumentIdArray(TestCase):
+    def test_ids_are_kept_in_order_without_duplicates(self):
+        documents = DocumentIdArray([3, 1, 3])
+        documents.add_all([2, 1, -5])
+        self.assertEqual(documents, [3, 1, 2, -5])
+        self.assertIn(-5, documents)
+        self.assertNotIn(4, documents)
+
+        documents.remove_all([1, 4])
+        self.assertEqual(documents, [3, 2, -5])
+        self.assertEqual(documents.missing([4, 2, 4]), [4])
+        self.assertEqual(documents.existing([4, 2, 2]), [2])
+        self.assertEqual(documents.difference([2]), [3, -5])
+
+    def test_copies_are_independent(self):
+        documents = DocumentIdArray([1, 2])
+        copy = documents.copy()
+        copy.add_all([3])
+        copy.remove_all([1])
+        self.assertEqual(documents, [1, 2])
+        self.assertEqual(copy, [2, 3])
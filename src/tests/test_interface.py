@@ -0,0 +1,139 @@
+from threading import Thread
+from unittest import TestCase
+
+from interface import runners
+from interface.service import DatasetsService
+
+
+class TestDatasetsService(TestCase):
+    def setUp(self):
+        self.datasets_service = DatasetsService()
+
+    def tearDown(self):
+        self.datasets_service.shutdown()
+
+    def test_datasets_are_paginated(self):
+        dataset_ids = sorted(
+            [self.datasets_service.create_dataset(f'dataset {i}') for i in range(5)],
+            key=lambda dataset_id: dataset_id.hex
+        )
+
+        first_page = self.datasets_service.get_all_datasets(limit=2)
+        self.assertEqual([d.id for d in first_page], dataset_ids[:2])
+
+        second_page = self.datasets_service.get_all_datasets(limit=2, after=first_page[-1].id.hex)
+        self.assertEqual([d.id for d in second_page], dataset_ids[2:4])
+
+        last_page = self.datasets_service.get_all_datasets(limit=2, after=second_page[-1].id.hex)
+        self.assertEqual([d.id for d in last_page], dataset_ids[4:])
+
+        self.assertEqual([d.id for d in self.datasets_service.get_all_datasets()], dataset_ids)
+
+    def test_datasets_are_loaded_in_chunks(self):
+        dataset_ids = [self.datasets_service.create_dataset(f'dataset {i}') for i in range(5)]
+        self.datasets_service.BULK_LOAD_SIZE = 2
+
+        chunks = list(self.datasets_service.iter_datasets(self.datasets_service.get_dataset_ids()))
+
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual({d.id for chunk in chunks for d in chunk}, set(dataset_ids))
+
+    def test_summaries_are_projected_from_dataset_events(self):
+        dataset_id = self.datasets_service.create_dataset('dataset', 'description')
+        self.datasets_service.add_train_documents_to_dataset(dataset_id.hex, ['1', '2', '3'])
+        self.datasets_service.add_test_documents_to_dataset(dataset_id.hex, ['4'])
+        self.datasets_service.remove_documents_from_all_datasets(['1', '4', '5'])
+        self.datasets_service.update_meta(dataset_id.hex, 'new name', 'new description')
+        deleted_dataset_id = self.datasets_service.create_dataset('deleted dataset')
+        self.datasets_service.delete(deleted_dataset_id.hex)
+
+        summaries = [s for chunk in self.datasets_service.iter_summaries([dataset_id, deleted_dataset_id])
+                     for s in chunk]
+
+        self.assertEqual(len(summaries), 1)
+        self.assertEqual(summaries[0].dataset_id, dataset_id)
+        self.assertEqual(summaries[0].name, 'new name')
+        self.assertEqual((summaries[0].num_train_documents, summaries[0].num_test_documents), (2, 0))
+
+    def test_datasets_can_be_changed_concurrently(self):
+        def create_datasets():
+            for i in range(10):
+                dataset_id = self.datasets_service.create_dataset(f'dataset {i}')
+                self.datasets_service.add_train_documents_to_dataset(dataset_id.hex, [f'http://documents/{i}'])
+
+        threads = [Thread(target=create_datasets) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.datasets_service.get_all_datasets()), 40)
+
+    def test_bulk_loaded_datasets_are_up_to_date(self):
+        dataset_id = self.datasets_service.create_dataset('dataset')
+        # cache the dataset, then change it
+        self.datasets_service.get_dataset(dataset_id.hex)
+        self.datasets_service.add_train_documents_to_dataset(dataset_id.hex, ['http://documents/1'])
+        other_dataset_id = self.datasets_service.create_dataset('other dataset')
+        self.datasets_service.add_test_documents_to_dataset(other_dataset_id.hex, ['http://documents/2'])
+
+        datasets = {d.id: d for d in self.datasets_service.get_all_datasets()}
+        document_urls = self.datasets_service.get_document_urls
+        self.assertEqual(document_urls(datasets[dataset_id].train_validate_documents), ['http://documents/1'])
+        self.assertEqual(document_urls(datasets[other_dataset_id].test_documents), ['http://documents/2'])
+
+    def test_mappings_are_shared_between_requests(self):
+        dataset_id = self.datasets_service.create_dataset('dataset')
+        mapping_id = self.datasets_service.create_mapping('mapping', 'description', ['alias'], ['task'])
+        self.datasets_service.update_mappings(dataset_id.hex, [mapping_id.hex])
+
+        dataset = self.datasets_service.get_dataset(dataset_id.hex)
+        self.assertEqual([m.name for m in self.datasets_service.get_mappings_for_dataset(dataset)], ['mapping'])
+        self.assertEqual([[m.id for m in mappings] for mappings in
+                          self.datasets_service.get_mappings_for_datasets([dataset, dataset])],
+                         [[mapping_id], [mapping_id]])
+
+    def test_documents_are_removed_with_one_event_per_dataset(self):
+        dataset_id = self.datasets_service.create_dataset('dataset')
+        self.datasets_service.add_train_documents_to_dataset(dataset_id.hex, ['1', '2', '3'])
+        self.datasets_service.add_test_documents_to_dataset(dataset_id.hex, ['4'])
+        other_dataset_id = self.datasets_service.create_dataset('other dataset')
+        self.datasets_service.add_test_documents_to_dataset(other_dataset_id.hex, ['1', '5'])
+        untouched_dataset_id = self.datasets_service.create_dataset('untouched dataset')
+        self.datasets_service.add_train_documents_to_dataset(untouched_dataset_id.hex, ['6'])
+
+        versions = {d.id: d.version for d in self.datasets_service.get_all_datasets()}
+        self.datasets_service.remove_documents_from_all_datasets(['1', '3', '4', '7'])
+
+        datasets = {d.id: d for d in self.datasets_service.get_all_datasets()}
+        document_urls = self.datasets_service.get_document_urls
+        self.assertEqual(document_urls(datasets[dataset_id].train_validate_documents), ['2'])
+        self.assertEqual(len(datasets[dataset_id].test_documents), 0)
+        self.assertEqual(datasets[dataset_id].version, versions[dataset_id] + 2)
+        self.assertEqual(document_urls(datasets[other_dataset_id].test_documents), ['5'])
+        self.assertEqual(datasets[other_dataset_id].version, versions[other_dataset_id] + 1)
+        self.assertEqual(datasets[untouched_dataset_id].version, versions[untouched_dataset_id])
+
+
+class TestAsynchronousProjections(TestCase):
+    def setUp(self):
+        self.datasets_service = DatasetsService(projections_mode=runners.THREAD)
+
+    def tearDown(self):
+        self.datasets_service.shutdown()
+
+    def test_projections_can_be_waited_for(self):
+        dataset_id = self.datasets_service.create_dataset('dataset')
+        self.datasets_service.add_train_documents_to_dataset(dataset_id.hex, ['1', '2'])
+
+        self.assertTrue(self.datasets_service.wait_for_projections())
+        self.assertEqual([d.id for d in self.datasets_service.get_all_datasets()], [dataset_id])
+
+        self.datasets_service.remove_documents_from_all_datasets(['1'])
+        dataset = self.datasets_service.get_dataset(dataset_id.hex)
+        self.assertEqual(self.datasets_service.get_document_urls(dataset.train_validate_documents), ['2'])
+
+    def test_waiting_for_projections_times_out(self):
+        self.datasets_service.create_dataset('dataset')
+        position = self.datasets_service.position()
+        self.assertFalse(self.datasets_service.wait_for_projections(position + 1, timeout=0.05))
@@ -0,0 +1,146 @@
+import json
+from typing import List
+from unittest import TestCase
+from unittest.mock import patch
+
+from eventsourcing.persistence import IntegrityError
+from pika.spec import Basic, BasicProperties
+
+from dispatcher import MessageDispatcher
+from interface.service import DatasetsService
+from messages.listener import AMQPListener, Message
+from messages.local import LocalChannel, LocalAMQPListener
+
+
+class FakeChannel:
+    def __init__(self, deliveries: List):
+        self.deliveries = deliveries
+        self.acks = []
+        self.nacks = []
+
+    def consume(self, queue: str, inactivity_timeout: float):
+        yield from self.deliveries
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False):
+        self.acks.append((delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag: int, multiple: bool = False, requeue: bool = True):
+        self.nacks.append((delivery_tag, multiple, requeue))
+
+
+def deleted_message(delivery_tag: int, document_id: str) -> Message:
+    deliver = Basic.Deliver(delivery_tag=delivery_tag, routing_key='document.event.deleted')
+    return deliver, BasicProperties(), json.dumps({'id': document_id}).encode('utf-8')
+
+
+class TestAMQPListener(TestCase):
+    def test_messages_are_batched(self):
+        batches = []
+        listener = AMQPListener('localhost', 5672, 'user', 'pass', lambda channel, batch: batches.append(batch),
+                                batch_size=2, batch_timeout_ms=60 * 1000)
+        messages = [deleted_message(i, str(i)) for i in range(1, 4)]
+        # the broker reports inactivity with an empty delivery
+        channel = FakeChannel([*messages, (None, None, None)])
+
+        listener._consume(channel)
+
+        self.assertEqual(batches, [messages[:2], messages[2:]])
+
+    def test_failed_batches_are_requeued(self):
+        batches = []
+
+        def on_messages(channel, batch):
+            if len(batches) == 0:
+                batches.append(None)
+                raise RuntimeError('failed')
+            batches.append(batch)
+
+        listener = AMQPListener('localhost', 5672, 'user', 'pass', on_messages, batch_size=1, min_reconnect_delay=0)
+        messages = [deleted_message(i, str(i)) for i in range(1, 3)]
+        channel = FakeChannel(messages)
+
+        listener._consume(channel)
+
+        self.assertEqual(channel.nacks, [(1, True, True)])
+        self.assertEqual(batches, [None, messages[1:]])
+
+
+class TestMessageDispatcher(TestCase):
+    def setUp(self):
+        self.datasets_service = DatasetsService()
+        self.dispatcher = MessageDispatcher(self.datasets_service)
+
+    def tearDown(self):
+        self.datasets_service.shutdown()
+
+    def test_batch_is_dispatched_and_acknowledged_at_once(self):
+        dataset_id = self.datasets_service.create_dataset('dataset')
+        self.datasets_service.add_train_documents_to_dataset(dataset_id.hex, ['1', '2', '3'])
+        version = self.datasets_service.get_dataset(dataset_id.hex).version
+
+        channel = FakeChannel([])
+        malformed = (Basic.Deliver(delivery_tag=3, routing_key='document.event.deleted'), BasicProperties(), b'{}')
+        self.dispatcher.dispatch_batch(channel, [deleted_message(1, '1'), deleted_message(2, '3'), malformed])
+
+        dataset = self.datasets_service.get_dataset(dataset_id.hex)
+        self.assertEqual(self.datasets_service.get_document_urls(dataset.train_validate_documents), ['2'])
+        self.assertEqual(dataset.version, version + 1)
+        self.assertEqual(channel.acks, [(3, True)])
+
+
+    def test_malformed_messages_are_skipped(self):
+        dataset_id = self.datasets_service.create_dataset('dataset')
+        self.datasets_service.add_train_documents_to_dataset(dataset_id.hex, ['1', '2'])
+
+        channel = FakeChannel([])
+        deliver = Basic.Deliver(delivery_tag=4, routing_key='document.event.deleted')
+        malformed = [(deliver, BasicProperties(), body) for body in [b'[]', b'"1"', b'{"id": 1}']]
+        self.dispatcher.dispatch_batch(channel, [deleted_message(1, '1'), *malformed])
+
+        dataset = self.datasets_service.get_dataset(dataset_id.hex)
+        self.assertEqual(self.datasets_service.get_document_urls(dataset.train_validate_documents), ['2'])
+        self.assertEqual(channel.acks, [(4, True)])
+
+    def test_batch_is_requeued_if_the_service_fails(self):
+        listener = AMQPListener('localhost', 5672, 'user', 'pass', self.dispatcher.dispatch_batch,
+                                batch_size=2, min_reconnect_delay=0)
+        channel = FakeChannel([deleted_message(1, '1'), deleted_message(2, '2')])
+
+        with patch.object(self.datasets_service, 'remove_documents_from_all_datasets', side_effect=IntegrityError()):
+            listener._consume(channel)
+
+        self.assertEqual(channel.acks, [])
+        self.assertEqual(channel.nacks, [(2, True, True)])
+
+
+class TestLocalAMQPListener(TestCase):
+    def test_published_messages_are_dispatched_and_acknowledged(self):
+        datasets_service = DatasetsService()
+        dataset_id = datasets_service.create_dataset('dataset')
+        datasets_service.add_train_documents_to_dataset(dataset_id.hex, ['1', '2', '3'])
+
+        channel = LocalChannel()
+        listener = LocalAMQPListener(channel, MessageDispatcher(datasets_service).dispatch_batch,
+                                     batch_size=2, batch_timeout_ms=10)
+        listener.start()
+        for document_id in ['1', '3', '4']:
+            channel.publish('document.event.deleted', json.dumps({'id': document_id}).encode('utf-8'))
+
+        self.assertTrue(channel.wait_until_acknowledged(timeout=5))
+        listener.stop()
+        listener.join()
+        self.assertEqual(len(channel.acknowledgement_seconds), 3)
+        dataset = datasets_service.get_dataset(dataset_id.hex)
+        self.assertEqual(datasets_service.get_document_urls(dataset.train_validate_documents), ['2'])
+        datasets_service.shutdown()
+
+    def test_rejected_messages_are_redelivered(self):
+        channel = LocalChannel()
+        delivery_tag = channel.publish('document.event.deleted', b'{"id": "1"}')
+        deliveries = channel.consume('queue', inactivity_timeout=0.01)
+
+        self.assertEqual(next(deliveries)[0].delivery_tag, delivery_tag)
+        channel.basic_nack(delivery_tag, multiple=True)
+        self.assertEqual(next(deliveries)[0].delivery_tag, delivery_tag)
+        channel.basic_ack(delivery_tag)
+        self.assertTrue(channel.wait_until_acknowledged(timeout=0))
@@ -0,0 +1,103 @@
+import time
+from threading import Thread
+from unittest import TestCase
+
+from domain.dataset import Dataset
+from util.cache import LRUCache
+from util.datasplitter import SplitCache, split_data, compute_split
+
+
+class TestLRUCache(TestCase):
+    def test_concurrent_misses_are_computed_once(self):
+        cache = LRUCache(4)
+        computations = []
+
+        def compute():
+            computations.append(1)
+            time.sleep(0.05)
+            return 'value'
+
+        results = []
+        threads = [Thread(target=lambda: results.append(cache.get_or_compute('key', compute))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(computations), 1)
+        self.assertEqual(results, ['value'] * 8)
+
+
+class TestDataSplitter(TestCase):
+    def setUp(self):
+        self.dataset = Dataset.create('dataset', '')
+        self.dataset.add_train_documents(list(range(7)))
+        self.dataset.add_test_documents([100])
+
+    def test_k_fold_split_has_contiguous_validation_folds(self):
+        folds, test = split_data(self.dataset, num_folds=3)
+        self.assertEqual([f['valid'] for f in folds], [[0, 1, 2], [3, 4], [5, 6]])
+        self.assertEqual(folds[1]['train'], [0, 1, 2, 5, 6])
+        self.assertEqual(test, [100])
+
+    def test_single_document_folds_are_lists(self):
+        folds, _ = split_data(self.dataset, num_folds=7)
+        self.assertEqual(folds[0]['valid'], [0])
+
+    def test_validation_split_takes_last_documents(self):
+        folds, _ = split_data(self.dataset, validate_split=0.3)
+        self.assertEqual(folds, [{'train': [0, 1, 2, 3], 'valid': [4, 5, 6]}])
+
+    def test_seeded_test_split_is_deterministic(self):
+        split = compute_split(100, num_folds=4, test_split=0.2, seed='seed')
+        self.assertEqual(split.test_indices().tolist(),
+                         compute_split(100, num_folds=4, test_split=0.2, seed='seed').test_indices().tolist())
+        self.assertEqual(len(split.test_indices()), 20)
+        train, valid = split.fold_indices(0)
+        self.assertEqual(sorted(train.tolist() + valid.tolist() + split.test_indices().tolist()), list(range(100)))
+
+    def test_validation_folds_are_given_per_document(self):
+        split = compute_split(7, num_folds=3)
+        self.assertEqual(split.validation_folds().tolist(), [0, 0, 0, 1, 1, 2, 2])
+
+        split = compute_split(10, test_split=0.2, validate_split=0.5, seed='seed')
+        validation_folds = split.validation_folds()
+        self.assertEqual((validation_folds == 0).sum(), 4)
+        self.assertTrue((validation_folds[split.test_indices()] == -1).all())
+
+    def test_too_many_folds_are_rejected(self):
+        with self.assertRaises(ValueError):
+            split_data(self.dataset, num_folds=8)
+
+
+class TestSplitCache(TestCase):
+    def setUp(self):
+        self.dataset = Dataset.create('dataset', '')
+        self.dataset.add_train_documents(list(range(20)))
+        self.dataset.collect_events()
+
+    def test_splits_are_cached_per_parameters(self):
+        cache = SplitCache(8)
+        split = cache.get_split(self.dataset, 5, 0.2, None, 'seed')
+        self.assertIs(cache.get_split(self.dataset, 5, 0.2, None, 'seed'), split)
+        documents = self.dataset.train_validate_documents.to_list()
+        self.assertEqual(split.gather(documents, []), split_data(self.dataset, 5, 0.2, None, 'seed'))
+        self.assertIsNot(cache.get_split(self.dataset, 5, 0.2, None, 'other seed'), split)
+        self.assertEqual(len(cache), 2)
+
+    def test_unseeded_random_splits_are_not_cached(self):
+        cache = SplitCache(8)
+        cache.get_split(self.dataset, None, 0.2)
+        self.assertEqual(len(cache), 0)
+
+    def test_splits_of_older_versions_are_dropped(self):
+        cache = SplitCache(8)
+        cache.get_split(self.dataset, 5)
+        cache.get_split(self.dataset, 4)
+
+        self.dataset.remove_train_documents([0])
+        self.dataset.collect_events()
+        folds, _ = cache.get_split(self.dataset, 5).gather(self.dataset.train_validate_documents.to_list(), [])
+
+        self.assertEqual(len(cache), 1)
+        self.assertNotIn(0, [d for fold in folds for d in fold['train'] + fold['valid']])
@@ -1,55 +1,158 @@
-import random
+import hashlib
+from typing import Dict, List, Tuple, Optional, Sequence, TypeVar
 
 import numpy
-from sklearn.model_selection import KFold
 
 from domain.dataset import Dataset
+from util.cache import LRUCache
 
+# documents are gathered as they are given, e.g. as ids or as urls
+T = TypeVar('T')
+Folds = List[Dict[str, List[T]]]
 
-def split_data(dataset: Dataset, num_folds: int = None, test_split: float = None,
-               validate_split: float = None, seed: str = None):
-    _train_data = dataset.train_validate_documents.copy()
-    _test_data = dataset.test_documents.copy()
 
-    # if a random seed is given use it to make splitting deterministic
-    if seed is not None:
-        random.seed(seed)
+def _rng(seed: Optional[str]) -> numpy.random.Generator:
+    if seed is None:
+        return numpy.random.default_rng()
+    # derive a stable integer seed, python's hash of strings is randomized per process
+    digest = hashlib.sha256(seed.encode('utf-8')).digest()
+    return numpy.random.default_rng(int.from_bytes(digest[:8], 'little'))
 
-    # if a test split ratio is given create a random test set
-    if test_split is not None:
-        random.shuffle(_train_data)
-        split_idx = int((1 - test_split) * len(_train_data))
-        _train_data, _test_data = _train_data[:split_idx], _train_data[split_idx:]
 
-    # if a number of folds is given create the folds
-    if num_folds is not None:
-        _train_data = numpy.array(_train_data)
-        _train_data = numpy.expand_dims(_train_data, axis=1)
+class DatasetSplit:
+    """
+    Split of the train documents of a dataset into folds (and optionally test documents), kept
+    as positions into the list of train documents. The documents themselves are only gathered
+    by :meth:`gather`, so a split is small compared to the documents and can be shared.
+
+    ``order[:test_start]`` are the positions of train documents used for folds, the validation
+    documents of each fold are a contiguous range of them. ``order[test_start:]`` are the positions
+    of train documents split off as test documents, if a test split was requested.
+    """
+
+    def __init__(self, order: numpy.ndarray, test_start: int, fold_bounds: List[Tuple[int, int]],
+                 has_validation: bool, has_test_split: bool):
+        self.order = order
+        self.test_start = test_start
+        self.fold_bounds = fold_bounds
+        self.has_validation = has_validation
+        self.has_test_split = has_test_split
+
+    @property
+    def num_folds(self) -> int:
+        return len(self.fold_bounds)
+
+    def fold_indices(self, fold: int) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        start, end = self.fold_bounds[fold]
+        train = numpy.concatenate([self.order[:start], self.order[end:self.test_start]])
+        return train, self.order[start:end]
+
+    def test_indices(self) -> numpy.ndarray:
+        return self.order[self.test_start:]
+
+    def validation_folds(self) -> numpy.ndarray:
+        """
+        :return: for each train document the fold it is a validation document of, -1 if it is
+                 a train document in all folds or split off as test document
+        """
+        validation_folds = numpy.full(len(self.order), -1, dtype=numpy.int32)
+        if self.has_validation:
+            for i, (start, end) in enumerate(self.fold_bounds):
+                validation_folds[self.order[start:end]] = i
+        return validation_folds
+
+    def gather(self, documents: Sequence[T], test_documents: Sequence[T]) -> Tuple[Folds, List[T]]:
+        """
+        Gathers the documents of this split from the documents of the dataset it was computed for.
+
+        :param documents: the train documents of the dataset
+        :param test_documents: the predefined test documents of the dataset
+        :return: the folds with their train (and validation) documents and the test documents
+        """
+        def take(indices: numpy.ndarray) -> List[T]:
+            return [documents[i] for i in indices.tolist()]
 
         folds = []
-        kf = KFold(num_folds)
-        for i, (train_indices, validation_indices) in enumerate(kf.split(_train_data)):
-            train_samples, validation_samples = _train_data[train_indices], _train_data[validation_indices]
-            train_samples, validation_samples = numpy.squeeze(train_samples), numpy.squeeze(validation_samples)
-            train_samples, validation_samples = train_samples.tolist(), validation_samples.tolist()
-            folds.append({
-                'train': train_samples,
-                'valid': validation_samples
-            })
-        return folds, _test_data
+        for i in range(self.num_folds):
+            train, valid = self.fold_indices(i)
+            fold = {'train': take(train)}
+            if self.has_validation:
+                fold['valid'] = take(valid)
+            folds.append(fold)
+
+        if self.has_test_split:
+            return folds, take(self.test_indices())
+        return folds, list(test_documents)
+
+
+def compute_split(num_documents: int, num_folds: int = None, test_split: float = None,
+                  validate_split: float = None, seed: str = None) -> DatasetSplit:
+    """
+    Splits the positions of ``num_documents`` train documents. If a test split ratio is given, a random
+    part of them is split off as test documents first. Then the remaining documents are either split
+    into ``num_folds`` folds of contiguous validation documents (like an unshuffled k-fold split), or
+    the last ``validate_split`` part of them becomes the validation documents of a single fold.
+    """
+    if test_split is not None:
+        order = _rng(seed).permutation(num_documents)
+        test_start = int((1 - test_split) * num_documents)
+    else:
+        order = numpy.arange(num_documents)
+        test_start = num_documents
+
+    if num_folds is not None:
+        if num_folds < 2:
+            raise ValueError(f'Need at least 2 folds for a k-fold split, got {num_folds}.')
+        if num_folds > test_start:
+            raise ValueError(f'Can not split {test_start} documents into {num_folds} folds.')
+        # the first (num_documents % num_folds) folds get one more validation document
+        fold_sizes = numpy.full(num_folds, test_start // num_folds)
+        fold_sizes[:test_start % num_folds] += 1
+        ends = numpy.cumsum(fold_sizes).tolist()
+        fold_bounds = list(zip([0] + ends[:-1], ends))
+        return DatasetSplit(order, test_start, fold_bounds, True, test_split is not None)
 
     # if no k-fold splitting is requested then return a single "fold" containing all training data
     # and an optional validation data if validation ratio is given
     if validate_split is not None:
-        split_idx = int((1 - validate_split) * len(_train_data))
-        _train_data, _valid_data = _train_data[:split_idx], _train_data[split_idx:]
-        fold = {
-            'train': _train_data,
-            'valid': _valid_data
-        }
-    else:
-        fold = {
-            'train': _train_data
-        }
+        valid_start = int((1 - validate_split) * test_start)
+        return DatasetSplit(order, test_start, [(valid_start, test_start)], True, test_split is not None)
+    return DatasetSplit(order, test_start, [(test_start, test_start)], False, test_split is not None)
+
+
+def split_dataset(dataset: Dataset, num_folds: int = None, test_split: float = None,
+                  validate_split: float = None, seed: str = None) -> DatasetSplit:
+    return compute_split(len(dataset.train_validate_documents), num_folds, test_split, validate_split, seed)
+
+
+def split_data(dataset: Dataset, num_folds: int = None, test_split: float = None,
+               validate_split: float = None, seed: str = None) -> Tuple[Folds, List[int]]:
+    split = split_dataset(dataset, num_folds, test_split, validate_split, seed)
+    return split.gather(dataset.train_validate_documents.to_list(), dataset.test_documents.to_list())
+
+
+class SplitCache(LRUCache):
+    """
+    Caches splits of datasets by dataset version and split parameters. Cached splits
+    are shared between readers and must not be changed. Splits of older versions of
+    a dataset are dropped, as soon as a newer version of it is split.
+    """
+
+    def get_split(self, dataset: Dataset, num_folds: int = None, test_split: float = None,
+                  validate_split: float = None, seed: str = None) -> DatasetSplit:
+        if test_split is not None and seed is None:
+            # randomly split on every request, so never cache these
+            return split_dataset(dataset, num_folds, test_split, validate_split, seed)
+
+        def compute() -> DatasetSplit:
+            self._invalidate_older_versions(dataset)
+            return split_dataset(dataset, num_folds, test_split, validate_split, seed)
+
+        key = (dataset.id, dataset.version, num_folds, test_split, validate_split, seed)
+        return self.get_or_compute(key, compute)
 
-    return [fold], _test_data
+    def _invalidate_older_versions(self, dataset: Dataset) -> None:
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if key[0] == dataset.id and key[1] < dataset.version:
+                    self.invalidate(key)
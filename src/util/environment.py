@@ -0,0 +1,20 @@
+import os
+
+from util import logwrapper
+
+
+def configure_event_store():
+    # event sourcing configuration
+    os.environ["INFRASTRUCTURE_FACTORY"] = "eventsourcing.postgres:Factory"
+    os.environ["POSTGRES_DBNAME"] = os.environ["GNUMA_DB_NAME"]
+    os.environ["POSTGRES_HOST"] = os.environ["GNUMA_DB_HOST"]
+    os.environ["POSTGRES_PORT"] = os.environ["GNUMA_DB_PORT"]
+    os.environ["POSTGRES_USER"] = os.environ["GNUMA_DB_USER"]
+    os.environ["POSTGRES_PASSWORD"] = os.environ["GNUMA_DB_PASS"]
+    os.environ["POSTGRES_CONN_MAX_AGE"] = "10"
+    os.environ["POSTGRES_PRE_PING"] = "y"
+    os.environ["POSTGRES_LOCK_TIMEOUT"] = "5"
+    os.environ["POSTGRES_IDLE_IN_TRANSACTION_SESSION_TIMEOUT"] = "5"
+
+    logwrapper.info(f'Will connect to database {os.environ["POSTGRES_DBNAME"]} '
+                    f'at postgres://{os.environ["POSTGRES_HOST"]}:{os.environ["POSTGRES_PORT"]}')
@@ -0,0 +1,15 @@
+import os
+
+from api.app import create_app
+from interface.service import DatasetsService
+from util.environment import configure_event_store
+
+# api workers of several processes must not process the dataset events concurrently,
+# so by default they leave that to a separate projector.py process
+os.environ.setdefault('PROJECTIONS_MODE', 'process')
+
+# every worker process imports this module after being forked, so each
+# one gets a service of its own with its own database connections
+configure_event_store()
+datasets_service = DatasetsService()
+app = create_app(datasets_service)